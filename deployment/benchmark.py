@@ -0,0 +1,373 @@
+"""
+Inference benchmark suite.
+
+Generates synthetic videos locally, then times the preprocessing stages,
+each encoder of MultimodalSentimentModel and end-to-end predict_fn across
+batch sizes and thread counts. Results are written as JSON; pass
+--compare to flag regressions against a stored baseline.
+
+    python benchmark.py --output results.json
+    python benchmark.py --compare baseline.json --tolerance 0.1
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import torch
+
+from synthetic_media import generate_video, SyntheticTranscriber
+from clip_config import parse_clip_geometry, clip_geometry_name
+
+
+def parse_int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--resolution', type=str, default='640x360')
+    parser.add_argument('--fps', type=int, default=25)
+    parser.add_argument('--utterances', type=parse_int_list, default=[1, 4])
+    parser.add_argument('--batch_sizes', type=parse_int_list, default=[1, 4, 8])
+    parser.add_argument('--threads', type=parse_int_list,
+                        default=[1, max(1, torch.get_num_threads())])
+    parser.add_argument('--geometries', type=str, default='30x224x224,16x112x112',
+                        help='Comma separated clip geometries (FRAMESxHEIGHTxWIDTH or preset)')
+    parser.add_argument('--samplings', type=str, default='head,uniform,motion',
+                        help='Frame sampling strategies timed by the process_video benchmark')
+    parser.add_argument('--decoders', type=str, default='opencv,ffmpeg',
+                        help='Frame decoders timed by the process_video benchmark')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--suites', type=str, default='preprocess,encoders,e2e',
+                        help='Comma separated subset of: preprocess, encoders, e2e, '
+                             'transcription (downloads the Whisper weights)')
+    parser.add_argument('--transcription_profiles', type=str, default='accurate,fast,fastest',
+                        help='Speed profiles timed by the transcription suite')
+    parser.add_argument('--model_dir', type=str, default=None,
+                        help='Load weights with model_fn instead of using a freshly initialised model')
+    parser.add_argument('--output', type=str, default='benchmark_results.json')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Baseline results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed relative slowdown of the median before flagging')
+    parser.add_argument('--min_delta_ms', type=float, default=0.5,
+                        help='Ignore slowdowns smaller than this (timer noise)')
+    return parser.parse_args(argv)
+
+
+def measure(fn, warmup=1, repeat=5):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'median_ms': statistics.median(timings),
+        'mean_ms': statistics.fmean(timings),
+        'min_ms': timings[0],
+        'p90_ms': timings[min(len(timings) - 1, int(round(0.9 * (len(timings) - 1))))],
+        'stdev_ms': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'runs': len(timings)
+    }
+
+
+class BenchmarkRunner:
+    def __init__(self, warmup, repeat, batch_sizes):
+        self.warmup = warmup
+        self.repeat = repeat
+        self.batch_sizes = batch_sizes
+        self.results = {}
+
+    def run(self, name, fn, **params):
+        """Time fn and store it under a key that encodes its parameters"""
+        key = name + ''.join(f'[{k}={v}]' for k, v in sorted(params.items()))
+        stats = measure(fn, self.warmup, self.repeat)
+        self.results[key] = {'benchmark': name, 'params': params, **stats}
+        print(f"{key:70s} median {stats['median_ms']:10.2f} ms  p90 {stats['p90_ms']:10.2f} ms")
+        return stats
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        commit = None
+    return {
+        'python': sys.version.split()[0],
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'cuda': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        'git_commit': commit
+    }
+
+
+def build_model_dict(args, device):
+    from transformers import AutoTokenizer
+
+    if args.model_dir:
+        from inference import model_fn
+        model_dict = model_fn(args.model_dir)
+    else:
+        from models import MultimodalSentimentModel
+        model = MultimodalSentimentModel().to(device)
+        model.eval()
+        model_dict = {
+            'model': model,
+            'tokenizer': AutoTokenizer.from_pretrained('bert-base-uncased'),
+            'device': device
+        }
+    return model_dict
+
+
+def cut_segment(video_path, start_time, end_time, temp_dir):
+    """Legacy baseline: the per-utterance ffmpeg cut (re-encoded to a new
+    file) that predict_fn ran before it decoded each time range straight
+    from the source video"""
+    with tempfile.NamedTemporaryFile(dir=temp_dir, prefix=f"segment_{start_time}_{end_time}_",
+                                     suffix=".mp4", delete=False) as segment_file:
+        segment_path = segment_file.name
+
+    subprocess.run([
+        "ffmpeg", "-i", video_path,
+        "-ss", str(start_time),
+        "-to", str(end_time),
+        "-c:v", "libx264",
+        "-c:a", "aac",
+        "-y",
+        segment_path
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    if not os.path.exists(segment_path) or os.path.getsize(segment_path) == 0:
+        raise ValueError("Segment extraction failed: " + segment_path)
+    return segment_path
+
+
+def bench_preprocess(runner, videos, model_dict, clip_configs, samplings, decoders):
+    from inference import VideoUtteranceProcessor, VideoProcessor
+
+    processor = VideoUtteranceProcessor()
+    tokenizer = model_dict['tokenizer']
+    video = videos[max(videos)]
+    segment = video['segments'][0]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        segment_path = cut_segment(video['path'], segment['start'], segment['end'], tmp_dir)
+
+        # The old cut-then-decode path, against the *_range stages below
+        runner.run('extract_segment', lambda: cut_segment(
+            video['path'], segment['start'], segment['end'], tmp_dir))
+        for clip_config in clip_configs:
+            for sampling in samplings:
+                for decoder in decoders:
+                    video_processor = VideoProcessor(
+                        dict(clip_config, sampling=sampling, decoder=decoder))
+                    runner.run('process_video',
+                               lambda: video_processor.process_video(segment_path),
+                               geometry=clip_geometry_name(clip_config), sampling=sampling,
+                               decoder=decoder)
+                    # What predict_fn does: decode the range from the source, no segment cut
+                    runner.run('process_video_range',
+                               lambda: video_processor.process_video(
+                                   video['path'], segment['start'], segment['end']),
+                               geometry=clip_geometry_name(clip_config), sampling=sampling,
+                               decoder=decoder)
+        runner.run('extract_features',
+                   lambda: processor.audio_processor.extract_features(segment_path))
+        runner.run('extract_features_range',
+                   lambda: processor.audio_processor.extract_features(
+                       video['path'], start_time=segment['start'], end_time=segment['end']))
+
+    texts = [s['text'] for s in video['segments']]
+    for batch_size in runner.batch_sizes:
+        batch = (texts * batch_size)[:batch_size]
+        runner.run('tokenization', lambda: tokenizer(
+            batch, padding="max_length", truncation=True,
+            max_length=128, return_tensors="pt"), batch_size=batch_size)
+
+
+# Dynamic padding: MELD utterances are mostly under 32 tokens
+SHORT_TOKENS = 32
+
+
+def encoder_inputs(batch_size, device):
+    return {
+        'text': {'input_ids': torch.randint(1000, 2000, (batch_size, 128), device=device),
+                 'attention_mask': torch.ones(batch_size, 128, dtype=torch.long, device=device)},
+        'audio': torch.randn(batch_size, 1, 64, 300, device=device)
+    }
+
+
+def video_input(batch_size, clip_config, device):
+    return torch.rand(batch_size, clip_config['num_frames'], 3,
+                      clip_config['height'], clip_config['width'], device=device)
+
+
+def bench_encoders(runner, model_dict, threads, clip_configs):
+    model = model_dict['model']
+    device = model_dict['device']
+
+    def heads(features):
+        fused = model.fusion_layer(features)
+        return model.emotion_classifier(fused), model.sentiment_classifier(fused)
+
+    for num_threads in threads:
+        torch.set_num_threads(num_threads)
+        for batch_size in runner.batch_sizes:
+            inputs = encoder_inputs(batch_size, device)
+            fused_inputs = torch.randn(batch_size, 128 * 3, device=device)
+            params = {'batch_size': batch_size, 'threads': num_threads}
+
+            with torch.inference_mode():
+                runner.run('text_encoder', lambda: model.text_encoder(
+                    inputs['text']['input_ids'], inputs['text']['attention_mask']), **params)
+                # Dynamically padded batch at a typical MELD utterance length
+                short_ids = inputs['text']['input_ids'][:, :SHORT_TOKENS]
+                runner.run('text_encoder', lambda: model.text_encoder(
+                    short_ids, torch.ones_like(short_ids)), tokens=SHORT_TOKENS, **params)
+                runner.run('audio_encoder', lambda: model.audio_encoder(inputs['audio']), **params)
+                runner.run('fusion_heads', lambda: heads(fused_inputs), **params)
+
+                for clip_config in clip_configs:
+                    video = video_input(batch_size, clip_config, device)
+                    geometry = clip_geometry_name(clip_config)
+                    runner.run('video_encoder', lambda: model.video_encoder(video),
+                               geometry=geometry, **params)
+                    runner.run('model_forward', lambda: model(
+                        inputs['text'], video, inputs['audio']), geometry=geometry, **params)
+                    # Same forward with the three encoders on concurrent threads
+                    model.enable_parallel_encoders(num_threads)
+                    try:
+                        runner.run('model_forward', lambda: model(
+                            inputs['text'], video, inputs['audio']),
+                            geometry=geometry, parallel=True, **params)
+                    finally:
+                        model.disable_parallel_encoders()
+
+
+def bench_e2e(runner, videos, model_dict, threads, clip_configs):
+    from inference import predict_fn
+    from instrumentation import pop_trace
+
+    def run_predict(video, **options):
+        prediction = predict_fn({'video_path': video['path'], **options}, model_dict)
+        pop_trace(prediction['request_id']).finish(trace_dir=None)
+        return prediction
+
+    for num_threads in threads:
+        torch.set_num_threads(num_threads)
+        for clip_config in clip_configs:
+            model_dict['clip_config'] = clip_config
+            for utterances, video in sorted(videos.items()):
+                model_dict['transcriber'] = SyntheticTranscriber(video['segments'])
+                runner.run('predict_fn', lambda: run_predict(video),
+                           utterances=utterances, threads=num_threads,
+                           geometry=clip_geometry_name(clip_config))
+                # Every transcribed segment scored on its own
+                runner.run('predict_fn', lambda: run_predict(video, segmentation=False),
+                           utterances=utterances, threads=num_threads,
+                           geometry=clip_geometry_name(clip_config), segmentation='off')
+
+
+def bench_transcription(runner, videos, profiles, device):
+    from transcription import Transcriber, TranscriptCache
+
+    for profile in profiles:
+        transcriber = Transcriber(profile, device=device)
+        cached = Transcriber(profile, device=device, cache=TranscriptCache(cache_dir=None))
+        for utterances, video in sorted(videos.items()):
+            params = {'profile': profile, 'utterances': utterances}
+            runner.run('transcribe', lambda: transcriber.transcribe(video['path']), **params)
+            # Warm-up fills the cache: only decode + hash + lookup is timed
+            runner.run('transcribe', lambda: cached.transcribe(video['path']), cached=True, **params)
+
+
+def compare_results(current, baseline, tolerance, min_delta_ms):
+    """Return (regressions, improvements) comparing medians of shared benchmarks"""
+    regressions, improvements = [], []
+    for key, result in current['results'].items():
+        base = baseline.get('results', {}).get(key)
+        if base is None:
+            continue
+        ratio = result['median_ms'] / base['median_ms'] if base['median_ms'] else float('inf')
+        delta = result['median_ms'] - base['median_ms']
+        entry = {'benchmark': key, 'baseline_ms': base['median_ms'],
+                 'current_ms': result['median_ms'], 'ratio': ratio}
+        if ratio > 1 + tolerance and delta > min_delta_ms:
+            regressions.append(entry)
+        elif ratio < 1 - tolerance and -delta > min_delta_ms:
+            improvements.append(entry)
+    return regressions, improvements
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    torch.manual_seed(args.seed)
+    width, height = (int(v) for v in args.resolution.lower().split('x'))
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    suites = set(args.suites.split(','))
+    clip_configs = [parse_clip_geometry(g) for g in args.geometries.split(',')]
+
+    runner = BenchmarkRunner(args.warmup, args.repeat, args.batch_sizes)
+    model_dict = build_model_dict(args, device)
+
+    with tempfile.TemporaryDirectory() as media_dir:
+        videos = {}
+        for utterances in args.utterances:
+            path = os.path.join(media_dir, f"synthetic_{utterances}.mp4")
+            videos[utterances] = generate_video(
+                path, duration=args.duration, width=width, height=height,
+                fps=args.fps, utterances=utterances, seed=args.seed)
+
+        if 'preprocess' in suites:
+            bench_preprocess(runner, videos, model_dict, clip_configs,
+                             args.samplings.split(','), args.decoders.split(','))
+        if 'encoders' in suites:
+            bench_encoders(runner, model_dict, args.threads, clip_configs)
+        if 'e2e' in suites:
+            bench_e2e(runner, videos, model_dict, args.threads, clip_configs)
+        if 'transcription' in suites:
+            bench_transcription(runner, videos, args.transcription_profiles.split(','), device)
+
+    output = {
+        'environment': environment_info(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'results': runner.results
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions, improvements = compare_results(
+            output, baseline, args.tolerance, args.min_delta_ms)
+        for entry in improvements:
+            print(f"✅ {entry['benchmark']}: {entry['baseline_ms']:.2f} -> {entry['current_ms']:.2f} ms ({entry['ratio']:.2f}x)")
+        for entry in regressions:
+            print(f"❌ {entry['benchmark']}: {entry['baseline_ms']:.2f} -> {entry['current_ms']:.2f} ms ({entry['ratio']:.2f}x)")
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+Bulk inference over a manifest of videos.
+
+    python bulk.py --manifest videos.jsonl --output results.jsonl --workers 4
+
+Each manifest line is a JSON string (an s3:// URI or a local path) or an
+object with "video_path" and optional "id", "duration" and request
+options ("timeline", "segmentation", ...). The model is loaded once and
+shared copy-on-write by a pool of forked workers; jobs are dispatched
+shortest first by probed duration. Every result is appended to the output
+JSON Lines file as soon as it finishes, so an interrupted run picks up
+where it stopped when started again with the same output.
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from inference import EXECUTOR_MAX_BATCH, fetch_video, model_fn, predict_fn
+from instrumentation import pop_trace, start_trace
+from media_decoder import probe_video
+from model_executor import ModelExecutor
+from s3_transfer import presigned_url
+from streaming import JsonlFileSink
+
+# Set before the pool forks, so workers inherit the model instead of loading it
+_BULK_CONTEXT = {}
+
+
+def load_manifest(path):
+    """Jobs ({id, video_path, duration, options}) from a JSON Lines manifest"""
+    jobs, ids = [], set()
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                entry = {'video_path': entry}
+            if not isinstance(entry, dict) or 'video_path' not in entry:
+                raise ValueError(f"{path}:{number}: expected a path or an object with video_path")
+            if entry.get('sharded'):
+                # Workers are daemonic pool processes, which cannot start a shard pool
+                raise ValueError(f"{path}:{number}: \"sharded\" is not supported in bulk runs, "
+                                 f"which already process videos in parallel")
+            options = dict(entry)
+            job_id = str(options.pop('id', entry['video_path']))
+            if job_id in ids:
+                raise ValueError(f"{path}:{number}: duplicate job id {job_id}")
+            ids.add(job_id)
+            jobs.append({'id': job_id, 'video_path': options.pop('video_path'),
+                         'duration': options.pop('duration', None), 'options': options})
+    return jobs
+
+
+def probe_duration(video_path):
+    """Duration from the container header; S3 objects are probed through a
+    presigned URL, which reads only the header ranges"""
+    if video_path.startswith('s3://'):
+        video_path = presigned_url(video_path, expires_in=600)
+    return probe_video(video_path)['duration']
+
+
+def probe_durations(jobs, threads=8):
+    """Fill in missing job durations (None when probing fails)"""
+
+    def probe(job):
+        if job['duration'] is None:
+            try:
+                job['duration'] = probe_duration(job['video_path'])
+            except Exception as e:
+                print(f"Could not probe {job['video_path']}: {e}")
+        return job
+
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(probe, jobs))
+
+
+def shortest_first(jobs):
+    """Short videos first; unprobed ones last, in manifest order"""
+    return sorted(jobs, key=lambda j: math.inf if j['duration'] is None else j['duration'])
+
+
+def finished_ids(output_path, retry_failed=True):
+    """Ids already in the output file. A line cut short by an interruption
+    is ignored; failed jobs are run again unless retry_failed is off."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('status') == 'ok' or not retry_failed:
+                done.add(record['id'])
+    return done
+
+
+def _init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+
+def run_job(job):
+    """Download (for S3) and predict one video; returns its result record"""
+    model_dict = _BULK_CONTEXT['model_dict']
+    request_id = f"bulk-{os.getpid()}-{time.time_ns()}"
+    record = {'id': job['id'], 'video_path': job['video_path'], 'duration': job['duration'],
+              'worker': os.getpid()}
+    start = time.perf_counter()
+    try:
+        input_data = {**job['options'], 'video_path': job['video_path'], 'request_id': request_id}
+        if job['video_path'].startswith('s3://'):
+            # The download is released (or deleted) when the trace finishes
+            input_data = fetch_video(input_data, start_trace(request_id))
+        elif not os.path.exists(job['video_path']):
+            raise FileNotFoundError(f"Video not found: {job['video_path']}")
+        prediction = predict_fn(input_data, model_dict)
+        pop_trace(request_id).finish()
+        prediction.pop('request_id', None)
+        record.update(status='ok', prediction=prediction)
+    except Exception as e:
+        trace = pop_trace(request_id)
+        if trace is not None:
+            trace.finish(status='error')
+        record.update(status='failed', error=str(e))
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+def throughput_summary(records, wall_seconds, skipped):
+    ok = [r for r in records if r['status'] == 'ok']
+    video_seconds = sum(r['duration'] or 0.0 for r in ok)
+    workers = {}
+    for r in records:
+        workers[r['worker']] = workers.get(r['worker'], 0) + 1
+    return {
+        'videos': len(records),
+        'ok': len(ok),
+        'failed': len(records) - len(ok),
+        'skipped': skipped,
+        'wall_s': wall_seconds,
+        'video_s': video_seconds,
+        'videos_per_hour': len(ok) * 3600.0 / wall_seconds if wall_seconds > 0 else 0.0,
+        # Seconds of video processed per second of wall time
+        'realtime_factor': video_seconds / wall_seconds if wall_seconds > 0 else 0.0,
+        'mean_job_s': sum(r['seconds'] for r in records) / len(records) if records else 0.0,
+        'jobs_per_worker': list(workers.values())
+    }
+
+
+def run_bulk(jobs, model_dict, output_path, workers=1, retry_failed=True):
+    """Run the jobs not yet finished in output_path; returns the summary.
+
+    CUDA models cannot be shared with forked workers, so they run the jobs
+    in this process.
+    """
+    done = finished_ids(output_path, retry_failed)
+    pending = shortest_first([j for j in jobs if j['id'] not in done])
+    if model_dict['device'].type != 'cpu':
+        workers = 1
+    workers = max(1, min(workers, len(pending) or 1))
+    print(f"{len(pending)} videos to process ({len(jobs) - len(pending)} already done), "
+          f"{workers} worker(s)")
+
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, 'rb+') as f:
+            # Start after a line an interruption cut short
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    sink = JsonlFileSink(output_path, append=True)
+    progress = {'status': 'running', 'total': len(jobs), 'done': len(jobs) - len(pending),
+                'failed': 0, 'updated_at': time.time()}
+    sink.mark(progress)
+    records = []
+    start = time.perf_counter()
+    _BULK_CONTEXT['model_dict'] = model_dict
+
+    def record(result):
+        sink.write([result])
+        records.append(result)
+        progress['done'] += 1
+        progress['failed'] += result['status'] != 'ok'
+        progress['updated_at'] = time.time()
+        sink.mark(progress)
+        print(f"[{progress['done']}/{len(jobs)}] {result['id']}: {result['status']} "
+              f"in {result['seconds']:.1f}s")
+
+    try:
+        if workers == 1:
+            for job in pending:
+                record(run_job(job))
+        else:
+            threads = max(1, torch.get_num_threads() // workers)
+            # The workers tokenize too; the fast tokenizer's thread pool does not survive a fork
+            os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+            # Nor does the executor's thread: a worker runs one job at a time
+            # and calls the model directly
+            executor = model_dict.get('executor')
+            if executor is not None:
+                executor.close()
+                model_dict['executor'] = None
+            try:
+                with multiprocessing.get_context('fork').Pool(
+                        workers, initializer=_init_worker, initargs=(threads,)) as pool:
+                    # chunksize=1 keeps dispatch in shortest-first order
+                    for result in pool.imap_unordered(run_job, pending, chunksize=1):
+                        record(result)
+            finally:
+                if executor is not None:
+                    model_dict['executor'] = ModelExecutor(EXECUTOR_MAX_BATCH)
+        progress['status'] = 'done'
+    except KeyboardInterrupt:
+        progress['status'] = 'interrupted'
+        print("Interrupted, run again with the same --output to resume")
+    finally:
+        _BULK_CONTEXT.clear()
+        progress['summary'] = throughput_summary(
+            records, time.perf_counter() - start, len(jobs) - len(pending))
+        sink.mark(progress)
+        sink.close()
+    return progress['summary']
+
+
+def str2bool(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument('--manifest', type=str, required=True)
+    parser.add_argument('--output', type=str, default='bulk_results.jsonl')
+    parser.add_argument('--model_dir', type=str, default='model')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--probe_threads', type=int, default=8)
+    parser.add_argument('--retry_failed', type=str2bool, default=True,
+                        help='Run videos that failed in a previous run again')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    jobs = probe_durations(load_manifest(args.manifest), args.probe_threads)
+    model_dict = model_fn(args.model_dir)
+    summary = run_bulk(jobs, model_dict, args.output, args.workers, args.retry_failed)
+    print(json.dumps(summary, indent=2))
+    print(f"Results in {args.output}, progress and summary in {args.output}.progress.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Caller-supplied transcripts: segment lists and SRT / WebVTT caption files.
+
+When a request carries its own timed text, predict_fn scores these
+segments directly and Whisper does not run.
+"""
+
+import os
+import re
+
+CAPTION_EXTENSIONS = ('.srt', '.vtt')
+
+# [hh:]mm:ss,mmm (SRT) or [hh:]mm:ss.mmm (WebVTT)
+_TIMESTAMP = re.compile(r'(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})')
+# Inline markup: <i>, <c.yellow>, <00:01.000>, {\an8}
+_MARKUP = re.compile(r'<[^>]*>|\{[^}]*\}')
+
+
+def parse_timestamp(value):
+    match = _TIMESTAMP.fullmatch(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid caption timestamp: {value!r}")
+    hours, minutes, seconds, millis = match.groups()
+    return (int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+            + int(millis.ljust(3, '0')) / 1000)
+
+
+def parse_captions(text):
+    """Segments from SRT or WebVTT text. Cue numbers and identifiers, the
+    WEBVTT header, NOTE/STYLE blocks and cue settings are ignored."""
+    text = text.lstrip('\ufeff').replace('\r\n', '\n').replace('\r', '\n')
+    segments = []
+    for block in re.split(r'\n\s*\n', text):
+        lines = [line.strip() for line in block.strip().split('\n')]
+        for i, line in enumerate(lines):
+            if '-->' not in line:
+                continue
+            start, end = line.split('-->', 1)
+            # WebVTT cue settings follow the end time
+            end = end.split()[0] if end.split() else end
+            caption = ' '.join(_MARKUP.sub('', l).strip() for l in lines[i + 1:] if l)
+            if caption:
+                segments.append({'start': parse_timestamp(start),
+                                 'end': parse_timestamp(end),
+                                 'text': caption})
+            break
+    return normalize_segments(segments)
+
+
+def load_captions(path):
+    with open(path, encoding='utf-8-sig', errors='replace') as f:
+        return parse_captions(f.read())
+
+
+def normalize_segments(segments):
+    """Validated copy of a caller's segments ({start, end, text}, seconds),
+    in time order; segments with no duration are dropped"""
+    normalized = []
+    for i, segment in enumerate(segments):
+        try:
+            start = float(segment['start'])
+            end = float(segment['end'])
+            text = str(segment['text']).strip()
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Segment {i} needs numeric start/end and text: {e}")
+        if end > start >= 0:
+            normalized.append({'start': start, 'end': end, 'text': text})
+    return sorted(normalized, key=lambda s: (s['start'], s['end']))
+
+
+def find_sidecar(video_path):
+    """An .srt / .vtt file next to the video with the same base name"""
+    base = os.path.splitext(video_path)[0]
+    for extension in CAPTION_EXTENSIONS:
+        if os.path.exists(base + extension):
+            return base + extension
+    return None
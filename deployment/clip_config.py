@@ -0,0 +1,75 @@
+# Video clip geometry shared by the dataset, the model and inference. It is
+# saved in the checkpoint so preprocessing at inference time always matches
+# what the model was trained on.
+
+# Checkpoints without a recorded sampling strategy were trained on the first
+# frames of each clip, so 'head' stays the default; train.py picks 'uniform'
+DEFAULT_CLIP_CONFIG = {
+    'num_frames': 30,
+    'height': 224,
+    'width': 224,
+    'sampling': 'head',
+    'frame_stride': 2,
+    'decoder': 'opencv'
+}
+
+SAMPLING_STRATEGIES = ('head', 'uniform', 'stride', 'motion')
+
+# opencv: cv2 decode + per-frame cv2.resize (what older checkpoints used)
+# ffmpeg: selection, scaling and pixel format conversion inside ffmpeg, raw
+#         frames piped straight into a numpy buffer (media_decoder.py)
+FRAME_DECODERS = ('opencv', 'ffmpeg')
+
+# r3d_18 was pretrained on Kinetics at 16x112x112, ~7x cheaper than the default
+CLIP_PRESETS = {
+    'default': DEFAULT_CLIP_CONFIG,
+    'r3d_native': {'num_frames': 16, 'height': 112, 'width': 112, 'sampling': 'uniform'},
+    'r3d_native_long': {'num_frames': 32, 'height': 112, 'width': 112, 'sampling': 'uniform'}
+}
+
+
+def make_clip_config(clip_config=None, **overrides):
+    """Complete a (possibly partial) clip config with the defaults"""
+    config = dict(DEFAULT_CLIP_CONFIG)
+    if clip_config:
+        config.update(clip_config)
+    config.update({k: v for k, v in overrides.items() if v is not None})
+    for key in ('num_frames', 'height', 'width', 'frame_stride'):
+        config[key] = int(config[key])
+        if config[key] <= 0:
+            raise ValueError(f"Invalid clip {key}: {config[key]}")
+    if config['sampling'] not in SAMPLING_STRATEGIES:
+        raise ValueError(
+            f"Invalid frame sampling {config['sampling']}, expected one of {SAMPLING_STRATEGIES}")
+    if config['decoder'] not in FRAME_DECODERS:
+        raise ValueError(
+            f"Invalid frame decoder {config['decoder']}, expected one of {FRAME_DECODERS}")
+    return config
+
+
+def parse_clip_geometry(value, sampling=None, decoder=None):
+    """'16x112x112' (frames x height x width) or a preset name -> clip config"""
+    if value in CLIP_PRESETS:
+        return make_clip_config(CLIP_PRESETS[value], sampling=sampling, decoder=decoder)
+    try:
+        num_frames, height, width = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise ValueError(
+            f"Clip geometry must be FRAMESxHEIGHTxWIDTH or one of {list(CLIP_PRESETS)}: {value}")
+    return make_clip_config(num_frames=num_frames, height=height, width=width,
+                            sampling=sampling, decoder=decoder)
+
+
+def clip_geometry_name(clip_config):
+    return f"{clip_config['num_frames']}x{clip_config['height']}x{clip_config['width']}"
+
+
+def clip_config_name(clip_config):
+    return f"{clip_geometry_name(clip_config)}/{clip_config['sampling']}"
+
+
+def clip_config_from_checkpoint(checkpoint):
+    """Checkpoints saved before the geometry was configurable used the default"""
+    if isinstance(checkpoint, dict) and 'clip_config' in checkpoint:
+        return make_clip_config(checkpoint['clip_config'])
+    return make_clip_config()
@@ -0,0 +1,104 @@
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+import torch
+
+# The frozen BERT's pooler output is a pure function of the token ids (in eval
+# mode), so it is cached per utterance: repeated short lines ("Yeah.",
+# "Okay.") skip BERT entirely. Entries are 768 float32 (3 KB); evicted
+# entries optionally spill to disk and survive restarts.
+
+
+def token_key(token_ids):
+    """Stable key for an unpadded sequence of token ids"""
+    return hashlib.blake2b(np.asarray(token_ids, dtype=np.int64).tobytes(),
+                           digest_size=16).hexdigest()
+
+
+def weights_fingerprint(module):
+    """Short hash of a module's weights, so a spill dir is never shared by
+    encoders that would produce different embeddings"""
+    digest = hashlib.blake2b(digest_size=8)
+    for name, tensor in sorted(module.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+class TextEmbeddingCache:
+    def __init__(self, max_items=8192, spill_dir=None, max_spill_items=100000):
+        self.max_items = max_items
+        self.spill_dir = spill_dir
+        self.max_spill_items = max_spill_items
+        self.entries = OrderedDict()
+        self.spilled = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def bind(self, namespace):
+        """Scope the spill dir to one encoder (see weights_fingerprint) and
+        index what earlier runs left there"""
+        if self.spill_dir is None:
+            return
+        self.spill_dir = os.path.join(self.spill_dir, namespace)
+        os.makedirs(self.spill_dir, exist_ok=True)
+        files = sorted(os.scandir(self.spill_dir), key=lambda e: e.stat().st_mtime)
+        for entry in files:
+            if entry.name.endswith('.npy'):
+                self.spilled[entry.name[:-4]] = None
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if key in self.spilled:
+            try:
+                value = torch.from_numpy(np.load(os.path.join(self.spill_dir, f'{key}.npy')))
+            except (OSError, ValueError):
+                del self.spilled[key]
+            else:
+                self.disk_hits += 1
+                self._store(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._store(key, value.detach().to('cpu', torch.float32))
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_items:
+            old_key, old_value = self.entries.popitem(last=False)
+            self._spill(old_key, old_value)
+
+    def _spill(self, key, value):
+        if self.spill_dir is None or key in self.spilled:
+            return
+        path = os.path.join(self.spill_dir, f'{key}.npy')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, value.numpy())
+        os.replace(tmp_path, path)
+        self.spilled[key] = None
+        while len(self.spilled) > self.max_spill_items:
+            old_key, _ = self.spilled.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.spill_dir, f'{old_key}.npy'))
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+            'spilled': len(self.spilled)
+        }
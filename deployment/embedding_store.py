@@ -0,0 +1,311 @@
+"""
+Columnar store of per-utterance embeddings.
+
+    python embedding_store.py search --store embeddings --video ep1.mp4 --at 12.5
+    python embedding_store.py rescore --store embeddings --model_path model/model.pth
+
+Each utterance scored with "store_embeddings" keeps its text, video and
+audio encoder outputs (128 each) and its fused features (256), keyed by
+video id and time range. Every column is a flat float16 file read through
+np.memmap, so a store of millions of utterances is searched (cosine top-k,
+in chunks) and re-scored with new fusion / classifier heads without
+decoding any video or loading any encoder.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+from models import FusionHeads
+
+EMBEDDING_STORE_DIR = os.environ.get('INFERENCE_EMBEDDING_STORE_DIR', 'embeddings')
+
+# name -> (width, dtype); a width of 0 is a scalar column
+COLUMNS = {
+    'text': (128, np.float16),
+    'video': (128, np.float16),
+    'audio': (128, np.float16),
+    'fused': (256, np.float16),
+    'start': (0, np.float32),
+    'end': (0, np.float32),
+    'video_index': (0, np.int32)
+}
+FEATURE_COLUMNS = ('text', 'video', 'audio', 'fused')
+
+# Names of stores under EMBEDDING_STORE_DIR that requests may write to
+STORE_NAME = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+# Rows per chunk when scanning the store
+SCAN_ROWS = 65536
+
+
+class EmbeddingStore:
+    """Append-only columns of utterance embeddings in one directory.
+
+    meta.json holds the committed row count and the video ids; a row is
+    visible once meta.json is rewritten, so a writer that dies mid-append
+    leaves bytes past the end that the next append truncates. Appends take
+    an exclusive file lock and may come from several processes.
+    """
+
+    def __init__(self, directory=EMBEDDING_STORE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.rows = 0
+        self.video_ids = []
+        self._video_lookup = {}
+        self._mtime = None
+        self._maps = {}
+        os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    def _path(self, name):
+        return os.path.join(self.directory, f'{name}.bin')
+
+    def refresh(self):
+        """Pick up rows appended by other processes"""
+        path = os.path.join(self.directory, 'meta.json')
+        if not os.path.exists(path):
+            return
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with open(path) as f:
+            meta = json.load(f)
+        self._mtime = mtime
+        self.rows = meta['rows']
+        self.video_ids = meta['video_ids']
+        self._video_lookup = {v: i for i, v in enumerate(self.video_ids)}
+        self._maps = {}
+
+    def _write_meta(self):
+        path = os.path.join(self.directory, 'meta.json')
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'rows': self.rows, 'video_ids': self.video_ids,
+                       'columns': {name: [width, np.dtype(dtype).name]
+                                   for name, (width, dtype) in COLUMNS.items()}}, f)
+        os.replace(tmp, path)
+
+    @contextmanager
+    def _write_lock(self):
+        with self.lock, open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append(self, video_id, starts, ends, features):
+        """Add one video's utterances. features maps each of FEATURE_COLUMNS
+        to an array (or tensor) with one row per utterance."""
+        starts = np.asarray(starts, dtype=np.float32).reshape(-1)
+        count = len(starts)
+        if count == 0:
+            return
+        values = {'start': starts, 'end': np.asarray(ends, dtype=np.float32).reshape(-1)}
+        for name in FEATURE_COLUMNS:
+            array = features[name]
+            if isinstance(array, torch.Tensor):
+                array = array.detach().float().cpu().numpy()
+            width, dtype = COLUMNS[name]
+            values[name] = np.asarray(array, dtype=dtype).reshape(count, width)
+
+        with self._write_lock():
+            if video_id not in self._video_lookup:
+                self._video_lookup[video_id] = len(self.video_ids)
+                self.video_ids.append(video_id)
+            values['video_index'] = np.full(count, self._video_lookup[video_id], dtype=np.int32)
+            for name, (width, dtype) in COLUMNS.items():
+                row_bytes = max(width, 1) * np.dtype(dtype).itemsize
+                with open(self._path(name), 'ab') as f:
+                    # Drop whatever an interrupted append left past the last committed row
+                    f.truncate(self.rows * row_bytes)
+                    f.write(np.ascontiguousarray(values[name], dtype=dtype).tobytes())
+            self.rows += count
+            self._write_meta()
+            self._maps = {}
+
+    def column(self, name):
+        """A read-only memmap of one column over the committed rows"""
+        if self.rows == 0:
+            width, dtype = COLUMNS[name]
+            return np.empty((0, width) if width else 0, dtype=dtype)
+        if name not in self._maps:
+            width, dtype = COLUMNS[name]
+            self._maps[name] = np.memmap(self._path(name), dtype=dtype, mode='r',
+                                         shape=(self.rows, width) if width else (self.rows,))
+        return self._maps[name]
+
+    def find(self, video_id, time):
+        """Row of the utterance of video_id covering (or nearest to) time"""
+        self.refresh()
+        if video_id not in self._video_lookup:
+            raise KeyError(f"No utterances stored for {video_id}")
+        rows = np.flatnonzero(self.column('video_index') == self._video_lookup[video_id])
+        starts, ends = self.column('start')[rows], self.column('end')[rows]
+        distance = np.maximum(starts - time, 0) + np.maximum(time - ends, 0)
+        return int(rows[np.argmin(distance)])
+
+    def describe(self, row):
+        return {'row': int(row),
+                'video_id': self.video_ids[self.column('video_index')[row]],
+                'start': float(self.column('start')[row]),
+                'end': float(self.column('end')[row])}
+
+    def search(self, query, k=10, column='fused', exclude_video=None):
+        """The k rows most cosine-similar to query, best first.
+
+        The column is scanned in chunks of SCAN_ROWS: one matrix product and
+        an argpartition per chunk, merged into a running top k.
+        """
+        self.refresh()
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        data = self.column(column)
+        video_index = self.column('video_index')
+        excluded = self._video_lookup.get(exclude_video, -1)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+
+        for begin in range(0, len(data), SCAN_ROWS):
+            chunk = np.asarray(data[begin:begin + SCAN_ROWS], dtype=np.float32)
+            norms = np.linalg.norm(chunk, axis=1)
+            scores = chunk @ query / np.maximum(norms, 1e-12)
+            if excluded >= 0:
+                scores[video_index[begin:begin + SCAN_ROWS] == excluded] = -np.inf
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+            else:
+                top = np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, top + begin])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k)[:k]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        order = np.argsort(-best_scores)
+        return [{**self.describe(row), 'score': float(score)}
+                for row, score in zip(best_rows[order], best_scores[order])
+                if np.isfinite(score)]
+
+    def similar(self, row, k=10, column='fused', same_video=False):
+        """Utterances like a stored one (other videos only unless same_video)"""
+        exclude = None if same_video else self.describe(row)['video_id']
+        results = self.search(self.column(column)[row], k + 1, column, exclude)
+        return [r for r in results if r['row'] != row][:k]
+
+    @torch.inference_mode()
+    def rescore(self, heads, batch_size=SCAN_ROWS, device='cpu'):
+        """Emotion and sentiment probabilities for every stored utterance.
+
+        heads is a FusionHeads (or a full MultimodalSentimentModel), run on
+        the stored encoder outputs, or any module mapping fused features to
+        {'emotions', 'sentiments'} logits, run on the stored fused features.
+        """
+        self.refresh()
+        heads = heads.to(device).eval()
+        per_modality = hasattr(heads, 'classify')
+        emotions, sentiments = [], []
+        for begin in range(0, self.column('start').shape[0], batch_size):
+            def load(name):
+                chunk = np.asarray(self.column(name)[begin:begin + batch_size], dtype=np.float32)
+                return torch.from_numpy(chunk).to(device)
+
+            if per_modality:
+                outputs = heads.classify(load('text'), load('video'), load('audio'))
+            else:
+                outputs = heads(load('fused'))
+            emotions.append(torch.softmax(outputs['emotions'].float(), dim=1).cpu().numpy())
+            sentiments.append(torch.softmax(outputs['sentiments'].float(), dim=1).cpu().numpy())
+        if not emotions:
+            return {'emotions': np.empty((0, 7), np.float32), 'sentiments': np.empty((0, 3), np.float32)}
+        return {'emotions': np.concatenate(emotions), 'sentiments': np.concatenate(sentiments)}
+
+    def stats(self):
+        self.refresh()
+        size = sum(os.path.getsize(self._path(name)) for name in COLUMNS
+                   if os.path.exists(self._path(name)))
+        return {'rows': self.rows, 'videos': len(self.video_ids), 'bytes': size}
+
+
+def store_directory(option, base=EMBEDDING_STORE_DIR):
+    """The store a request's "store_embeddings" names: true is the store in
+    base, a plain name (letters, digits, _ and -) a store under base"""
+    if option is True:
+        return base
+    if isinstance(option, str) and STORE_NAME.fullmatch(option):
+        return os.path.join(base, option)
+    raise ValueError(f"store_embeddings must be true or a store name, got {option!r}")
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_embedding_store(directory=EMBEDDING_STORE_DIR):
+    """One EmbeddingStore per directory per process"""
+    with _STORES_LOCK:
+        if directory not in _STORES:
+            _STORES[directory] = EmbeddingStore(directory)
+        return _STORES[directory]
+
+
+def load_heads(model_path):
+    """FusionHeads with the weights of a MultimodalSentimentModel checkpoint"""
+    checkpoint = torch.load(model_path, map_location='cpu')
+    state_dict = checkpoint.get('model_state_dict', checkpoint)
+    return FusionHeads.from_state_dict(state_dict)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[2].strip())
+    parser.add_argument('--store', type=str, default=EMBEDDING_STORE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    search = commands.add_parser('search', help='Utterances similar to a stored one')
+    search.add_argument('--video', type=str, required=True)
+    search.add_argument('--at', type=float, required=True, help='Time (s) inside the utterance')
+    search.add_argument('--k', type=int, default=10)
+    search.add_argument('--column', choices=FEATURE_COLUMNS, default='fused')
+    search.add_argument('--same_video', action='store_true')
+
+    rescore = commands.add_parser('rescore', help='Score every stored utterance with new heads')
+    rescore.add_argument('--model_path', type=str, required=True)
+    rescore.add_argument('--output', type=str, default='rescored.jsonl')
+    return parser.parse_args()
+
+
+def main():
+    from inference import EMOTION_MAP, SENTIMENT_MAP
+
+    args = parse_args()
+    store = EmbeddingStore(args.store)
+    print(f"{args.store}: {store.stats()}")
+    if args.command == 'search':
+        row = store.find(args.video, args.at)
+        print(f"Query: {store.describe(row)}")
+        for result in store.similar(row, args.k, args.column, args.same_video):
+            print(json.dumps(result))
+    else:
+        scores = store.rescore(load_heads(args.model_path))
+        with open(args.output, 'w') as f:
+            for row, (emotions, sentiments) in enumerate(zip(scores['emotions'], scores['sentiments'])):
+                f.write(json.dumps({**store.describe(row),
+                                    'emotion': EMOTION_MAP[int(emotions.argmax())],
+                                    'sentiment': SENTIMENT_MAP[int(sentiments.argmax())],
+                                    'emotions': [round(float(p), 4) for p in emotions],
+                                    'sentiments': [round(float(p), 4) for p in sentiments]}) + '\n')
+        print(f"Re-scored {len(scores['emotions'])} utterances into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
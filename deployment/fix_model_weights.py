@@ -7,13 +7,15 @@ def fix_nan_weights(model_path, output_path):
     
     print(f"Loading corrupted model from: {model_path}")
     checkpoint = torch.load(model_path, map_location='cpu')
+    # Newer checkpoints wrap the weights together with their clip_config
+    state_dict = checkpoint.get('model_state_dict', checkpoint)
     
     print("Checking for NaN weights...")
     fixed_count = 0
     total_params = 0
     
     # Fix NaN weights in the state dict
-    for key, param in checkpoint.items():
+    for key, param in state_dict.items():
         total_params += param.numel()
         if torch.isnan(param).any():
             print(f"❌ Fixing NaN in {key}")
@@ -44,6 +46,7 @@ def fix_nan_weights(model_path, output_path):
     # Verify the fix
     print("Verifying fix...")
     fixed_checkpoint = torch.load(output_path, map_location='cpu')
+    fixed_checkpoint = fixed_checkpoint.get('model_state_dict', fixed_checkpoint)
     nan_count = 0
     
     for key, param in fixed_checkpoint.items():
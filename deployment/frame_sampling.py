@@ -0,0 +1,209 @@
+import cv2
+import numpy as np
+import torch
+from clip_config import SAMPLING_STRATEGIES
+from media_decoder import probe_video, decode_video_frames, decode_clip, decode_audio
+
+# Temporal frame sampling for utterance clips. Frames that are not kept are
+# skipped with grab() (demux + decode, no pixel conversion or copy) and long
+# gaps are crossed by seeking, which lands on the previous keyframe.
+#
+#   head    - first num_frames consecutive frames (what older checkpoints used)
+#   uniform - num_frames evenly spread over the whole utterance
+#   stride  - every frame_stride-th frame, centred on the utterance
+#   motion  - uniform candidates, keeping the highest-motion frame per bin
+
+# Gaps longer than this are crossed with a seek instead of grab()s
+SEEK_THRESHOLD = 48
+# Candidates decoded per kept frame by the motion sampler
+MOTION_CANDIDATES = 2
+MOTION_THUMBNAIL = (32, 32)
+
+
+def sample_indices(strategy, total_frames, num_frames, frame_stride=2):
+    """Sorted, unique frame indices to keep for a clip of total_frames"""
+    if total_frames <= 0:
+        return []
+    if strategy == 'head' or total_frames <= num_frames:
+        return list(range(min(num_frames, total_frames)))
+    if strategy == 'uniform':
+        # Centre of each of num_frames equal bins
+        return ((np.arange(num_frames) + 0.5) * total_frames / num_frames).astype(int).tolist()
+    if strategy == 'stride':
+        span = min(total_frames, num_frames * frame_stride)
+        start = (total_frames - span) // 2
+        return list(range(start, start + span, frame_stride))[:num_frames]
+    if strategy == 'motion':
+        candidates = min(total_frames, num_frames * MOTION_CANDIDATES)
+        return sample_indices('uniform', total_frames, candidates)
+    raise ValueError(
+        f"Unknown frame sampling strategy {strategy}, expected one of {SAMPLING_STRATEGIES}")
+
+
+def read_frames(cap, indices, seek_threshold=SEEK_THRESHOLD):
+    """Yield (index, frame) for the requested sorted indices, decoding pixels
+    only for those; stops early if the stream ends"""
+    position = 0
+    for index in indices:
+        if index - position > seek_threshold:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            position = index
+        while position < index:
+            if not cap.grab():
+                return
+            position += 1
+        ret, frame = cap.read()
+        if not ret or frame is None:
+            return
+        position += 1
+        yield index, frame
+
+
+def select_motion_frames(frames, num_frames):
+    """Split the candidates into num_frames bins and keep the frame that
+    differs most from its predecessor in each one"""
+    if len(frames) <= num_frames:
+        return frames
+    thumbnails = [cv2.resize(cv2.cvtColor(f, cv2.COLOR_BGR2GRAY), MOTION_THUMBNAIL).astype(np.float32)
+                  for f in frames]
+    scores = np.zeros(len(frames), dtype=np.float32)
+    for i in range(1, len(frames)):
+        scores[i] = np.abs(thumbnails[i] - thumbnails[i - 1]).mean()
+    scores[0] = scores[1]
+
+    bins = np.array_split(np.arange(len(frames)), num_frames)
+    keep = [b[np.argmax(scores[b])] for b in bins if len(b)]
+    if isinstance(frames, np.ndarray):
+        return frames[keep]
+    return [frames[i] for i in keep]
+
+
+def _time_range_frames(fps, total_frames, start_time, end_time):
+    """(first frame, frame count) of a time range within the video"""
+    first = int(round(start_time * fps)) if start_time is not None else 0
+    last = int(round(end_time * fps)) if end_time is not None else total_frames
+    if total_frames > 0:
+        last = min(last, total_frames)
+    return first, max(0, last - first)
+
+
+def _decode_opencv(video_path, strategy, num_frames, frame_stride, start_time, end_time):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise ValueError(f"Video not found: {video_path}")
+
+        first, total_frames = _time_range_frames(
+            cap.get(cv2.CAP_PROP_FPS) or 0.0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            start_time, end_time)
+        if total_frames <= 0:
+            # Frame count unknown (some containers): fall back to the head
+            strategy, total_frames = 'head', num_frames
+        # read_frames seeks to the range start when it is far enough in
+        indices = [first + i for i in sample_indices(strategy, total_frames, num_frames, frame_stride)]
+        return [frame for _, frame in read_frames(cap, indices)], strategy
+    finally:
+        cap.release()
+
+
+def _ffmpeg_indices(video_path, strategy, num_frames, frame_stride, start_time, end_time):
+    info = probe_video(video_path)
+    _, total_frames = _time_range_frames(
+        info['fps'], info['frame_count'], start_time, end_time)
+    if total_frames <= 0:
+        strategy, total_frames = 'head', num_frames
+    return sample_indices(strategy, total_frames, num_frames, frame_stride), strategy, info
+
+
+def _finish_frames(decoded, strategy, clip_config):
+    """Motion selection and resize to the clip size as one uint8 array"""
+    num_frames = clip_config['num_frames']
+    size = (clip_config['width'], clip_config['height'])
+    if len(decoded) == 0:
+        raise ValueError("No frames could be extracted")
+    if strategy == 'motion':
+        decoded = select_motion_frames(decoded, num_frames)
+    if isinstance(decoded, np.ndarray):
+        # ffmpeg already scaled the frames
+        return decoded[:num_frames]
+    frames = np.empty((min(len(decoded), num_frames), size[1], size[0], 3), dtype=np.uint8)
+    for i, frame in enumerate(decoded[:num_frames]):
+        frames[i] = cv2.resize(frame, size)
+    return frames
+
+
+def decode_clip_frames(video_path, clip_config, start_time=None, end_time=None):
+    """Sampled frames of a clip as uint8 BGR [n, height, width, 3], n <= num_frames.
+
+    start_time/end_time (seconds) restrict sampling to that part of the video,
+    so utterances can be read from the full source without cutting it first.
+    """
+    num_frames = clip_config['num_frames']
+    size = (clip_config['width'], clip_config['height'])
+    strategy = clip_config.get('sampling', 'head')
+    frame_stride = clip_config.get('frame_stride', 2)
+
+    if clip_config.get('decoder', 'opencv') == 'ffmpeg':
+        indices, strategy, _ = _ffmpeg_indices(
+            video_path, strategy, num_frames, frame_stride, start_time, end_time)
+        decoded = decode_video_frames(video_path, indices, size, start_time, end_time)
+    else:
+        decoded, strategy = _decode_opencv(
+            video_path, strategy, num_frames, frame_stride, start_time, end_time)
+
+    try:
+        return _finish_frames(decoded, strategy, clip_config)
+    except ValueError as e:
+        raise ValueError(f"{e}: {video_path}")
+
+
+def pad_frames(frames, num_frames):
+    """Zero pad (or truncate) uint8 frames to num_frames"""
+    if len(frames) == num_frames:
+        return frames
+    out = np.zeros((num_frames,) + frames.shape[1:], dtype=frames.dtype)
+    count = min(len(frames), num_frames)
+    out[:count] = frames[:count]
+    return out
+
+
+def frames_to_tensor(frames, num_frames):
+    """uint8 [n, H, W, C] frames -> [num_frames, C, H, W] float tensor in
+    [0, 1], zero padded at the end when the clip is too short"""
+    out = pad_frames(frames, num_frames).astype(np.float32)
+    out *= 1.0 / 255.0
+    # [frames, height, width, channels] -> [frames, channels, height, width]
+    return torch.from_numpy(out).permute(0, 3, 1, 2)
+
+
+def load_clip_frames(video_path, clip_config, start_time=None, end_time=None):
+    """Decode a clip to a [num_frames, channels, height, width] float tensor in
+    [0, 1], zero padded at the end when the clip is too short"""
+    return frames_to_tensor(
+        decode_clip_frames(video_path, clip_config, start_time, end_time),
+        clip_config['num_frames'])
+
+
+def load_clip(video_path, clip_config, sample_rate=16000, start_time=None, end_time=None):
+    """uint8 frames and the mono waveform of a clip.
+
+    With the ffmpeg decoder both come out of a single demux of the file; the
+    opencv decoder reads the file twice (cv2 for frames, ffmpeg for audio).
+    """
+    if clip_config.get('decoder', 'opencv') != 'ffmpeg':
+        return (decode_clip_frames(video_path, clip_config, start_time, end_time),
+                decode_audio(video_path, sample_rate, start_time, end_time))
+
+    strategy = clip_config.get('sampling', 'head')
+    indices, strategy, info = _ffmpeg_indices(
+        video_path, strategy, clip_config['num_frames'], clip_config.get('frame_stride', 2),
+        start_time, end_time)
+    duration = end_time - start_time if start_time is not None and end_time is not None \
+        else info['duration']
+    decoded, waveform = decode_clip(
+        video_path, indices, (clip_config['width'], clip_config['height']),
+        sample_rate, start_time, end_time, duration=duration)
+    try:
+        return _finish_frames(decoded, strategy, clip_config), waveform
+    except ValueError as e:
+        raise ValueError(f"{e}: {video_path}")
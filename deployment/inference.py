@@ -1,16 +1,33 @@
 import torch
-from models import MultimodalSentimentModel
+from models import MultimodalSentimentModel, TextAudioHead, cascade_confidence
+from clip_config import make_clip_config, clip_config_from_checkpoint, clip_config_name
+from frame_sampling import load_clip_frames
+from media_decoder import decode_audio, decode_video_rate, probe_video
+from features import MelFeatureExtractor, get_mel_extractor, scale_frames, SAMPLE_RATE
 import os
-import cv2
-import numpy as np
 import subprocess
-import torchaudio
-import whisper
 from transformers import AutoTokenizer
 import sys
 import json
-import boto3
+from botocore.exceptions import ClientError
 import tempfile
+import shutil
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import METRICS, RequestTrace, configure_logging, get_logger, start_trace, get_trace, pop_trace
+from streaming import STREAM_CHUNK_SECONDS, iter_transcript_windows, iter_segment_windows, open_sink, progress_marker, transcribe_range
+from transcription import Transcriber, TranscriptCache, TRANSCRIPTION_PROFILE, TRANSCRIPT_CACHE_DIR
+from captions import CAPTION_EXTENSIONS, find_sidecar, load_captions, normalize_segments
+from segmentation import coalesce_segments, make_segmentation_policy
+from model_executor import ModelExecutor, run_model
+from s3_transfer import get_input_cache, get_s3_client, parse_s3_uri
+from sharding import plan_windows, tag_window_segments, merge_window_segments, split_even, combine_summaries
+from embedding_store import get_embedding_store, store_directory
+from timeline import make_timeline_config, window_starts, window_blocks, frame_windows, window_texts, columnar_timeline
+
+logger = get_logger()
 
 # Fix: Match the training model's emotion and sentiment mappings exactly
 # Based on training/models.py line 158
@@ -18,6 +35,40 @@ EMOTION_MAP = {0: "anger", 1: "disgust", 2: "fear",
                3: "joy", 4: "neutral", 5: "sadness", 6: "surprise"}
 SENTIMENT_MAP = {0: "negative", 1: "neutral", 2: "positive"}
 
+# Utterances encoded together by BERT (grouped by token length)
+TEXT_BATCH_SIZE = 16
+# Frozen-BERT embeddings cached across requests (0 disables); evicted
+# entries spill to INFERENCE_TEXT_CACHE_DIR when it is set
+TEXT_CACHE_SIZE = int(os.environ.get('INFERENCE_TEXT_CACHE_SIZE', '8192'))
+TEXT_CACHE_DIR = os.environ.get('INFERENCE_TEXT_CACHE_DIR')
+# Sharded mode: overlapping windows of a long video transcribed and scored
+# in forked worker processes that share the loaded model copy-on-write
+SHARD_SECONDS = float(os.environ.get('INFERENCE_SHARD_SECONDS', '120'))
+SHARD_OVERLAP_SECONDS = float(os.environ.get('INFERENCE_SHARD_OVERLAP_SECONDS', '10'))
+SHARD_WORKERS = int(os.environ.get('INFERENCE_SHARD_WORKERS', str(os.cpu_count() or 1)))
+
+# Start transcribing from a presigned URL while the video is still
+# downloading ("overlap_download" per request). Off by default: ffmpeg
+# reads the object through the URL while the multipart download fetches
+# it too, so every overlapped request transfers the object from S3 twice
+OVERLAP_DOWNLOAD = os.environ.get('INFERENCE_OVERLAP_DOWNLOAD', 'false').lower() in ('1', 'true', 'yes')
+
+# Requests served at once by one loaded model (INFERENCE_CONCURRENT_REQUESTS
+# > 1 runs every model call through a shared ModelExecutor, which batches
+# matching calls of up to INFERENCE_EXECUTOR_MAX_BATCH rows)
+CONCURRENT_REQUESTS = int(os.environ.get('INFERENCE_CONCURRENT_REQUESTS', '1'))
+EXECUTOR_MAX_BATCH = int(os.environ.get('INFERENCE_EXECUTOR_MAX_BATCH', '8'))
+# Per-request scratch directories, on tmpfs when there is one
+SCRATCH_DIR = os.environ.get('INFERENCE_SCRATCH_DIR') or (
+    '/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir())
+
+# The fast tokenizer's truncation / padding state is not safe to share
+# between threads
+_TOKENIZER_LOCK = threading.Lock()
+
+# Set before the pool forks, so workers inherit the model instead of unpickling it
+_SHARD_CONTEXT = {}
+
 
 def install_ffmpeg():
     print("Starting Ffmpeg installation...")
@@ -73,153 +124,166 @@ def install_ffmpeg():
 
 
 class VideoProcessor:
-    def process_video(self, video_path):
-        cap = cv2.VideoCapture(video_path)
-        frames = []
+    def __init__(self, clip_config=None):
+        self.clip_config = make_clip_config(clip_config)
 
+    def process_video(self, video_path, start_time=None, end_time=None):
         try:
-            if not cap.isOpened():
-                raise ValueError(f"Video not found: {video_path}")
-
-            # Try and read first frame to validate video
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                raise ValueError(f"Video not found: {video_path}")
-
-            # Reset index to not skip first frame
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-
-            while len(frames) < 30 and cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-
-                frame = cv2.resize(frame, (224, 224))
-                frame = frame / 255.0
-                frames.append(frame)
-
+            return load_clip_frames(video_path, self.clip_config, start_time, end_time)
         except Exception as e:
             raise ValueError(f"Video error: {str(e)}")
-        finally:
-            cap.release()
-
-        if (len(frames) == 0):
-            raise ValueError("No frames could be extracted")
-
-        # Pad or truncate frames
-        if len(frames) < 30:
-            frames += [np.zeros_like(frames[0])] * (30 - len(frames))
-        else:
-            frames = frames[:30]
-
-        # Before permute: [frames, height, width, channels]
-        # After permute: [frames, channels, height, width]
-        return torch.FloatTensor(np.array(frames)).permute(0, 3, 1, 2)
 
 
 class AudioProcessor:
-    def extract_features(self, video_path, max_length=300):
-        audio_path = video_path.replace('.mp4', '.wav')
-
+    def extract_features(self, video_path, max_length=300, start_time=None, end_time=None):
+        # ffmpeg resamples to 16 kHz mono PCM on a pipe; a time range reads the
+        # audio straight from the source video, so nothing is written to disk
         try:
-            subprocess.run([
-                'ffmpeg',
-                '-i', video_path,
-                '-vn',
-                '-acodec', 'pcm_s16le',
-                '-ar', '16000',
-                '-ac', '1',
-                audio_path
-            ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-            waveform, sample_rate = torchaudio.load(audio_path)
-
-            if sample_rate != 16000:
-                resampler = torchaudio.transforms.Resample(sample_rate, 16000)
-                waveform = resampler(waveform)
-
-            mel_spectrogram = torchaudio.transforms.MelSpectrogram(
-                sample_rate=16000,
-                n_mels=64,
-                n_fft=1024,
-                hop_length=512
-            )
-
-            mel_spec = mel_spectrogram(waveform)
-
-            # Normalize
-            mel_spec = (mel_spec - mel_spec.mean()) / mel_spec.std()
-
-            if mel_spec.size(2) < 300:
-                padding = 300 - mel_spec.size(2)
-                mel_spec = torch.nn.functional.pad(mel_spec, (0, padding))
-            else:
-                mel_spec = mel_spec[:, :, :300]
+            waveform = decode_audio(
+                video_path, sample_rate=16000, start_time=start_time, end_time=end_time)
 
-            return mel_spec
+            # Same cached extractor (mel, normalize, pad to 300) as training
+            waveforms, lengths = MelFeatureExtractor.pad_waveforms([torch.from_numpy(waveform)])
+            with torch.no_grad():
+                mel_spec = get_mel_extractor()(waveforms, lengths)
+            return mel_spec[0]
 
-        except subprocess.CalledProcessError as e:
-            raise ValueError(f"Audio extraction error: {str(e)}")
         except Exception as e:
             raise ValueError(f"Audio error: {str(e)}")
-        finally:
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
 
 
 class VideoUtteranceProcessor:
-    def __init__(self):
-        self.video_processor = VideoProcessor()
+    def __init__(self, clip_config=None):
+        self.video_processor = VideoProcessor(clip_config)
         self.audio_processor = AudioProcessor()
 
-    def extract_segment(self, video_path, start_time, end_time, temp_dir="/tmp"):
-        os.makedirs(temp_dir, exist_ok=True)
-        segment_path = os.path.join(
-            temp_dir, f"segment_{start_time}_{end_time}.mp4")
-
-        subprocess.run([
-            "ffmpeg", "-i", video_path,
-            "-ss", str(start_time),
-            "-to", str(end_time),
-            "-c:v", "libx264",
-            "-c:a", "aac",
-            "-y",
-            segment_path
-        ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        if not os.path.exists(segment_path) or os.path.getsize(segment_path) == 0:
-            raise ValueError("Segment extraction failed: " + segment_path)
-
-        return segment_path
 
-
-def download_from_s3(s3_uri):
-    s3_client = boto3.client("s3")
-    bucket = s3_uri.split("/")[2]
-    key = "/".join(s3_uri.split("/")[3:])
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_file:
-        s3_client.download_file(bucket, key, temp_file.name)
-        return temp_file.name
+def download_from_s3(s3_uri, trace, background=False):
+    """Fetch a video through the shared input cache; the file stays pinned
+    until the request's trace finishes. With background=True the returned
+    Download may still be running."""
+    cache = get_input_cache()
+    download = cache.fetch(s3_uri, background=background)
+    trace.on_finish(lambda: cache.release(download.path))
+    trace.attributes['input_cache'] = 'hit' if download.cached else 'miss'
+    return download
+
+
+def download_captions(video_uri, captions_uri=None, scratch_dir=None):
+    """Caption file from S3 into a local temp file (in scratch_dir):
+    captions_uri, or else an .srt / .vtt next to the video (None when there
+    is none)"""
+    s3_client = get_s3_client()
+    if captions_uri:
+        candidates = [captions_uri]
+    else:
+        base = os.path.splitext(video_uri)[0]
+        candidates = [base + extension for extension in CAPTION_EXTENSIONS]
+
+    for uri in candidates:
+        bucket, key = parse_s3_uri(uri)
+        with tempfile.NamedTemporaryFile(dir=scratch_dir, delete=False,
+                                         suffix=os.path.splitext(key)[1]) as temp_file:
+            try:
+                s3_client.download_fileobj(bucket, key, temp_file)
+            except ClientError as e:
+                error = e
+            else:
+                return temp_file.name
+        os.remove(temp_file.name)
+        missing = error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey')
+        if captions_uri or not missing:
+            raise error
+    return None
 
 
 def input_fn(request_body, request_content_type):
     if request_content_type == "application/json":
         input_data = json.loads(request_body)
-        s3_uri = input_data['video_path']
-        local_path = download_from_s3(s3_uri)
-        return {"video_path": local_path}
+        trace = start_trace(input_data.get('request_id'))
+        try:
+            if input_data.get('video_paths') is not None:
+                # Batch request: every download starts now and runs while
+                # predict_fn scores the videos before it
+                options = {k: v for k, v in input_data.items() if k not in ('video_paths', 'request_id')}
+                trace.attributes['videos'] = len(input_data['video_paths'])
+                videos = []
+                for video in input_data['video_paths']:
+                    video = {**options, **(video if isinstance(video, dict) else {'video_path': video})}
+                    try:
+                        videos.append(fetch_video(video, trace, background=True))
+                    except Exception as e:
+                        # Reported in that video's result
+                        videos.append({**video, "video_uri": video['video_path'], "error": str(e)})
+                return {"videos": videos, "request_id": trace.request_id}
+            trace.attributes['video_path'] = input_data['video_path']
+            input_data = fetch_video(input_data, trace, background=bool(
+                input_data.get('overlap_download', OVERLAP_DOWNLOAD)))
+        except Exception:
+            pop_trace(trace.request_id).finish(status="error")
+            raise
+        # Other request options (cascade, stream_to, ...) pass through
+        return {**input_data, "request_id": trace.request_id}
     raise ValueError(f"Unsupported content type: {request_content_type}")
 
 
+def fetch_video(input_data, trace, background=False):
+    """Download a request's video (and its captions) from S3; returns the
+    request with local paths, the S3 URI kept as video_uri. A background
+    download still running is passed on under "download"."""
+    s3_uri = input_data['video_path']
+    with trace.stage("s3_download", background=background):
+        download = download_from_s3(s3_uri, trace, background)
+    fetched = {**input_data, "video_path": download.path, "video_uri": s3_uri}
+    if not download.done():
+        fetched['download'] = download
+    # Timed text from the caller skips Whisper: an explicit caption
+    # file, or an .srt / .vtt next to the video
+    captions = input_data.get('captions', True)
+    if input_data.get('segments') is None and captions is not False:
+        with trace.stage("caption_download"):
+            fetched['captions'] = download_captions(
+                s3_uri, captions if isinstance(captions, str) else None,
+                request_scratch_dir(trace)) or False
+    return fetched
+
+
+def request_scratch_dir(trace):
+    """The request's own scratch directory, removed when its trace finishes"""
+    if 'scratch_dir' not in trace.attributes:
+        path = tempfile.mkdtemp(prefix=f"inference-{trace.request_id}-", dir=SCRATCH_DIR)
+        trace.attributes['scratch_dir'] = path
+        trace.on_finish(lambda: shutil.rmtree(path, ignore_errors=True))
+    return trace.attributes['scratch_dir']
+
+
+def wait_for_download(input_data, trace):
+    """Block until the request's background download (if any) is on disk"""
+    download = input_data.pop('download', None)
+    if download is not None:
+        with trace.stage("download_wait"):
+            download.wait()
+
+
 def output_fn(prediction, response_content_type):
     if response_content_type == "application/json":
-        return json.dumps(prediction)
+        trace = pop_trace(prediction.get("request_id"))
+        if trace is None:
+            return json.dumps(prediction)
+        try:
+            with trace.stage("serialization"):
+                body = json.dumps(prediction)
+        except Exception:
+            trace.finish(status="error")
+            raise
+        trace.finish()
+        return body
     raise ValueError(f"Unsupported content type: {response_content_type}")
 
 
 def model_fn(model_dir):
     # Load the model for inference
+    configure_logging()
     if not install_ffmpeg():
         raise RuntimeError(
             "FFmpeg installation failed - required for inference")
@@ -227,10 +291,6 @@ def model_fn(model_dir):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Using device: {device}")
     
-    # Create model instance
-    model = MultimodalSentimentModel().to(device)
-    print(f"Model created with {sum(p.numel() for p in model.parameters()):,} parameters")
-    
     # Try multiple possible model file names and paths
     # Priority: Existing models first, then fallback paths
     possible_paths = [
@@ -260,6 +320,12 @@ def model_fn(model_dir):
     # Load the model weights
     checkpoint = torch.load(model_path, map_location=device)
     print(f"Checkpoint keys: {list(checkpoint.keys()) if isinstance(checkpoint, dict) else 'Not a dict'}")
+
+    # Create model instance with the clip geometry it was trained on
+    clip_config = clip_config_from_checkpoint(checkpoint)
+    model = MultimodalSentimentModel(clip_config).to(device)
+    print(f"Model created with {sum(p.numel() for p in model.parameters()):,} parameters, "
+          f"clip {clip_config_name(clip_config)}")
     
     # Handle different checkpoint formats
     if isinstance(checkpoint, dict):
@@ -295,6 +361,10 @@ def model_fn(model_dir):
     
     model.eval()
     print("Model set to evaluation mode")
+
+    if TEXT_CACHE_SIZE > 0:
+        model.text_encoder.enable_cache(TEXT_CACHE_SIZE, TEXT_CACHE_DIR)
+        print(f"Text embedding cache: {TEXT_CACHE_SIZE} entries, spill dir {TEXT_CACHE_DIR}")
     
     # Fix: Add gradient clipping and validation for any trainable params
     for param in model.parameters():
@@ -306,7 +376,8 @@ def model_fn(model_dir):
         print("Testing model with dummy inputs...")
         dummy_text = {'input_ids': torch.randint(0, 1000, (1, 128)).to(device),
                      'attention_mask': torch.ones(1, 128).to(device)}
-        dummy_video = torch.randn(1, 30, 3, 224, 224).to(device)
+        dummy_video = torch.randn(
+            1, clip_config['num_frames'], 3, clip_config['height'], clip_config['width']).to(device)
         dummy_audio = torch.randn(1, 1, 64, 300).to(device)
         
         with torch.inference_mode():
@@ -322,17 +393,44 @@ def model_fn(model_dir):
     if not validate_model_weights(model):
         print("⚠️ Warning: Model weights have issues, but continuing...")
 
+    transcriber = Transcriber(TRANSCRIPTION_PROFILE, device="cpu" if device.type == "cpu" else device,
+                              cache=TranscriptCache())
+    print(f"Transcription profile {transcriber.profile} (whisper {transcriber.model_name}), "
+          f"transcript cache {TRANSCRIPT_CACHE_DIR or 'in memory only'}")
+
     return {
         'model': model,
+        'cascade': load_cascade(model_path, device),
+        'clip_config': clip_config,
         'tokenizer': AutoTokenizer.from_pretrained('bert-base-uncased'),
-        'transcriber': whisper.load_model(
-            "base",
-            device="cpu" if device.type == "cpu" else device,
-        ),
+        'transcriber': transcriber,
+        # Shared by concurrently served requests (None: one request at a time)
+        'executor': ModelExecutor(EXECUTOR_MAX_BATCH) if CONCURRENT_REQUESTS > 1 else None,
         'device': device
     }
 
 
+def load_cascade(model_path, device):
+    """Load the text+audio cascade head shipped next to the model, if any"""
+    cascade_path = os.path.join(os.path.dirname(model_path), 'cascade_head.pth')
+    if not os.path.exists(cascade_path):
+        print("No cascade head found, every segment runs the video encoder")
+        return None
+
+    checkpoint = torch.load(cascade_path, map_location=device)
+    head = TextAudioHead().to(device)
+    head.load_state_dict(checkpoint['state_dict'])
+    head.eval()
+    report = checkpoint.get('report', {})
+    print(f"Cascade head loaded: {checkpoint['criterion']} >= {checkpoint['threshold']:.3f} "
+          f"(dev skip rate {report.get('skip_rate', float('nan')):.1%})")
+    return {
+        'head': head,
+        'threshold': checkpoint['threshold'],
+        'criterion': checkpoint['criterion']
+    }
+
+
 def validate_model_weights(model):
     """Check if model weights are properly loaded and not NaN"""
     print("Validating model weights...")
@@ -363,124 +461,610 @@ def validate_model_weights(model):
 
 
 def predict_fn(input_data, model_dict):
-    model = model_dict['model']
-    tokenizer = model_dict['tokenizer']
-    device = model_dict['device']
-    video_path = input_data['video_path']
+    # Requests that did not come through input_fn (local runs) get their own trace
+    trace = get_trace(input_data.get('request_id'))
+    if trace is None:
+        trace = start_trace(input_data.get('request_id'))
+    if input_data.get('videos') is not None:
+        return batch_predict(input_data, model_dict, trace)
 
-    result = model_dict['transcriber'].transcribe(
-        video_path, word_timestamps=True)
+    try:
+        segments = caller_segments(input_data)
+        policy = segmentation_policy(input_data, caller=segments is not None)
+        store_dir = store_directory(input_data['store_embeddings']) \
+            if input_data.get('store_embeddings') else None
+        # With overlap_download, Whisper can start on a presigned URL while
+        # the download finishes (a second transfer of the object); batch
+        # downloads run in the background either way. The other modes need
+        # the file first
+        overlap = 'download' in input_data and segments is None \
+            and bool(input_data.get('overlap_download', OVERLAP_DOWNLOAD)) and not any(
+                input_data.get(mode) for mode in ('timeline', 'stream_to', 'sharded'))
+        if not overlap:
+            wait_for_download(input_data, trace)
+    except Exception:
+        pop_trace(trace.request_id)
+        trace.finish(status="error")
+        raise
+    trace.attributes['transcript'] = 'asr' if segments is None else 'caller'
+
+    if input_data.get('timeline'):
+        return timeline_predict(input_data, model_dict, trace, segments)
+    if input_data.get('stream_to'):
+        return stream_predict(input_data, model_dict, trace, segments, policy)
+    if input_data.get('sharded'):
+        # CUDA does not survive a fork, and forking while other requests'
+        # threads hold locks is not safe
+        if model_dict['device'].type == 'cpu' and model_dict.get('executor') is None:
+            return sharded_predict(input_data, model_dict, trace, segments, policy)
+        logger.warning("Sharded mode needs a CPU model serving one request at a time, "
+                       "processing sequentially")
 
-    utterance_processor = VideoUtteranceProcessor()
-    predictions = []
+    video_path = input_data['video_path']
+    try:
+        if segments is not None:
+            result = {"segments": segments}
+        else:
+            transcriber = model_dict['transcriber']
+            before = transcript_cache_counts(transcriber)
+            download = input_data.get('download')
+            source = download.url if download is not None and not download.done() else video_path
+            with trace.stage("transcription", overlapped=source != video_path):
+                result = transcriber.transcribe(source)
+            wait_for_download(input_data, trace)
+            observe_transcript_cache(trace, transcriber, before)
+        trace.attributes['segments'] = len(result["segments"])
+        segments = apply_segmentation(result["segments"], policy, trace)
+
+        # The cascade is on whenever a calibrated head shipped with the model;
+        # stored embeddings need every encoder, so it is off when storing
+        cascade = model_dict.get('cascade') if input_data.get('cascade', True) and not store_dir else None
+        stats = {'cascade_skipped': 0}
+        embeddings = [] if store_dir else None
+        predictions = list(score_segments(
+            video_path, segments, model_dict, trace, cascade, stats, embeddings=embeddings))
+
+        if cascade is not None:
+            trace.attributes['cascade_skipped'] = stats['cascade_skipped']
+            logger.info(f"Cascade skipped the video encoder for {stats['cascade_skipped']}/{len(segments)} segments")
+        if embeddings:
+            video_id = input_data.get('video_id') or input_data.get('video_uri') or video_path
+            store_embeddings(embeddings, video_id, store_dir, trace)
+    except Exception:
+        # The trace's cleanup unpins the input and removes the scratch dir
+        pop_trace(trace.request_id)
+        trace.finish(status="error")
+        raise
+    return {"utterances": predictions, "request_id": trace.request_id}
+
+
+def store_embeddings(embeddings, video_id, directory, trace):
+    """Append a request's utterance embeddings (segment, outputs pairs) to the store"""
+    with trace.stage("embedding_store", utterances=len(embeddings)):
+        features = {name: torch.cat([outputs[f'{name}_features'] for _, outputs in embeddings])
+                    for name in ('text', 'video', 'audio', 'fused')}
+        get_embedding_store(directory).append(
+            video_id, [segment['start'] for segment, _ in embeddings],
+            [segment['end'] for segment, _ in embeddings], features)
+    trace.attributes['embeddings_stored'] = len(embeddings)
+
+
+def batch_predict(input_data, model_dict, trace):
+    """predict_fn for each of input_data['videos'], CONCURRENT_REQUESTS at a
+    time when a shared executor serves the model (in order otherwise).
+    Every video gets its own trace (<request_id>-<n>); a failed video is
+    reported with its error instead of failing the batch."""
+    def predict_video(i, video):
+        request_id = f"{trace.request_id}-{i}"
+        source = video.get('video_uri', video['video_path'])
+        try:
+            if 'error' in video:
+                raise ValueError(video['error'])
+            prediction = predict_fn({**video, 'request_id': request_id}, model_dict)
+            pop_trace(request_id).finish()
+            return {"video_path": source, **prediction}
+        except Exception as e:
+            logger.warning(f"Video {i} ({source}) failed: {e}")
+            return {"video_path": source, "request_id": request_id, "error": str(e)}
+
+    videos = input_data['videos']
+    concurrency = min(CONCURRENT_REQUESTS, len(videos)) if model_dict.get('executor') else 1
+    with trace.stage("videos", count=len(videos), concurrency=concurrency):
+        if concurrency > 1:
+            with ThreadPoolExecutor(concurrency) as pool:
+                results = list(pool.map(predict_video, range(len(videos)), videos))
+        else:
+            results = [predict_video(i, video) for i, video in enumerate(videos)]
+    trace.attributes.update(videos=len(results),
+                            failed_videos=sum('error' in r for r in results))
+    return {"results": results, "request_id": trace.request_id}
+
+
+def caller_segments(input_data):
+    """Timed text supplied with the request: a "segments" list, a caption
+    file ("captions", local path) or an .srt / .vtt next to the video.
+    None when Whisper has to transcribe."""
+    if input_data.get('segments') is not None:
+        return normalize_segments(input_data['segments'])
+    captions = input_data.get('captions', True)
+    if captions is False:
+        return None
+    path = captions if isinstance(captions, str) else find_sidecar(input_data['video_path'])
+    return load_captions(path) if path else None
+
+
+def segmentation_policy(input_data, caller=False):
+    """The request's segmentation policy: "segmentation": false turns it
+    off, a dict overrides the defaults. Caller-supplied segments are scored
+    as given unless the request sets a policy."""
+    setting = input_data.get('segmentation', not caller)
+    if setting is False:
+        return None
+    return make_segmentation_policy(setting if isinstance(setting, dict) else None)
+
+
+def apply_segmentation(segments, policy, trace):
+    """Coalesce segments under the policy, counting forwards saved in the trace"""
+    if policy is None:
+        return segments
+    segments, stats = coalesce_segments(segments, policy)
+    METRICS.observe_segmentation(stats['merged'], stats['dropped'])
+    totals = trace.attributes.setdefault('segmentation', dict.fromkeys(stats, 0))
+    for k, v in stats.items():
+        totals[k] += v
+    logger.info(f"Segmentation: {stats['input']} segments -> {stats['scored']} forwards "
+                f"({stats['merged']} merged, {stats['dropped']} dropped)")
+    return segments
+
+
+def stream_predict(input_data, model_dict, trace, segments=None, policy=None):
+    """Transcribe in bounded windows and write each window's utterances to
+    input_data['stream_to'] (an s3:// prefix, or a JSON Lines file under
+    INFERENCE_STREAM_DIR) as soon as they are scored. Nothing accumulates
+    across windows, so memory stays flat however long the video is."""
+    video_path = input_data['video_path']
+    cascade = model_dict.get('cascade') if input_data.get('cascade', True) else None
+    chunk_seconds = float(input_data.get('stream_chunk_seconds', STREAM_CHUNK_SECONDS))
+    stats = {'cascade_skipped': 0}
+    # Per-stage totals only; per-segment spans would grow with the video
+    trace.keep_spans = False
+
+    sink = None
+    progress = None
+    before = transcript_cache_counts(model_dict['transcriber'])
+    try:
+        sink = open_sink(input_data['stream_to'])
+        trace.attributes['stream_to'] = sink.location
+        progress = progress_marker(
+            trace.request_id, trace.attributes.get('video_path', video_path),
+            probe_video(video_path)['duration'])
+        sink.mark(progress)
+
+        if segments is not None:
+            windows = iter_segment_windows(segments, chunk_seconds)
+        else:
+            windows = iter_transcript_windows(
+                model_dict['transcriber'], video_path, progress['duration_s'], chunk_seconds)
+        while True:
+            with trace.stage("transcription", window=progress['windows']):
+                window = next(windows, None)
+            if window is None:
+                break
+            processed_until, segments = window
+
+            predictions = list(score_segments(
+                video_path, apply_segmentation(segments, policy, trace), model_dict, trace,
+                cascade, stats, first_index=progress['utterances']))
+            with trace.stage("stream_write", utterances=len(predictions)):
+                sink.write(predictions)
+                progress.update(processed_until_s=processed_until, updated_at=time.time(),
+                                windows=progress['windows'] + 1,
+                                segments=progress['segments'] + len(segments),
+                                utterances=progress['utterances'] + len(predictions))
+                sink.mark(progress)
+            logger.info(f"Streamed {progress['utterances']} utterances, "
+                        f"{processed_until:.1f}/{progress['duration_s']:.1f}s")
+
+        progress.update(status='done', updated_at=time.time())
+        sink.mark(progress)
+    except Exception:
+        if progress is not None:
+            try:
+                progress.update(status='error', updated_at=time.time())
+                sink.mark(progress)
+            except Exception as e:
+                logger.warning(f"Could not write progress marker: {e}")
+        pop_trace(trace.request_id)
+        trace.finish(status="error")
+        raise
+    finally:
+        if sink is not None:
+            sink.close()
+
+    observe_transcript_cache(trace, model_dict['transcriber'], before)
+    trace.attributes['segments'] = progress['segments']
+    if cascade is not None:
+        trace.attributes['cascade_skipped'] = stats['cascade_skipped']
+    return {"stream": progress, "request_id": trace.request_id}
+
+
+def transcript_cache_counts(transcriber):
+    """Transcript cache lookups so far (None for transcribers without a cache)"""
+    stats = transcriber.stats() if hasattr(transcriber, 'stats') else None
+    return stats and {k: stats[k] for k in ('hits', 'disk_hits', 'misses')}
+
+
+def observe_transcript_cache(trace, transcriber, before):
+    after = transcript_cache_counts(transcriber)
+    if after is None or before is None:
+        return
+    delta = {k: after[k] - before[k] for k in after}
+    METRICS.observe_transcript_cache(**delta)
+    trace.attributes['transcript_cache'] = delta
+
+
+def _init_shard_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+
+def _transcribe_shard(window):
+    context = _SHARD_CONTEXT
+    result = transcribe_range(
+        context['model_dict']['transcriber'], context['video_path'], *window)
+    segments = [{k: s[k] for k in ('start', 'end', 'text', 'no_speech_prob') if k in s}
+                for s in result['segments']]
+    return tag_window_segments(segments, window, context['duration'])
+
+
+def _score_shard(job):
+    shard, first_index, segments = job
+    context = _SHARD_CONTEXT
+    trace = RequestTrace(f"{context['request_id']}-shard{shard}")
+    trace.keep_spans = False
+    stats = {'cascade_skipped': 0}
+    predictions = list(score_segments(
+        context['video_path'], segments, context['model_dict'], trace,
+        context['cascade'], stats, first_index))
+    return predictions, stats, trace.summary(), trace.attributes.get('text_cache')
+
+
+def sharded_predict(input_data, model_dict, trace, segments=None, policy=None):
+    """predict_fn over overlapping time windows in a pool of forked workers.
+
+    Workers transcribe one window each (timestamps re-based to the video);
+    the parent merges the windows, dropping the second copy of utterances
+    heard in an overlap, then the workers score contiguous runs of the
+    merged segments. Worker stage timings are summed under
+    trace.attributes['shard_stages'].
+    """
+    video_path = input_data['video_path']
+    cascade = model_dict.get('cascade') if input_data.get('cascade', True) else None
+    shard_seconds = float(input_data.get('shard_seconds', SHARD_SECONDS))
+    overlap_seconds = float(input_data.get('shard_overlap_seconds', SHARD_OVERLAP_SECONDS))
+    # A request may ask for fewer workers than the server allows, not more
+    workers = min(max(1, int(input_data.get('shard_workers', SHARD_WORKERS))), max(1, SHARD_WORKERS))
 
-    for segment in result["segments"]:
+    try:
+        duration = probe_video(video_path)['duration']
+        windows = plan_windows(duration, shard_seconds, overlap_seconds)
+        _SHARD_CONTEXT.update(model_dict=model_dict, video_path=video_path, duration=duration,
+                              cascade=cascade, request_id=trace.request_id)
+        threads = max(1, torch.get_num_threads() // workers)
+        # The workers tokenize too; the fast tokenizer's thread pool does not survive a fork
+        os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+        with multiprocessing.get_context('fork').Pool(
+                workers, initializer=_init_shard_worker, initargs=(threads,)) as pool:
+            if segments is None:
+                with trace.stage("transcription", windows=len(windows), workers=workers):
+                    segments = merge_window_segments(
+                        pool.map(_transcribe_shard, windows, chunksize=1))
+            transcribed = len(segments)
+            segments = apply_segmentation(segments, policy, trace)
+
+            jobs, first_index = [], 0
+            for shard, group in enumerate(split_even(segments, workers)):
+                jobs.append((shard, first_index, group))
+                first_index += len(group)
+            with trace.stage("sharded_scoring", segments=len(segments), workers=workers):
+                results = pool.map(_score_shard, jobs, chunksize=1)
+    except Exception:
+        pop_trace(trace.request_id)
+        trace.finish(status="error")
+        raise
+    finally:
+        _SHARD_CONTEXT.clear()
+
+    predictions, cascade_skipped, text_cache = [], 0, {}
+    for (_, _, group), (shard_predictions, stats, _, cache_delta) in zip(jobs, results):
+        predictions.extend(shard_predictions)
+        cascade_skipped += stats['cascade_skipped']
+        # Worker metrics stay in the worker; count the segments here
+        METRICS.inc_segment("ok", len(shard_predictions))
+        METRICS.inc_segment("failed", len(group) - len(shard_predictions))
+        for k, v in (cache_delta or {}).items():
+            text_cache[k] = text_cache.get(k, 0) + v
+
+    trace.attributes.update(segments=transcribed, windows=len(windows), shard_workers=workers,
+                            shard_stages=combine_summaries(result[2] for result in results))
+    if text_cache:
+        trace.attributes['text_cache'] = text_cache
+    if cascade is not None:
+        trace.attributes['cascade_skipped'] = cascade_skipped
+    return {"utterances": predictions, "request_id": trace.request_id}
+
+
+def timeline_predict(input_data, model_dict, trace, segments=None):
+    """Dense emotion / sentiment timeline: one prediction per fixed window
+    ("timeline": true, or {"step": 1.0, "window": 3.0, ...}) instead of
+    one per transcript segment.
+
+    Each block of windows is decoded once (frames resampled to
+    num_frames / window fps, one waveform); window frames are strided
+    views of the block's frames and window mels slices of one STFT, and
+    windows are scored batch_size at a time. A window's text is every
+    transcript segment overlapping it. Returns columnar output under
+    "timeline"; the cascade is not used.
+    """
+    video_path = input_data['video_path']
+    model = model_dict['model']
+    device = model_dict['device']
+    clip_config = make_clip_config(model_dict.get('clip_config'))
+    executor = model_dict.get('executor')
+    setting = input_data['timeline']
+
+    try:
+        config = make_timeline_config(setting if isinstance(setting, dict) else None)
+        if segments is None:
+            transcriber = model_dict['transcriber']
+            before = transcript_cache_counts(transcriber)
+            with trace.stage("transcription"):
+                segments = transcriber.transcribe(video_path)["segments"]
+            observe_transcript_cache(trace, transcriber, before)
+        segments = [{'start': s['start'], 'end': s['end'], 'text': s['text']} for s in segments]
+
+        duration = probe_video(video_path)['duration']
+        step, window = config['step'], config['window']
+        starts = window_starts(duration, step, window)
+        texts, owners = window_texts(segments, starts, window)
+
+        # BERT once per distinct window text
+        unique_texts = list(dict.fromkeys(texts))
+        unique_features = encode_texts(model, model_dict['tokenizer'], unique_texts, device, trace,
+                                       executor=executor)
+        fallback = torch.zeros(1, 128, device=device)
+        features_by_text = {text: fallback if f is None else f
+                            for text, f in zip(unique_texts, unique_features)}
+
+        num_frames = clip_config['num_frames']
+        fps = num_frames / window
+        size = (clip_config['width'], clip_config['height'])
+        extractor = get_mel_extractor(device)
+        emotion_probs, sentiment_probs, scored = [], [], 0
+        for block in window_blocks(starts, config['block_seconds']):
+            block_start, block_end = block[0], block[-1] + window
+            with trace.stage("frame_decode", windows=len(block)):
+                frames = torch.from_numpy(decode_video_rate(
+                    video_path, fps, size, start_time=block_start, end_time=block_end))
+                frames = frame_windows(
+                    frames, [round((s - block_start) * fps) for s in block], num_frames)
+            with trace.stage("mel_extraction", windows=len(block)):
+                waveform = decode_audio(video_path, SAMPLE_RATE,
+                                        start_time=block_start, end_time=block_end)
+                with torch.inference_mode():
+                    mels = extractor.windows(
+                        waveform, [(s - block_start) * SAMPLE_RATE for s in block],
+                        int(window * SAMPLE_RATE))
+
+            for first in range(0, len(block), config['batch_size']):
+                batch = slice(first, first + config['batch_size'])
+                count = len(block[batch])
+                text_features = torch.cat(
+                    [features_by_text[t] for t in texts[scored:scored + count]])
+                scored += count
+                with torch.inference_mode(), trace.stage("forward", windows=count):
+                    video_features = run_model(executor, model.video_encoder,
+                                               sanitize_video(scale_frames(frames[batch].to(device))))
+                    audio_features = run_model(executor, model.audio_encoder, sanitize_audio(mels[batch]))
+                    outputs = run_model(executor, model.classify,
+                                        text_features, video_features, audio_features)
+                emotion_probs.append(torch.softmax(outputs['emotions'].float(), dim=1).cpu())
+                sentiment_probs.append(torch.softmax(outputs['sentiments'].float(), dim=1).cpu())
+    except Exception:
+        pop_trace(trace.request_id)
+        trace.finish(status="error")
+        raise
+
+    METRICS.inc_segment("ok", len(starts))
+    trace.attributes.update(segments=len(segments), windows=len(starts))
+    logger.info(f"Timeline: {len(starts)} windows of {window}s every {step}s")
+    timeline = columnar_timeline(
+        config, starts, owners, torch.cat(emotion_probs), torch.cat(sentiment_probs),
+        [EMOTION_MAP[i] for i in range(len(EMOTION_MAP))],
+        [SENTIMENT_MAP[i] for i in range(len(SENTIMENT_MAP))])
+    return {"timeline": timeline, "segments": segments, "request_id": trace.request_id}
+
+
+def score_segments(video_path, segments, model_dict, trace, cascade=None, stats=None,
+                   first_index=0, embeddings=None):
+    """Yield the prediction for each transcribed segment, in order.
+
+    Model failures fall back to uniform predictions; segments whose
+    preprocessing fails are dropped. Skips by the cascade are counted in
+    stats['cascade_skipped']. With an embeddings list, (segment, outputs)
+    is appended for every segment the full model scored, outputs carrying
+    the encoder and fused features.
+    """
+    model = model_dict['model']
+    device = model_dict['device']
+    executor = model_dict.get('executor')
+    utterance_processor = VideoUtteranceProcessor(model_dict.get('clip_config'))
+    stats = stats if stats is not None else {'cascade_skipped': 0}
+
+    # BERT runs once per micro-batch of similar-length utterances, and not at
+    # all for utterances already in the embedding cache
+    text_cache = model.text_encoder.embedding_cache
+    before = text_cache.stats() if text_cache is not None else None
+    segment_text_features = encode_texts(
+        model, model_dict['tokenizer'], [segment["text"] for segment in segments], device, trace,
+        executor=executor)
+    if text_cache is not None:
+        after = text_cache.stats()
+        delta = {k: after[k] - before[k] for k in ('hits', 'disk_hits', 'misses')}
+        METRICS.observe_text_cache(entries=after['entries'], **delta)
+        totals = trace.attributes.setdefault('text_cache', dict.fromkeys(delta, 0))
+        for k, v in delta.items():
+            totals[k] += v
+
+    for offset, segment in enumerate(segments):
+        index = first_index + offset
         try:
-            segment_path = utterance_processor.extract_segment(
-                video_path,
-                segment["start"],
-                segment["end"]
-            )
-
-            video_frames = utterance_processor.video_processor.process_video(
-                segment_path)
-            audio_features = utterance_processor.audio_processor.extract_features(
-                segment_path)
-            text_inputs = tokenizer(
-                segment["text"],
-                padding="max_length",
-                truncation=True,
-                max_length=128,
-                return_tensors="pt"
-            )
-
-            # Move to device
-            text_inputs = {k: v.to(device) for k, v in text_inputs.items()}
-            video_frames = video_frames.unsqueeze(0).to(device)
-            audio_features = audio_features.unsqueeze(0).to(device)
-
-            # Fix: Add input validation and normalization
-            # Check for NaN in inputs
-            if torch.isnan(video_frames).any():
-                print("❌ NaN detected in video input, replacing with zeros")
-                video_frames = torch.nan_to_num(video_frames, nan=0.0)
-            
-            if torch.isnan(audio_features).any():
-                print("❌ NaN detected in audio input, replacing with zeros")
-                audio_features = torch.nan_to_num(audio_features, nan=0.0)
-            
-            # Normalize inputs to prevent numerical instability
-            if video_frames.abs().max() > 1.0:
-                video_frames = torch.clamp(video_frames, -1.0, 1.0)
-            
-            if audio_features.abs().max() > 10.0:
-                audio_features = torch.clamp(audio_features, -10.0, 10.0)
-
-            # Get predictions
-            with torch.inference_mode():
-                # Debug: Check inputs before model
-                print(f"Text input shape: {text_inputs['input_ids'].shape}")
-                print(f"Video input shape: {video_frames.shape}")
-                print(f"Audio input shape: {audio_features.shape}")
-                
-                # Check for NaN in inputs
-                if torch.isnan(video_frames).any():
-                    print("❌ NaN in video input!")
-                if torch.isnan(audio_features).any():
-                    print("❌ NaN in audio input!")
-                
+            # Audio and frames are decoded straight from the source time range,
+            # no segment is cut and re-encoded first
+            with trace.stage("mel_extraction", segment=index):
+                audio_features = utterance_processor.audio_processor.extract_features(
+                    video_path, start_time=segment["start"], end_time=segment["end"])
+            audio_features = sanitize_audio(audio_features.unsqueeze(0).to(device))
+
+            # Model failures fall back to uniform predictions, as before;
+            # preprocessing failures drop the segment
+            outputs = None
+            model_failed = False
+            try:
+                text_features = segment_text_features[offset]
+                if text_features is None:
+                    raise ValueError("text encoding failed")
+                with torch.inference_mode(), trace.stage("forward", segment=index):
+                    audio_encoded = run_model(executor, model.audio_encoder, audio_features)
+
+                    if cascade is not None:
+                        cascade_outputs = run_model(
+                            executor, cascade['head'], text_features, audio_encoded)
+                        confidence = cascade_confidence(
+                            cascade_outputs, cascade['criterion']).item()
+                        if confidence >= cascade['threshold']:
+                            outputs = cascade_outputs
+                            stats['cascade_skipped'] += 1
+            except Exception as e:
+                logger.error(f"Model inference failed: {e}")
+                model_failed = True
+
+            if outputs is None and not model_failed:
+                with trace.stage("frame_decode", segment=index):
+                    video_frames = utterance_processor.video_processor.process_video(
+                        video_path, segment["start"], segment["end"])
+                video_frames = sanitize_video(video_frames.unsqueeze(0).to(device))
+
                 try:
-                    outputs = model(text_inputs, video_frames, audio_features)
-                    
-                    # Debug: Check raw outputs before softmax
-                    print(f"Raw emotion output: {outputs['emotions']}")
-                    print(f"Raw sentiment output: {outputs['sentiments']}")
-                    
-                    # Fix: Handle NaN outputs gracefully
-                    if torch.isnan(outputs["emotions"]).any():
-                        print("❌ NaN detected in raw emotion output! Using uniform distribution")
-                        outputs["emotions"] = torch.ones_like(outputs["emotions"]) * 1.0/7.0
-                    
-                    if torch.isnan(outputs["sentiments"]).any():
-                        print("❌ NaN detected in raw sentiment output! Using uniform distribution")
-                        outputs["sentiments"] = torch.ones_like(outputs["sentiments"]) * 1.0/3.0
-                    
-                    # Apply softmax with numerical stability
-                    emotion_probs = torch.softmax(outputs["emotions"], dim=1)[0]
-                    sentiment_probs = torch.softmax(outputs["sentiments"], dim=1)[0]
-
-                    emotion_values, emotion_indices = torch.topk(emotion_probs, 3)
-                    sentiment_values, sentiment_indices = torch.topk(
-                        sentiment_probs, 3)
-                        
+                    with torch.inference_mode(), trace.stage("video_forward", segment=index):
+                        video_features = run_model(executor, model.video_encoder, video_frames)
+                        classify = model.classify if embeddings is None else model.classify_with_features
+                        outputs = run_model(executor, classify,
+                                            text_features, video_features, audio_encoded)
                 except Exception as e:
-                    print(f"❌ Model inference failed: {e}")
-                    # Fallback to uniform predictions
-                    emotion_probs = torch.ones(7) / 7.0
-                    sentiment_probs = torch.ones(3) / 3.0
-                    emotion_values, emotion_indices = torch.topk(emotion_probs, 3)
-                    sentiment_values, sentiment_indices = torch.topk(sentiment_probs, 3)
-
-            predictions.append({
-                "start_time": segment["start"],
-                "end_time": segment["end"],
-                "text": segment["text"],
-                "emotions": [
-                    {"label": EMOTION_MAP[idx.item()], "confidence": conf.item()} for idx, conf in zip(emotion_indices, emotion_values)
-                ],
-                "sentiments": [
-                    {"label": SENTIMENT_MAP[idx.item()], "confidence": conf.item()} for idx, conf in zip(sentiment_indices, sentiment_values)
-                ]
-            })
+                    logger.error(f"Model inference failed: {e}")
 
+            prediction = format_utterance(segment, outputs)
+            if embeddings is not None and outputs is not None and 'fused_features' in outputs:
+                embeddings.append((segment, outputs))
+            METRICS.inc_segment("ok")
         except Exception as e:
-            print("Segment failed inference: " + str(e))
+            METRICS.inc_segment("failed")
+            logger.warning(f"Segment {index} failed inference: {e}")
+            continue
+        yield prediction
+
+
+def length_batches(lengths, batch_size):
+    """Indices grouped into batches of similar length (shortest first)"""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def encode_texts(model, tokenizer, texts, device, trace, batch_size=TEXT_BATCH_SIZE, executor=None):
+    """Text features ([1, 128] each, None where encoding failed) for every
+    text. Each micro-batch is padded only to its longest utterance, which
+    gives the same features as padding everything to 128 tokens."""
+    if not texts:
+        return []
+    with trace.stage("tokenization", texts=len(texts)):
+        with _TOKENIZER_LOCK:
+            token_ids = tokenizer(texts, truncation=True, max_length=128)['input_ids']
+
+    features = [None] * len(texts)
+    for batch in length_batches([len(ids) for ids in token_ids], batch_size):
+        try:
+            with torch.inference_mode(), trace.stage(
+                    "text_encoding", batch_size=len(batch), tokens=len(token_ids[batch[-1]])):
+                with _TOKENIZER_LOCK:
+                    text_inputs = tokenizer.pad(
+                        {'input_ids': [token_ids[i] for i in batch]}, return_tensors="pt")
+                # Padded lengths differ between requests: run alone, not batched
+                batch_features = run_model(executor, model.encode_text,
+                                           {k: v.to(device) for k, v in text_inputs.items()})
+            for row, i in enumerate(batch):
+                features[i] = batch_features[row:row + 1]
+        except Exception as e:
+            logger.error(f"Text encoding failed: {e}")
+    return features
+
+
+def sanitize_video(video_frames):
+    # Fix: Add input validation and normalization
+    if torch.isnan(video_frames).any():
+        logger.warning("NaN detected in video input, replacing with zeros")
+        video_frames = torch.nan_to_num(video_frames, nan=0.0)
+
+    # Normalize inputs to prevent numerical instability
+    if video_frames.abs().max() > 1.0:
+        video_frames = torch.clamp(video_frames, -1.0, 1.0)
+    return video_frames
+
+
+def sanitize_audio(audio_features):
+    if torch.isnan(audio_features).any():
+        logger.warning("NaN detected in audio input, replacing with zeros")
+        audio_features = torch.nan_to_num(audio_features, nan=0.0)
+
+    if audio_features.abs().max() > 10.0:
+        audio_features = torch.clamp(audio_features, -10.0, 10.0)
+    return audio_features
+
 
-        finally:
-            # Cleanup
-            if os.path.exists(segment_path):
-                os.remove(segment_path)
-    return {"utterances": predictions}
+def format_utterance(segment, outputs):
+    """Top-3 emotions and sentiments for one segment; uniform when the model failed"""
+    if outputs is None:
+        emotion_probs = torch.ones(7) / 7.0
+        sentiment_probs = torch.ones(3) / 3.0
+    else:
+        emotion_logits = outputs["emotions"]
+        sentiment_logits = outputs["sentiments"]
+
+        # Fix: Handle NaN outputs gracefully
+        if torch.isnan(emotion_logits).any():
+            logger.warning("NaN detected in raw emotion output, using uniform distribution")
+            emotion_logits = torch.ones_like(emotion_logits) * 1.0/7.0
+
+        if torch.isnan(sentiment_logits).any():
+            logger.warning("NaN detected in raw sentiment output, using uniform distribution")
+            sentiment_logits = torch.ones_like(sentiment_logits) * 1.0/3.0
+
+        emotion_probs = torch.softmax(emotion_logits, dim=1)[0]
+        sentiment_probs = torch.softmax(sentiment_logits, dim=1)[0]
+
+    emotion_values, emotion_indices = torch.topk(emotion_probs, 3)
+    sentiment_values, sentiment_indices = torch.topk(sentiment_probs, 3)
+
+    return {
+        "start_time": segment["start"],
+        "end_time": segment["end"],
+        "text": segment["text"],
+        "emotions": [
+            {"label": EMOTION_MAP[idx.item()], "confidence": conf.item()} for idx, conf in zip(emotion_indices, emotion_values)
+        ],
+        "sentiments": [
+            {"label": SENTIMENT_MAP[idx.item()], "confidence": conf.item()} for idx, conf in zip(sentiment_indices, sentiment_values)
+        ]
+    }
 
 
 def process_local_video(video_path, model_dir="model"):
@@ -489,6 +1073,8 @@ def process_local_video(video_path, model_dir="model"):
     input_data = {'video_path': video_path}
 
     predictions = predict_fn(input_data, model_dict)
+    trace = pop_trace(predictions["request_id"])
+    trace_path = trace.finish()
 
     for utterance in predictions["utterances"]:
         print("\nUtterance:")
@@ -503,6 +1089,9 @@ def process_local_video(video_path, model_dir="model"):
             print(f"{sentiment['label']}: {sentiment['confidence']:.2f}")
         print("-"*50)
 
+    if trace_path:
+        print(f"Trace written to {trace_path}")
+
 
 if __name__ == "__main__":
     process_local_video("./joy.mp4")
\ No newline at end of file
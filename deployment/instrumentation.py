@@ -0,0 +1,475 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Per-request instrumentation for the inference pipeline: leveled logging
+# tagged with a request id, per-stage timers with peak RSS, Prometheus-style
+# counters/histograms and a JSON trace written for every request.
+
+TRACE_DIR = os.environ.get('INFERENCE_TRACE_DIR', '/tmp/inference-traces')
+# Newest trace files kept in TRACE_DIR (0 keeps all)
+TRACE_MAX_FILES = int(os.environ.get('INFERENCE_TRACE_MAX_FILES', '1000'))
+METRICS_PATH = os.environ.get('INFERENCE_METRICS_PATH')
+LOG_LEVEL = os.environ.get('INFERENCE_LOG_LEVEL', 'INFO')
+
+# Seconds; covers everything from tokenization (~ms) to ASR on long videos
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+_request_id = contextvars.ContextVar('request_id', default='-')
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+def configure_logging(level=LOG_LEVEL):
+    """Attach a request-id aware handler to the inference logger once"""
+    logger = logging.getLogger('inference')
+    if not any(isinstance(f, _RequestIdFilter) for h in logger.handlers for f in h.filters):
+        handler = logging.StreamHandler()
+        handler.addFilter(_RequestIdFilter())
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+    return logger
+
+
+def get_logger(name='inference'):
+    if not name.startswith('inference'):
+        name = f'inference.{name}'
+    return logging.getLogger(name)
+
+
+def _read_proc_status(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    # Values are reported in kB
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_bytes():
+    rss = _read_proc_status('VmRSS')
+    if rss is None:
+        # ru_maxrss is in kB on Linux; best available fallback elsewhere
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return rss
+
+
+def peak_rss_bytes():
+    peak = _read_proc_status('VmHWM')
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return peak
+
+
+def reset_peak_rss():
+    """Reset the kernel's RSS high-water mark so the next stage gets its own peak.
+
+    Returns False when the kernel does not allow it; callers then fall back to
+    sampling RSS at the stage boundaries.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def process_memory(pid='self'):
+    """RSS, PSS, shared and private bytes of a process from
+    /proc/<pid>/smaps_rollup. PSS charges each shared page to the processes
+    mapping it in equal parts, so it sums to the real total over a process
+    tree. None where smaps_rollup is unavailable."""
+    fields = {'Rss': 'rss', 'Pss': 'pss', 'Shared_Clean': 'shared', 'Shared_Dirty': 'shared',
+              'Private_Clean': 'private', 'Private_Dirty': 'private'}
+    memory = dict.fromkeys(('rss', 'pss', 'shared', 'private'), 0)
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    memory[fields[name]] += int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return None
+    return memory
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} counter']
+        for key, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        self.values[_label_key(labels)] = value
+
+    def set_max(self, value, **labels):
+        key = _label_key(labels)
+        self.values[key] = max(self.values.get(key, value), value)
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f'# TYPE {self.name} gauge'
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        counts, total, count = self.values.get(
+            key, ([0] * len(self.buckets), 0.0, 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in sorted(self.values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(
+                    f'{self.name}_bucket{_format_labels(key, {"le": bound})} {bucket_count}')
+            lines.append(
+                f'{self.name}_bucket{_format_labels(key, {"le": "+Inf"})} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter(
+            'inference_requests_total', 'Inference requests by status')
+        self.segments = Counter(
+            'inference_segments_total', 'Scored utterance segments by status')
+        self.stage_seconds = Histogram(
+            'inference_stage_seconds', 'Wall time per pipeline stage')
+        self.request_seconds = Histogram(
+            'inference_request_seconds', 'End-to-end wall time per request')
+        self.stage_peak_rss = Gauge(
+            'inference_stage_peak_rss_bytes', 'Highest resident set size seen per stage')
+        self.text_cache_lookups = Counter(
+            'inference_text_cache_lookups_total', 'Text embedding cache lookups by result')
+        self.text_cache_entries = Gauge(
+            'inference_text_cache_entries', 'Text embeddings held in memory')
+        self.transcript_cache_lookups = Counter(
+            'inference_transcript_cache_lookups_total', 'Transcript cache lookups by result')
+        self.segments_coalesced = Counter(
+            'inference_segments_coalesced_total', 'Transcribed segments merged or dropped before scoring')
+
+    def inc_request(self, status):
+        with self.lock:
+            self.requests.inc(status=status)
+
+    def inc_segment(self, status, amount=1):
+        with self.lock:
+            self.segments.inc(amount, status=status)
+
+    def observe_stage(self, stage, seconds, peak_rss):
+        with self.lock:
+            self.stage_seconds.observe(seconds, stage=stage)
+            self.stage_peak_rss.set_max(peak_rss, stage=stage)
+
+    def observe_text_cache(self, hits, disk_hits, misses, entries):
+        with self.lock:
+            self.text_cache_lookups.inc(hits, result='hit')
+            self.text_cache_lookups.inc(disk_hits, result='disk_hit')
+            self.text_cache_lookups.inc(misses, result='miss')
+            self.text_cache_entries.set(entries)
+
+    def observe_transcript_cache(self, hits, disk_hits, misses):
+        with self.lock:
+            self.transcript_cache_lookups.inc(hits, result='hit')
+            self.transcript_cache_lookups.inc(disk_hits, result='disk_hit')
+            self.transcript_cache_lookups.inc(misses, result='miss')
+
+    def observe_segmentation(self, merged, dropped):
+        with self.lock:
+            self.segments_coalesced.inc(merged, result='merged')
+            self.segments_coalesced.inc(dropped, result='dropped')
+
+    def observe_request(self, seconds):
+        with self.lock:
+            self.request_seconds.observe(seconds)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in (self.requests, self.segments, self.stage_seconds,
+                           self.request_seconds, self.stage_peak_rss,
+                           self.text_cache_lookups, self.text_cache_entries,
+                           self.transcript_cache_lookups, self.segments_coalesced):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Write in node-exporter textfile format (atomic rename)"""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+METRICS = MetricsRegistry()
+
+
+_trace_writes = 0
+_trace_writes_lock = threading.Lock()
+
+
+def prune_traces(trace_dir, max_files=TRACE_MAX_FILES):
+    """Delete all but the newest max_files traces in trace_dir"""
+    if max_files <= 0:
+        return 0
+    traces = []
+    for entry in os.scandir(trace_dir):
+        if entry.name.endswith('.json'):
+            try:
+                traces.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    removed = 0
+    for _, path in sorted(traces)[:max(0, len(traces) - max_files)]:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            # Pruned by another worker
+            pass
+    return removed
+
+
+def _maybe_prune_traces(trace_dir):
+    # A directory scan per request would be wasteful: prune on the first
+    # write and then every tenth of max_files writes
+    global _trace_writes
+    with _trace_writes_lock:
+        _trace_writes += 1
+        due = (_trace_writes - 1) % max(1, TRACE_MAX_FILES // 10) == 0
+    if due:
+        prune_traces(trace_dir)
+
+
+# Stages running right now in any thread, each with a flag set once
+# another stage overlaps it
+_open_stages = {}
+_open_stages_lock = threading.Lock()
+
+
+class RequestTrace:
+    """Collects the timed stages of one request and writes them as a JSON trace"""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans = []
+        # Streaming requests keep only the per-stage totals, see summary
+        self.keep_spans = True
+        self._summary = {}
+        self.attributes = {}
+        self._token = _request_id.set(self.request_id)
+        self.finished = False
+        # Cleanups (e.g. releasing downloaded inputs) run when the request ends
+        self.finish_callbacks = []
+
+    @contextmanager
+    def stage(self, name, **attributes):
+        """Time a stage and measure its peak RSS.
+
+        The kernel's high-water mark is per process, so it is only reset (and
+        read back as the stage's own peak) while no other stage of any request
+        is running. A stage that overlaps another reports the larger RSS at
+        its boundaries as peak_rss_bytes and the process-wide high-water mark
+        separately as process_peak_rss_bytes.
+        """
+        rss_before = current_rss_bytes()
+        overlap = [False]
+        with _open_stages_lock:
+            if _open_stages:
+                overlap[0] = True
+                for other in _open_stages.values():
+                    other[0] = True
+            _open_stages[id(overlap)] = overlap
+            has_peak = not overlap[0] and reset_peak_rss()
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            yield
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            rss_after = current_rss_bytes()
+            with _open_stages_lock:
+                _open_stages.pop(id(overlap))
+            own_peak = has_peak and not overlap[0]
+            peak = peak_rss_bytes() if own_peak else max(rss_before, rss_after)
+            self._add_to_summary(name, duration, peak)
+            if self.keep_spans:
+                span = {
+                    'stage': name,
+                    'offset_s': start - self.start,
+                    'duration_s': duration,
+                    'rss_before_bytes': rss_before,
+                    'rss_after_bytes': rss_after,
+                    'peak_rss_bytes': peak,
+                    'peak_rss_scope': 'stage' if own_peak else 'boundaries',
+                    'status': status,
+                    **attributes
+                }
+                if overlap[0]:
+                    span['process_peak_rss_bytes'] = peak_rss_bytes()
+                self.spans.append(span)
+            METRICS.observe_stage(name, duration, peak)
+            get_logger().debug(
+                f"stage={name} duration={duration * 1000:.1f}ms peak_rss={peak / 1024**2:.1f}MB")
+
+    def _add_to_summary(self, name, duration, peak):
+        entry = self._summary.setdefault(
+            name, {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'peak_rss_bytes': 0})
+        entry['count'] += 1
+        entry['total_s'] += duration
+        entry['max_s'] = max(entry['max_s'], duration)
+        entry['peak_rss_bytes'] = max(entry['peak_rss_bytes'], peak)
+
+    def summary(self):
+        # Kept up to date by stage(), also when spans are not kept
+        return {name: dict(entry) for name, entry in self._summary.items()}
+
+    def on_finish(self, callback):
+        self.finish_callbacks.append(callback)
+
+    def finish(self, status='ok', trace_dir=TRACE_DIR):
+        if self.finished:
+            return None
+        self.finished = True
+        elapsed = time.perf_counter() - self.start
+        for callback in self.finish_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                get_logger().warning(f"Request cleanup failed: {e}")
+        METRICS.inc_request(status)
+        METRICS.observe_request(elapsed)
+
+        trace = {
+            'request_id': self.request_id,
+            'started_at': self.started_at,
+            'status': status,
+            'total_s': elapsed,
+            'attributes': self.attributes,
+            'summary': self.summary(),
+            'spans': self.spans
+        }
+
+        path = None
+        if trace_dir:
+            try:
+                os.makedirs(trace_dir, exist_ok=True)
+                path = os.path.join(trace_dir, f'{self.request_id}.json')
+                with open(path, 'w') as f:
+                    json.dump(trace, f, indent=2)
+                _maybe_prune_traces(trace_dir)
+            except OSError as e:
+                get_logger().warning(f"Could not write trace: {e}")
+                path = None
+
+        if METRICS_PATH:
+            try:
+                METRICS.write_textfile(METRICS_PATH)
+            except OSError as e:
+                get_logger().warning(f"Could not write metrics: {e}")
+
+        get_logger().info(
+            f"request finished status={status} total={elapsed:.2f}s "
+            + ' '.join(f"{name}={entry['total_s']:.2f}s" for name, entry in trace['summary'].items()))
+        try:
+            _request_id.reset(self._token)
+        except ValueError:
+            # Finished from a different context than it was started in
+            pass
+        return path
+
+
+_active_traces = {}
+_active_lock = threading.Lock()
+
+
+# Client request ids name trace files and scratch directories
+REQUEST_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+def start_trace(request_id=None):
+    """Start and register a request's trace. A client's request id is kept
+    only if it matches REQUEST_ID, otherwise a new one is generated; an id
+    already in flight gets a random suffix so requests never share a trace."""
+    if not (isinstance(request_id, str) and REQUEST_ID.fullmatch(request_id)):
+        request_id = None
+    with _active_lock:
+        if request_id in _active_traces:
+            request_id = f'{request_id}-{uuid.uuid4().hex[:8]}'
+        trace = RequestTrace(request_id)
+        _active_traces[trace.request_id] = trace
+    return trace
+
+
+def get_trace(request_id):
+    with _active_lock:
+        return _active_traces.get(request_id)
+
+
+def pop_trace(request_id):
+    with _active_lock:
+        return _active_traces.pop(request_id, None)
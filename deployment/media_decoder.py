@@ -0,0 +1,239 @@
+import os
+import subprocess
+import threading
+import cv2
+import numpy as np
+
+# ffmpeg decode backend: frame selection, scaling and pixel format conversion
+# run inside ffmpeg's filter graph and raw frames / PCM stream over stdout
+# straight into preallocated numpy buffers. No temp files, no per-frame
+# resize in Python.
+
+READ_CHUNK = 1 << 20
+
+
+def probe_video(video_path):
+    """Frame rate, frame count and duration from the container header"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise ValueError(f"Video not found: {video_path}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        return {
+            'fps': fps,
+            'frame_count': frame_count,
+            'duration': frame_count / fps if fps > 0 else 0.0,
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        }
+    finally:
+        cap.release()
+
+
+def _time_range_args(start_time=None, end_time=None):
+    # Input options: fast keyframe seek, then frame-accurate decode to start
+    args = []
+    if start_time is not None:
+        args += ['-ss', f'{start_time:.3f}']
+        if end_time is not None:
+            args += ['-t', f'{max(0.0, end_time - start_time):.3f}']
+    elif end_time is not None:
+        args += ['-t', f'{end_time:.3f}']
+    return args
+
+
+def _read_into(stream, buffer):
+    """Fill a flat uint8 buffer from a pipe; returns the number of bytes read"""
+    view = memoryview(buffer)
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:filled + READ_CHUNK])
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+def _raise_on_error(process, stderr, video_path):
+    if process.returncode != 0:
+        raise ValueError(f"ffmpeg failed on {video_path}: "
+                         f"{stderr.decode(errors='ignore').strip().splitlines()[-1:]}")
+
+
+def _kill(process):
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def _read_pcm(stream, capacity):
+    """Read s16le samples into a preallocated buffer, growing it if needed"""
+    pcm = np.empty(max(1, capacity), dtype=np.int16)
+    filled = 0
+    while True:
+        filled += _read_into(stream, pcm.view(np.uint8)[filled:])
+        if filled < pcm.nbytes:
+            break
+        pcm = np.resize(pcm, pcm.size * 2)
+    return pcm[:filled // 2]
+
+
+def _pcm_to_float(pcm):
+    waveform = pcm.astype(np.float32)
+    waveform *= 1.0 / 32768.0
+    return waveform
+
+
+def _expected_duration(video_path, start_time, end_time):
+    if start_time is not None and end_time is not None:
+        return end_time - start_time
+    return probe_video(video_path)['duration']
+
+
+def _video_output_args(indices, size):
+    width, height = size
+    filters = [f"scale={width}:{height}:flags=bilinear", "format=bgr24"]
+    # A leading run of frames needs no select filter, -frames:v stops the decode
+    if list(indices) != list(range(len(indices))):
+        selection = '+'.join(f"eq(n\\,{int(i)})" for i in indices)
+        filters.insert(0, f"select='{selection}'")
+    return [
+        '-map', '0:v:0',
+        '-vf', ','.join(filters),
+        '-vsync', '0',
+        '-frames:v', str(len(indices)),
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24'
+    ]
+
+
+def _audio_output_args(sample_rate):
+    return [
+        '-map', '0:a:0',
+        '-ac', '1', '-ar', str(sample_rate),
+        '-f', 's16le', '-acodec', 'pcm_s16le'
+    ]
+
+
+def _input_args(video_path, start_time, end_time):
+    return ['ffmpeg', '-nostdin', '-loglevel', 'error',
+            *_time_range_args(start_time, end_time), '-i', video_path]
+
+
+def decode_video_frames(video_path, indices, size, start_time=None, end_time=None):
+    """Decode the given frame indices (relative to start_time) scaled to
+    size=(width, height) as a uint8 BGR array [n, height, width, 3].
+
+    Channels stay BGR to match the OpenCV frames the model was trained on.
+    Fewer than len(indices) frames are returned if the stream ends early.
+    """
+    width, height = size
+    frames = np.empty((len(indices), height, width, 3), dtype=np.uint8)
+    if len(indices) == 0:
+        return frames
+
+    cmd = _input_args(video_path, start_time, end_time) + \
+        _video_output_args(indices, size) + ['pipe:1']
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               stdin=subprocess.DEVNULL)
+    try:
+        filled = _read_into(process.stdout, frames.reshape(-1))
+        # Drain anything beyond the buffer so ffmpeg can exit cleanly
+        while process.stdout.read(READ_CHUNK):
+            pass
+        _, stderr = process.communicate()
+    finally:
+        _kill(process)
+    _raise_on_error(process, stderr, video_path)
+    return frames[:filled // (height * width * 3)]
+
+
+def decode_video_rate(video_path, fps, size, start_time=None, end_time=None):
+    """Frames resampled to a fixed rate by ffmpeg's fps filter (frame k at
+    start_time + k / fps), scaled to size=(width, height): uint8 BGR
+    [n, height, width, 3]"""
+    width, height = size
+    duration = _expected_duration(video_path, start_time, end_time)
+    capacity = int(np.ceil(duration * fps)) + 1
+    frames = np.empty((capacity, height, width, 3), dtype=np.uint8)
+
+    cmd = _input_args(video_path, start_time, end_time) + [
+        '-map', '0:v:0',
+        '-vf', f"fps={fps},scale={width}:{height}:flags=bilinear,format=bgr24",
+        '-frames:v', str(capacity),
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1'
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               stdin=subprocess.DEVNULL)
+    try:
+        filled = _read_into(process.stdout, frames.reshape(-1))
+        while process.stdout.read(READ_CHUNK):
+            pass
+        _, stderr = process.communicate()
+    finally:
+        _kill(process)
+    _raise_on_error(process, stderr, video_path)
+    return frames[:filled // (height * width * 3)]
+
+
+def decode_audio(video_path, sample_rate=16000, start_time=None, end_time=None, duration=None):
+    """Mono float32 waveform in [-1, 1] resampled by ffmpeg"""
+    if duration is None:
+        duration = _expected_duration(video_path, start_time, end_time)
+
+    cmd = _input_args(video_path, start_time, end_time) + \
+        _audio_output_args(sample_rate) + ['pipe:1']
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               stdin=subprocess.DEVNULL)
+    try:
+        # Some headroom over the expected length
+        pcm = _read_pcm(process.stdout, int((duration + 1.0) * sample_rate))
+        _, stderr = process.communicate()
+    finally:
+        _kill(process)
+    _raise_on_error(process, stderr, video_path)
+    return _pcm_to_float(pcm)
+
+
+def decode_clip(video_path, indices, size, sample_rate=16000, start_time=None, end_time=None,
+                duration=None):
+    """Frames and waveform from a single demux of the file.
+
+    One ffmpeg process writes the selected, scaled frames to stdout and the
+    16 kHz mono PCM to a second pipe, which a thread drains concurrently so
+    neither output can stall the other. Returns (uint8 frames, float32 waveform).
+    """
+    width, height = size
+    if duration is None:
+        duration = _expected_duration(video_path, start_time, end_time)
+
+    audio_read, audio_write = os.pipe()
+    cmd = _input_args(video_path, start_time, end_time) + \
+        _video_output_args(indices, size) + ['pipe:1'] + \
+        _audio_output_args(sample_rate) + [f'pipe:{audio_write}']
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   stdin=subprocess.DEVNULL, pass_fds=(audio_write,))
+    except OSError:
+        os.close(audio_read)
+        raise
+    finally:
+        os.close(audio_write)
+
+    audio = {}
+    with os.fdopen(audio_read, 'rb', buffering=0) as audio_stream:
+        reader = threading.Thread(target=lambda: audio.update(
+            pcm=_read_pcm(audio_stream, int((duration + 1.0) * sample_rate))))
+        reader.start()
+        try:
+            frames = np.empty((len(indices), height, width, 3), dtype=np.uint8)
+            filled = _read_into(process.stdout, frames.reshape(-1))
+            while process.stdout.read(READ_CHUNK):
+                pass
+            _, stderr = process.communicate()
+        finally:
+            _kill(process)
+            reader.join()
+    _raise_on_error(process, stderr, video_path)
+
+    return frames[:filled // (height * width * 3)], _pcm_to_float(audio['pcm'])
@@ -0,0 +1,138 @@
+"""
+One thread that runs every model call for concurrently served requests.
+
+Request threads submit calls (encoder forwards, classify, ...) and block
+on the result, so the shared model is only ever used from one thread.
+Calls to the same function that are queued together and take tensors of
+matching shapes are concatenated along the batch dimension and run as one
+forward (at most max_batch rows); the outputs are split back per caller.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+import torch
+
+
+class _Call:
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.rows = args[0].size(0) if self.batchable() else 0
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def batchable(self):
+        return bool(self.args) and all(isinstance(a, torch.Tensor) and a.dim() > 0 for a in self.args)
+
+    def matches(self, other):
+        return (self.fn == other.fn and len(self.args) == len(other.args) and all(
+            a.shape[1:] == b.shape[1:] and a.dtype == b.dtype and a.device == b.device
+            for a, b in zip(self.args, other.args)))
+
+
+def _split(outputs, sizes):
+    """Per-caller slices of a batched output (a tensor or a dict of tensors)"""
+    if isinstance(outputs, dict):
+        parts = {k: torch.split(v, sizes) for k, v in outputs.items()}
+        return [{k: v[i] for k, v in parts.items()} for i in range(len(sizes))]
+    return list(torch.split(outputs, sizes))
+
+
+class ModelExecutor:
+    def __init__(self, max_batch=8, max_wait_ms=2.0):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.backlog = deque()
+        self.calls = 0
+        self.batches = 0
+        self.thread = threading.Thread(target=self._loop, name='model-executor', daemon=True)
+        self.thread.start()
+
+    def run(self, fn, *args):
+        """fn(*args) on the executor thread, possibly batched with other callers"""
+        if threading.current_thread() is self.thread:
+            return fn(*args)
+        call = _Call(fn, args)
+        self.queue.put(call)
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _next(self):
+        if self.backlog:
+            return self.backlog.popleft()
+        return self.queue.get()
+
+    def _gather(self, call):
+        """call plus the matching calls queued within max_wait"""
+        group, rows, skipped = [call], call.rows, []
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch:
+            if self.backlog:
+                other = self.backlog.popleft()
+            else:
+                try:
+                    other = self.queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+            if other is not None and other.batchable() and other.matches(call) \
+                    and rows + other.rows <= self.max_batch:
+                group.append(other)
+                rows += other.rows
+            else:
+                skipped.append(other)
+                if other is None:
+                    break
+        self.backlog.extendleft(reversed(skipped))
+        return group
+
+    def _loop(self):
+        while True:
+            call = self._next()
+            if call is None:
+                return
+            group = self._gather(call) if call.batchable() else [call]
+            self.calls += len(group)
+            self.batches += 1
+            self._execute(group)
+
+    def _execute(self, group):
+        try:
+            with torch.inference_mode():
+                if len(group) == 1:
+                    group[0].result = group[0].fn(*group[0].args)
+                else:
+                    inputs = [torch.cat(args) for args in zip(*(c.args for c in group))]
+                    results = _split(group[0].fn(*inputs), [c.rows for c in group])
+                    for c, result in zip(group, results):
+                        c.result = result
+        except Exception as e:
+            if len(group) > 1:
+                # One bad input must not fail the others: run them one by one
+                for c in group:
+                    self._execute([c])
+                return
+            group[0].error = e
+        for c in group:
+            c.done.set()
+
+    def stats(self):
+        return {'calls': self.calls, 'batches': self.batches,
+                'mean_batch': self.calls / self.batches if self.batches else 0.0}
+
+
+def run_model(executor, fn, *args):
+    """fn(*args) through the executor when requests are served concurrently"""
+    if executor is None:
+        return fn(*args)
+    return executor.run(fn, *args)
@@ -2,6 +2,9 @@ import torch
 import torch.nn as nn
 from transformers import BertModel
 from torchvision import models as vision_models
+from clip_config import make_clip_config
+from embedding_cache import TextEmbeddingCache, token_key, weights_fingerprint
+from concurrent.futures import ThreadPoolExecutor
 
 
 class TextEncoder(nn.Module):
@@ -13,8 +16,20 @@ class TextEncoder(nn.Module):
             param.requires_grad = False
 
         self.projection = nn.Linear(768, 128)
+        # Opt-in pooler output cache, see enable_cache
+        self.embedding_cache = None
+
+    def enable_cache(self, max_items=8192, spill_dir=None):
+        """Cache BERT pooler outputs by token ids. Only used in eval mode:
+        in train mode BERT's dropout makes the output non-deterministic."""
+        self.embedding_cache = TextEmbeddingCache(max_items, spill_dir)
+        self.embedding_cache.bind(weights_fingerprint(self.bert))
+        return self.embedding_cache
 
     def forward(self, input_ids, attention_mask):
+        if self.embedding_cache is not None and not self.bert.training:
+            return self.projection(self._cached_pooler_output(input_ids, attention_mask))
+
         # Extract BERT embeddings
         outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask)
 
@@ -23,6 +38,30 @@ class TextEncoder(nn.Module):
 
         return self.projection(pooler_output)
 
+    def _cached_pooler_output(self, input_ids, attention_mask):
+        lengths = attention_mask.sum(dim=1).tolist()
+        keys = [token_key(ids[:length]) for ids, length in zip(input_ids.tolist(), lengths)]
+        # One lookup (and at most one BERT row) per distinct utterance in the batch
+        first_row = {}
+        for i, key in enumerate(keys):
+            first_row.setdefault(key, i)
+        pooled = {key: self.embedding_cache.get(key) for key in first_row}
+
+        # BERT only for the misses, padded to the longest of them
+        missing = [key for key, value in pooled.items() if value is None]
+        if missing:
+            rows = [first_row[key] for key in missing]
+            width = max(lengths[i] for i in rows)
+            rows = torch.tensor(rows, device=input_ids.device)
+            outputs = self.bert(input_ids=input_ids[rows, :width],
+                                attention_mask=attention_mask[rows, :width])
+            for row, key in enumerate(missing):
+                pooled[key] = outputs.pooler_output[row]
+                self.embedding_cache.put(key, pooled[key])
+
+        return torch.stack([pooled[key].to(input_ids.device, self.projection.weight.dtype)
+                            for key in keys])
+
 
 class VideoEncoder(nn.Module):
     def __init__(self):
@@ -40,6 +79,7 @@ class VideoEncoder(nn.Module):
         )
 
     def forward(self, x):
+        # Any clip geometry works: r3d_18 ends in adaptive pooling
         # [batch_size, frames, channels, height, width]->[batch_size, channels, frames, height, width]
         x = x.transpose(1, 2)
         return self.backbone(x)
@@ -79,15 +119,41 @@ class AudioEncoder(nn.Module):
         return self.projection(features.squeeze(-1))
 
 
+def encoder_thread_split(total_threads):
+    """Intra-op threads for (text, video, audio) when the encoders run
+    concurrently: video (r3d_18) is the heaviest, text and audio share the rest"""
+    text = max(1, total_threads // 4)
+    audio = max(1, total_threads // 8)
+    return text, max(1, total_threads - text - audio), audio
+
+
+def _in_caller_mode(fn):
+    """Grad / inference mode are thread-local: run fn under the caller's"""
+    grad_enabled = torch.is_grad_enabled()
+    inference = torch.is_inference_mode_enabled()
+
+    def run(*args):
+        with torch.inference_mode(inference), torch.set_grad_enabled(grad_enabled):
+            return fn(*args)
+    return run
+
+
 class MultimodalSentimentModel(nn.Module):
-    def __init__(self):
+    def __init__(self, clip_config=None):
         super().__init__()
 
+        # Video input geometry; saved with the checkpoint
+        self.clip_config = make_clip_config(clip_config)
+
         # Encoders
         self.text_encoder = TextEncoder()
         self.video_encoder = VideoEncoder()
         self.audio_encoder = AudioEncoder()
+        # Opt-in concurrent encoders, see enable_parallel_encoders
+        self.encoder_pools = None
+        self._build_heads()
 
+    def _build_heads(self):
         # Fusion layer
         self.fusion_layer = nn.Sequential(
             nn.Linear(128 * 3, 256),
@@ -111,14 +177,13 @@ class MultimodalSentimentModel(nn.Module):
             nn.Linear(64, 3)  # Negative, positive, neutral
         )
 
-    def forward(self, text_inputs, video_frames, audio_features):
-        text_features = self.text_encoder(
+    def encode_text(self, text_inputs):
+        return self.text_encoder(
             text_inputs['input_ids'],
             text_inputs['attention_mask'],
         )
-        video_features = self.video_encoder(video_frames)
-        audio_features = self.audio_encoder(audio_features)
 
+    def classify(self, text_features, video_features, audio_features, return_features=False):
         # Concatenate multimodal features
         combined_features = torch.cat([
             text_features,
@@ -131,7 +196,119 @@ class MultimodalSentimentModel(nn.Module):
         emotion_output = self.emotion_classifier(fused_features)
         sentiment_output = self.sentiment_classifier(fused_features)
 
-        return {
+        outputs = {
             'emotions': emotion_output,
             'sentiments': sentiment_output
-        }
\ No newline at end of file
+        }
+        if return_features:
+            # Per-modality and fused embeddings, e.g. for the embedding store
+            outputs.update(text_features=text_features, video_features=video_features,
+                           audio_features=audio_features, fused_features=fused_features)
+        return outputs
+
+    def classify_with_features(self, text_features, video_features, audio_features):
+        return self.classify(text_features, video_features, audio_features, return_features=True)
+
+    def enable_parallel_encoders(self, num_threads=None):
+        """Run the text, video and audio encoders concurrently in forward.
+
+        Each encoder gets its own worker thread with a fixed share of the
+        intra-op threads (encoder_thread_split of num_threads, default
+        torch.get_num_threads()), so the three do not oversubscribe the cores.
+        Only pays off on CPU hosts with several cores per model.
+        """
+        self.disable_parallel_encoders()
+        threads = encoder_thread_split(num_threads or torch.get_num_threads())
+        self.encoder_pools = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{name}_encoder',
+                               initializer=torch.set_num_threads, initargs=(count,))
+            for name, count in zip(('text', 'video', 'audio'), threads)
+        ]
+        return threads
+
+    def disable_parallel_encoders(self):
+        if self.encoder_pools is not None:
+            for pool in self.encoder_pools:
+                pool.shutdown()
+            self.encoder_pools = None
+
+    def encode(self, text_inputs, video_frames, audio_features):
+        """(text, video, audio) features, concurrently when enabled"""
+        if self.encoder_pools is None:
+            return (self.encode_text(text_inputs),
+                    self.video_encoder(video_frames),
+                    self.audio_encoder(audio_features))
+
+        encoders = (self.encode_text, self.video_encoder, self.audio_encoder)
+        inputs = (text_inputs, video_frames, audio_features)
+        futures = [pool.submit(_in_caller_mode(encoder), x)
+                   for pool, encoder, x in zip(self.encoder_pools, encoders, inputs)]
+        return tuple(future.result() for future in futures)
+
+    def forward(self, text_inputs, video_frames, audio_features):
+        text_features, video_features, audio_features = self.encode(
+            text_inputs, video_frames, audio_features)
+
+        return self.classify(text_features, video_features, audio_features)
+
+
+class FusionHeads(nn.Module):
+    """The fusion layer and classifier heads of MultimodalSentimentModel
+    without the encoders, to score stored encoder features"""
+
+    HEAD_MODULES = ('fusion_layer', 'emotion_classifier', 'sentiment_classifier')
+
+    def __init__(self):
+        super().__init__()
+        MultimodalSentimentModel._build_heads(self)
+
+    classify = MultimodalSentimentModel.classify
+
+    def forward(self, text_features, video_features, audio_features):
+        return self.classify(text_features, video_features, audio_features)
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        """Heads with the weights of a full model's state dict"""
+        heads = cls()
+        heads.load_state_dict({k: v for k, v in state_dict.items()
+                               if k.split('.')[0] in cls.HEAD_MODULES})
+        return heads
+
+
+class TextAudioHead(nn.Module):
+    """Lightweight emotion/sentiment heads over the text and audio features
+    only, used to skip the video encoder when they are confident enough"""
+
+    def __init__(self):
+        super().__init__()
+        self.fusion_layer = nn.Sequential(
+            nn.Linear(128 * 2, 128),
+            nn.ReLU(),
+            nn.Dropout(0.2)
+        )
+        self.emotion_classifier = nn.Linear(128, 7)
+        self.sentiment_classifier = nn.Linear(128, 3)
+
+    def forward(self, text_features, audio_features):
+        fused_features = self.fusion_layer(
+            torch.cat([text_features, audio_features], dim=1))
+
+        return {
+            'emotions': self.emotion_classifier(fused_features),
+            'sentiments': self.sentiment_classifier(fused_features)
+        }
+
+
+def cascade_confidence(outputs, criterion='margin'):
+    """Per-sample confidence of a cascade prediction: the lower of the
+    emotion and sentiment scores, so both tasks must be confident to skip"""
+    scores = []
+    for key in ('emotions', 'sentiments'):
+        probs = torch.softmax(outputs[key], dim=1)
+        top2 = probs.topk(2, dim=1).values
+        if criterion == 'margin':
+            scores.append(top2[:, 0] - top2[:, 1])
+        else:
+            scores.append(top2[:, 0])
+    return torch.minimum(scores[0], scores[1])
\ No newline at end of file
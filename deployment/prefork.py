@@ -0,0 +1,242 @@
+"""
+Pre-fork serving: load the model once, fork N workers that share it.
+
+    python prefork.py --model_dir model --workers 4 --port 8080
+
+The parent runs model_fn, freezes every loaded module (eval mode, no
+autograd, parameters and buffers moved to shared memory) and the garbage
+collector, then forks workers that accept SageMaker-style requests
+(POST /invocations, GET /ping) on one listening socket. BERT, r3d_18, the
+heads and Whisper exist once in memory instead of once per worker.
+GET /memory reports RSS and PSS for the parent and every worker.
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+
+import torch
+
+from inference import CONCURRENT_REQUESTS, EXECUTOR_MAX_BATCH, input_fn, model_fn, output_fn, predict_fn
+from instrumentation import get_logger, pop_trace, process_memory
+from model_executor import ModelExecutor
+
+logger = get_logger()
+
+
+def shared_modules(model_dict):
+    cascade = model_dict.get('cascade') or {}
+    transcriber = model_dict.get('transcriber')
+    modules = [model_dict['model'], cascade.get('head'), getattr(transcriber, 'model', None)]
+    return [m for m in modules if isinstance(m, torch.nn.Module)]
+
+
+def freeze_for_fork(model_dict):
+    """Make the loaded weights safe to share with forked workers.
+
+    Parameters and buffers move to shared memory, so a worker touching them
+    never copies a page; autograd and the gradient hooks model_fn installs
+    are dropped. gc.freeze() keeps the collector from writing to (and so
+    copying) the pages of every object that existed before the fork.
+    """
+    for module in shared_modules(model_dict):
+        module.eval()
+        for param in module.parameters():
+            param.requires_grad_(False)
+            hooks = getattr(param, '_backward_hooks', None)
+            if hooks:
+                hooks.clear()
+        for tensor in itertools.chain(module.parameters(), module.buffers()):
+            # Whisper's alignment_heads buffer is sparse (and tiny)
+            if not tensor.is_sparse:
+                tensor.share_memory_()
+
+    # The executor's thread would not exist in the workers; each starts its own
+    executor = model_dict.get('executor')
+    if executor is not None:
+        executor.close()
+    model_dict['executor'] = None
+
+    gc.collect()
+    gc.freeze()
+
+
+def child_pids(parent_pid):
+    """Live children of a process (from /proc/<pid>/stat)"""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields resume after ')'
+                fields = f.read().rpartition(')')[2].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent_pid and fields[0] != 'Z':
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def memory_report(parent_pid):
+    """RSS / PSS of the parent and its workers. The sum of RSS counts the
+    shared weights once per process; the sum of PSS counts them once."""
+    processes = [('parent', parent_pid)] + [('worker', pid) for pid in child_pids(parent_pid)]
+    report = {'processes': []}
+    for role, pid in processes:
+        memory = process_memory(pid)
+        if memory is not None:
+            report['processes'].append({'role': role, 'pid': pid, **memory})
+    report['total_rss'] = sum(p['rss'] for p in report['processes'])
+    report['total_pss'] = sum(p['pss'] for p in report['processes'])
+    # What the same workers would use with a private copy of the model each
+    parent = report['processes'][0] if report['processes'] else None
+    workers = len(report['processes']) - 1
+    if parent is not None:
+        report['without_sharing'] = parent['rss'] * workers + sum(
+            p['private'] for p in report['processes'][1:])
+    return report
+
+
+def format_report(report):
+    mb = 1 << 20
+    lines = [f"{p['role']:>6} {p['pid']:>7}: rss {p['rss'] / mb:8.1f} MB  pss {p['pss'] / mb:8.1f} MB  "
+             f"private {p['private'] / mb:8.1f} MB" for p in report['processes']]
+    lines.append(f" total: rss {report['total_rss'] / mb:.1f} MB, pss {report['total_pss'] / mb:.1f} MB"
+                 + (f" (~{report['without_sharing'] / mb:.1f} MB with a model copy per worker)"
+                    if 'without_sharing' in report else ''))
+    return '\n'.join(lines)
+
+
+class InvocationHandler(BaseHTTPRequestHandler):
+    """SageMaker's serving contract on top of inference.py's handlers"""
+
+    def _reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/ping':
+            self._reply(200, b'{}')
+        elif self.path == '/memory':
+            self._reply(200, json.dumps(memory_report(self.server.parent_pid)).encode())
+        else:
+            self._reply(404, b'{"error": "not found"}')
+
+    def do_POST(self):
+        if self.path != '/invocations':
+            self._reply(404, b'{"error": "not found"}')
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        # At most CONCURRENT_REQUESTS requests run at once; the rest wait here
+        with self.server.request_slots:
+            input_data = None
+            try:
+                input_data = input_fn(body, self.headers.get('Content-Type', 'application/json'))
+                prediction = predict_fn(input_data, self.server.model_dict)
+                response = output_fn(prediction, 'application/json').encode()
+            except Exception as e:
+                logger.error(f"Invocation failed: {e}")
+                # Unpins the input and removes the scratch dir, unless the
+                # failing handler already finished the trace
+                trace = pop_trace(input_data.get('request_id')) if input_data else None
+                if trace is not None:
+                    trace.finish(status="error")
+                self._reply(500, json.dumps({'error': str(e)}).encode())
+                return
+        self._reply(200, response)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def _run_worker(server, model_dict, threads):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+    if CONCURRENT_REQUESTS > 1:
+        model_dict['executor'] = ModelExecutor(EXECUTOR_MAX_BATCH)
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+
+def serve(model_dict, workers=2, host='0.0.0.0', port=8080):
+    """Freeze the model, fork the workers and keep them running until
+    SIGTERM / SIGINT. A GPU model is served from this process alone."""
+    server_class = ThreadingHTTPServer if CONCURRENT_REQUESTS > 1 else HTTPServer
+    server = server_class((host, port), InvocationHandler)
+    server.model_dict = model_dict
+    server.request_slots = threading.BoundedSemaphore(max(1, CONCURRENT_REQUESTS))
+    server.parent_pid = os.getpid()
+
+    if model_dict['device'].type != 'cpu':
+        # CUDA does not survive a fork
+        logger.warning("Pre-fork serving needs a CPU model, serving from one process")
+        server.serve_forever()
+        return
+
+    freeze_for_fork(model_dict)
+    threads = max(1, torch.get_num_threads() // workers)
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(server, model_dict, threads)
+        return pid
+
+    running = {spawn() for _ in range(workers)}
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in running:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info(f"Serving on {host}:{port} with {workers} workers "
+                f"({threads} torch threads each)\n{format_report(memory_report(os.getpid()))}")
+
+    while running:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        running.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, starting a new one")
+            time.sleep(1)
+            running.add(spawn())
+    server.server_close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument('--model_dir', type=str, default='model')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', type=str, default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    serve(model_fn(args.model_dir), args.workers, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+S3 input transfers for inference.
+
+One pooled, thread-safe client per process, multipart downloads with
+tuned concurrency, and a bounded on-disk cache of downloaded inputs.
+Downloads can run in the background, so a request can start decoding
+audio (through a presigned URL) before the whole object is on disk.
+
+INFERENCE_S3_ENDPOINT_URL points the client at an S3-compatible stand-in
+(MinIO, moto_server, localstack) for local testing.
+"""
+
+import fcntl
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+MB = 1 << 20
+
+S3_ENDPOINT_URL = os.environ.get('INFERENCE_S3_ENDPOINT_URL') or None
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('INFERENCE_S3_MAX_POOL_CONNECTIONS', '32'))
+# Parts downloaded concurrently per object, and the part size
+S3_TRANSFER_CONCURRENCY = int(os.environ.get('INFERENCE_S3_TRANSFER_CONCURRENCY', '16'))
+S3_CHUNK_BYTES = int(float(os.environ.get('INFERENCE_S3_CHUNK_MB', '8')) * MB)
+# Downloaded inputs kept for repeat requests (0 removes each input after its request)
+INPUT_CACHE_DIR = os.environ.get('INFERENCE_INPUT_CACHE_DIR', '/tmp/input-cache')
+INPUT_CACHE_BYTES = int(float(os.environ.get('INFERENCE_INPUT_CACHE_MB', '4096')) * MB)
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def _forget_client():
+    # A forked child must not share the parent's pooled connections, nor
+    # the parent's input cache state (pins, pending downloads)
+    global _CLIENT, _INPUT_CACHE
+    _CLIENT = None
+    _INPUT_CACHE = None
+
+
+os.register_at_fork(after_in_child=_forget_client)
+
+
+def get_s3_client():
+    """The process-wide S3 client (boto3 clients are thread-safe; creating
+    them is not, and each one opens its own connection pool)"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = boto3.session.Session().client(
+                's3', endpoint_url=S3_ENDPOINT_URL,
+                config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                              retries={'max_attempts': 5, 'mode': 'adaptive'}))
+        return _CLIENT
+
+
+def transfer_config():
+    return TransferConfig(multipart_threshold=S3_CHUNK_BYTES,
+                          multipart_chunksize=S3_CHUNK_BYTES,
+                          max_concurrency=S3_TRANSFER_CONCURRENCY,
+                          use_threads=True)
+
+
+def parse_s3_uri(uri):
+    bucket, _, key = uri[len('s3://'):].partition('/') if uri.startswith('s3://') else ('', '', '')
+    if not bucket or not key:
+        raise ValueError(f"Invalid S3 URI: {uri}")
+    return bucket, key
+
+
+def presigned_url(uri, expires_in=3600):
+    bucket, key = parse_s3_uri(uri)
+    return get_s3_client().generate_presigned_url(
+        'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=expires_in)
+
+
+class Download:
+    """One object's download to a local file, possibly still running"""
+
+    def __init__(self, uri, path):
+        self.uri = uri
+        self.path = path
+        self.error = None
+        self.cached = False
+        # Fetches (in this process) that share the download, each pinning the file
+        self.waiters = 0
+        self.finished = threading.Event()
+
+    @property
+    def url(self):
+        """Presigned URL of the object, to read it before the download ends.
+        Reading it transfers the object a second time."""
+        return presigned_url(self.uri)
+
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self):
+        self.finished.wait()
+        if self.error is not None:
+            raise self.error
+        return self.path
+
+
+class InputCache:
+    """Downloaded inputs on local disk, keyed by URI and ETag and evicted
+    least recently used (by mtime) beyond max_bytes.
+
+    fetch() pins the file until release(), so a request's input is never
+    evicted while it is being decoded; with max_bytes=0 every input is
+    deleted once released. A pin is a shared flock on the file and eviction
+    only deletes files it can lock exclusively, so processes sharing the
+    directory (bulk and pre-fork workers) never delete each other's inputs
+    and max_bytes bounds the directory as a whole. Concurrent fetches of
+    one object within a process share a download.
+    """
+
+    # Partial downloads untouched for this long were left by a dead process
+    STALE_PART_SECONDS = 3600
+
+    def __init__(self, directory=INPUT_CACHE_DIR, max_bytes=INPUT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.pins = {}  # file name -> [count, locked file object]
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+        now = time.time()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if '.part' in name:
+                try:
+                    if now - os.path.getmtime(path) > self.STALE_PART_SECONDS:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        with self.lock:
+            self._evict()
+
+    def _name(self, uri, etag):
+        digest = hashlib.blake2b(f'{uri}\0{etag}'.encode(), digest_size=16).hexdigest()
+        return digest + os.path.splitext(uri)[1]
+
+    def _pin(self, name, count=1):
+        """Pin a cached file (called with the lock held); False when it is
+        not there, e.g. just evicted by another process"""
+        pin = self.pins.get(name)
+        if pin is not None:
+            pin[0] += count
+            return True
+        path = os.path.join(self.directory, name)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return False
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            # Evicted between the open and the lock
+            present = os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+        except FileNotFoundError:
+            present = False
+        if not present:
+            f.close()
+            return False
+        self.pins[name] = [count, f]
+        # Marks the file as recently used
+        os.utime(path)
+        return True
+
+    def fetch(self, uri, background=False):
+        """Download (or reuse) an object; returns its Download, pinned.
+        With background=True the download may still be running."""
+        bucket, key = parse_s3_uri(uri)
+        client = get_s3_client()
+        etag = client.head_object(Bucket=bucket, Key=key)['ETag']
+        name = self._name(uri, etag)
+        path = os.path.join(self.directory, name)
+
+        with self.lock:
+            if name not in self.pending and self._pin(name):
+                self.hits += 1
+                download = Download(uri, path)
+                download.cached = True
+                download.finished.set()
+                return download
+            self.misses += 1
+            download = self.pending.get(name)
+            if download is None:
+                download = self.pending[name] = Download(uri, path)
+                started = True
+            else:
+                started = False
+            download.waiters += 1
+
+        if started:
+            if background:
+                threading.Thread(target=self._download, args=(bucket, key, name, download),
+                                 daemon=True).start()
+            else:
+                self._download(bucket, key, name, download)
+        if not background:
+            download.wait()
+        return download
+
+    def _download(self, bucket, key, name, download):
+        part = f'{download.path}.{uuid.uuid4().hex}.part'
+        try:
+            get_s3_client().download_file(bucket, key, part, Config=transfer_config())
+            os.replace(part, download.path)
+        except Exception as e:
+            download.error = e
+            if os.path.exists(part):
+                os.remove(part)
+        with self.lock:
+            self.pending.pop(name, None)
+            # One pin for every fetch waiting on this download
+            if download.error is None and not self._pin(name, download.waiters):
+                download.error = FileNotFoundError(f"{download.path} was removed after its download")
+            self._evict()
+        download.finished.set()
+
+    def release(self, path):
+        """Unpin a fetched file; it becomes evictable"""
+        name = os.path.basename(path)
+        with self.lock:
+            pin = self.pins.get(name)
+            if pin is None:
+                # Its download failed
+                return
+            pin[0] -= 1
+            if pin[0] <= 0:
+                self.pins.pop(name)
+                pin[1].close()
+            self._evict()
+
+    def _files(self):
+        """(mtime, size, name) of the cached files, from every process"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if '.part' in entry.name or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.name))
+        return files
+
+    def _evict(self):
+        # Called with the lock held
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if name in self.pins:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                total -= size
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Pinned by another process
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            files = self._files()
+            return {'entries': len(files), 'bytes': sum(size for _, size, _ in files),
+                    'pinned': len(self.pins), 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+_INPUT_CACHE = None
+
+
+def get_input_cache():
+    global _INPUT_CACHE
+    with _CLIENT_LOCK:
+        if _INPUT_CACHE is None:
+            _INPUT_CACHE = InputCache()
+        return _INPUT_CACHE
@@ -0,0 +1,82 @@
+# Segmentation policy applied to transcribed segments before scoring. Every
+# scored segment costs a frame decode, a mel extraction and an encoder
+# forward, so very short or back-to-back Whisper segments are merged into
+# their neighbours and (optionally) non-speech segments are dropped.
+
+DEFAULT_SEGMENTATION_POLICY = {
+    # A segment shorter than this, or with fewer words, is merged into a neighbour
+    'min_duration': 1.0,
+    'min_words': 3,
+    # Merged segments never grow beyond this
+    'max_duration': 8.0,
+    # Only segments at most this far apart are merged
+    'max_gap': 0.5,
+    # Drop segments whose Whisper no_speech_prob exceeds this (None keeps all)
+    'max_no_speech_prob': None
+}
+
+
+def make_segmentation_policy(policy=None):
+    """Complete a (possibly partial) policy with the defaults"""
+    config = dict(DEFAULT_SEGMENTATION_POLICY)
+    unknown = set(policy or ()) - set(config)
+    if unknown:
+        raise ValueError(f"Unknown segmentation settings {sorted(unknown)}, "
+                         f"expected some of {list(config)}")
+    config.update(policy or {})
+    for key in ('min_duration', 'max_duration', 'max_gap'):
+        config[key] = float(config[key])
+        if config[key] < 0:
+            raise ValueError(f"Invalid segmentation {key}: {config[key]}")
+    config['min_words'] = int(config['min_words'])
+    if config['max_no_speech_prob'] is not None:
+        config['max_no_speech_prob'] = float(config['max_no_speech_prob'])
+    return config
+
+
+def _is_short(segment, policy):
+    return (segment['end'] - segment['start'] < policy['min_duration'] or
+            len(segment['text'].split()) < policy['min_words'])
+
+
+def _can_merge(first, second, policy):
+    return (second['start'] - first['end'] <= policy['max_gap'] and
+            second['end'] - first['start'] <= policy['max_duration'])
+
+
+def _merge(first, second):
+    merged = dict(first, end=max(first['end'], second['end']),
+                  text=f"{first['text'].strip()} {second['text'].strip()}".strip(),
+                  merged_segments=first.get('merged_segments', 1) + 1)
+    if 'words' in first or 'words' in second:
+        merged['words'] = (first.get('words') or []) + (second.get('words') or [])
+    if 'no_speech_prob' in first and 'no_speech_prob' in second:
+        merged['no_speech_prob'] = min(first['no_speech_prob'], second['no_speech_prob'])
+    return merged
+
+
+def coalesce_segments(segments, policy):
+    """(segments to score, stats). Adjacent segments are merged while one of
+    them is short and the result stays within max_gap / max_duration."""
+    coalesced = []
+    dropped = 0
+    for segment in segments:
+        no_speech = segment.get('no_speech_prob')
+        if (policy['max_no_speech_prob'] is not None and no_speech is not None
+                and no_speech > policy['max_no_speech_prob']):
+            dropped += 1
+            continue
+        previous = coalesced[-1] if coalesced else None
+        if (previous is not None and (_is_short(previous, policy) or _is_short(segment, policy))
+                and _can_merge(previous, segment, policy)):
+            coalesced[-1] = _merge(previous, segment)
+        else:
+            coalesced.append(dict(segment))
+
+    return coalesced, {
+        'input': len(segments),
+        'scored': len(coalesced),
+        'dropped': dropped,
+        'merged': len(segments) - dropped - len(coalesced),
+        'forwards_saved': len(segments) - len(coalesced)
+    }
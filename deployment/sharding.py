@@ -0,0 +1,83 @@
+"""
+Time-window sharding of long videos.
+
+The video is split into overlapping windows that worker processes
+transcribe independently (see inference.sharded_predict). The merged
+transcript keeps one copy of each utterance heard in an overlap, preferring
+the copy that was not cut by a window edge.
+"""
+
+import math
+
+# A segment ending (or starting) this close to an inner window edge may be cut
+EDGE_MARGIN_SECONDS = 1.0
+
+
+def plan_windows(duration, shard_seconds, overlap_seconds):
+    """[(start, end)] windows of about shard_seconds covering [0, duration],
+    neighbours overlapping by overlap_seconds"""
+    count = max(1, math.ceil(duration / shard_seconds))
+    step = duration / count
+    half = overlap_seconds / 2
+    return [(max(0.0, i * step - half), min(duration, (i + 1) * step + half))
+            for i in range(count)]
+
+
+def tag_window_segments(segments, window, duration):
+    """Mark segments that touch an inner edge of their window (possibly cut)"""
+    start, end = window
+    for segment in segments:
+        segment['cut'] = ((start > 0 and segment['start'] <= start + EDGE_MARGIN_SECONDS) or
+                          (end < duration and segment['end'] >= end - EDGE_MARGIN_SECONDS))
+    return segments
+
+
+def _overlap(a, b):
+    return min(a['end'], b['end']) - max(a['start'], b['start'])
+
+
+def merge_window_segments(window_segments):
+    """One time-ordered transcript from per-window segments (video time).
+
+    Two segments overlapping by more than half of the shorter one are the
+    same utterance heard in two windows; the uncut, then longer, copy wins.
+    """
+    merged = []
+    for segment in sorted((s for segments in window_segments for s in segments),
+                          key=lambda s: (s['start'], s['end'])):
+        if merged:
+            last = merged[-1]
+            shorter = min(last['end'] - last['start'], segment['end'] - segment['start'])
+            if _overlap(last, segment) > 0.5 * max(shorter, 1e-6):
+                rank = lambda s: (not s['cut'], s['end'] - s['start'])
+                if rank(segment) > rank(last):
+                    merged[-1] = segment
+                continue
+        merged.append(segment)
+    return [{k: v for k, v in s.items() if k != 'cut'} for s in merged]
+
+
+def split_even(items, parts):
+    """Contiguous, nearly equal slices of items (no empty slices)"""
+    parts = max(1, min(parts, len(items)))
+    size, extra = divmod(len(items), parts)
+    slices, start = [], 0
+    for i in range(parts):
+        stop = start + size + (1 if i < extra else 0)
+        slices.append(items[start:stop])
+        start = stop
+    return [s for s in slices if s]
+
+
+def combine_summaries(summaries):
+    """Per-stage totals summed over worker traces"""
+    combined = {}
+    for summary in summaries:
+        for name, entry in summary.items():
+            total = combined.setdefault(
+                name, {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'peak_rss_bytes': 0})
+            total['count'] += entry['count']
+            total['total_s'] += entry['total_s']
+            total['max_s'] = max(total['max_s'], entry['max_s'])
+            total['peak_rss_bytes'] = max(total['peak_rss_bytes'], entry['peak_rss_bytes'])
+    return combined
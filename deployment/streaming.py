@@ -0,0 +1,170 @@
+"""
+Streaming inference for long videos.
+
+Whisper runs on bounded windows of the audio instead of the whole file, and
+each window's utterances are scored and written out as soon as their
+segments are final: appended to a local JSON Lines file, or as one part
+object per window under an S3 prefix, next to a progress marker.
+"""
+
+import json
+import os
+import time
+import boto3
+from media_decoder import decode_audio
+from transcription import rebase_result
+
+WHISPER_SAMPLE_RATE = 16000
+# Audio transcribed per window (~19 MB of float32 PCM at 5 minutes)
+STREAM_CHUNK_SECONDS = float(os.environ.get('INFERENCE_STREAM_CHUNK_SECONDS', '300'))
+# Local "stream_to" paths from requests resolve under this directory;
+# unset, requests may only stream to s3:// prefixes
+STREAM_DIR = os.environ.get('INFERENCE_STREAM_DIR') or None
+# Segments ending this close to a window's end may be cut mid-utterance;
+# they are transcribed again at the start of the next window
+BOUNDARY_MARGIN_SECONDS = 1.0
+
+
+def transcribe_range(transcriber, video_path, start_time, end_time):
+    """Whisper on one time range of the video, with timestamps relative to
+    the video. Only that range's audio is decoded."""
+    if hasattr(transcriber, 'transcribe_range'):
+        return transcriber.transcribe_range(video_path, start_time, end_time)
+
+    audio = decode_audio(video_path, WHISPER_SAMPLE_RATE, start_time, end_time)
+    if len(audio) == 0:
+        return {'text': '', 'segments': []}
+    return rebase_result(transcriber.transcribe(audio), start_time)
+
+
+def iter_transcript_windows(transcriber, video_path, duration, chunk_seconds=STREAM_CHUNK_SECONDS):
+    """Yield (processed_until, final segments) window by window.
+
+    The next window starts where the last final segment ended, so a segment
+    running into a window's end is transcribed whole in the next one and no
+    segment is emitted twice.
+    """
+    start = 0.0
+    while start < duration:
+        end = min(start + chunk_seconds, duration)
+        segments = transcribe_range(transcriber, video_path, start, end)['segments']
+        if end >= duration:
+            yield duration, segments
+            return
+
+        final = [s for s in segments if s['end'] <= end - BOUNDARY_MARGIN_SECONDS]
+        if final and final[-1]['end'] > start:
+            next_start = final[-1]['end']
+        else:
+            # Nothing ended inside the window (silence, or one segment longer
+            # than the window): take it as transcribed
+            final, next_start = segments, end
+        yield next_start, final
+        start = next_start
+
+
+def iter_segment_windows(segments, chunk_seconds=STREAM_CHUNK_SECONDS):
+    """Caller-supplied segments in the same (processed_until, segments)
+    windows, grouped by the window their end falls in"""
+    window = []
+    window_end = chunk_seconds
+    for segment in segments:
+        if window and segment['end'] > window_end:
+            yield window[-1]['end'], window
+            window = []
+        while segment['end'] > window_end:
+            window_end += chunk_seconds
+        window.append(segment)
+    if window:
+        yield window[-1]['end'], window
+
+
+class JsonlFileSink:
+    """Utterances appended to a local JSON Lines file, progress in
+    <path>.progress.json (replaced atomically)"""
+
+    def __init__(self, path, append=False):
+        self.location = path
+        self.progress_path = f'{path}.progress.json'
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a' if append else 'w')
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def mark(self, progress):
+        tmp_path = f'{self.progress_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, self.progress_path)
+
+    def close(self):
+        self.file.close()
+
+
+class S3PrefixSink:
+    """One JSON Lines object per window under an S3 prefix (part-00000.jsonl,
+    ...), progress in <prefix>/progress.json"""
+
+    def __init__(self, uri, s3_client=None):
+        self.location = uri
+        bucket, _, prefix = uri[len('s3://'):].partition('/')
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+        self.client = s3_client or boto3.client('s3')
+        self.parts = 0
+
+    def _key(self, name):
+        return f'{self.prefix}/{name}' if self.prefix else name
+
+    def write(self, records):
+        if not records:
+            return
+        body = ''.join(json.dumps(record) + '\n' for record in records)
+        self.client.put_object(Bucket=self.bucket, Key=self._key(f'part-{self.parts:05d}.jsonl'),
+                               Body=body.encode(), ContentType='application/x-ndjson')
+        self.parts += 1
+
+    def mark(self, progress):
+        self.client.put_object(Bucket=self.bucket, Key=self._key('progress.json'),
+                               Body=json.dumps({**progress, 'parts': self.parts}).encode(),
+                               ContentType='application/json')
+
+    def close(self):
+        pass
+
+
+def resolve_stream_path(path, stream_dir=STREAM_DIR):
+    """A request's local stream_to path, inside stream_dir or rejected"""
+    if stream_dir is None:
+        raise ValueError("stream_to must be an s3:// prefix (set INFERENCE_STREAM_DIR for local files)")
+    base = os.path.realpath(stream_dir)
+    resolved = os.path.realpath(os.path.join(base, path))
+    if os.path.commonpath([base, resolved]) != base or resolved == base:
+        raise ValueError(f"stream_to must be a file under INFERENCE_STREAM_DIR: {path}")
+    return resolved
+
+
+def open_sink(uri):
+    """The sink for a request's stream_to: an s3:// prefix, or a file
+    under STREAM_DIR"""
+    if uri.startswith('s3://'):
+        return S3PrefixSink(uri)
+    return JsonlFileSink(resolve_stream_path(uri))
+
+
+def progress_marker(request_id, video_path, duration):
+    return {
+        'request_id': request_id,
+        'video_path': video_path,
+        'status': 'running',
+        'duration_s': duration,
+        'processed_until_s': 0.0,
+        'windows': 0,
+        'segments': 0,
+        'utterances': 0,
+        'updated_at': time.time()
+    }
@@ -0,0 +1,157 @@
+import os
+import subprocess
+import tempfile
+import wave
+import numpy as np
+
+# Deterministic synthetic videos for benchmarking: moving shapes plus
+# speech-like audio (harmonic voiced sounds with syllable-rate envelopes)
+# laid out as a known number of utterances separated by silence.
+
+WORDS = ["okay", "yeah", "what", "no", "really", "come", "on", "i", "know",
+         "that", "is", "great", "you", "did", "it", "again", "wait", "seriously"]
+
+
+def utterance_spans(duration, utterances, gap=0.4):
+    """Split [0, duration] into equally long utterances with silent gaps"""
+    if utterances <= 0:
+        return []
+    slot = duration / utterances
+    return [(round(i * slot + gap / 2, 3), round((i + 1) * slot - gap / 2, 3))
+            for i in range(utterances) if slot > gap]
+
+
+def generate_speech_like_audio(duration, sample_rate=16000, utterances=3, seed=0):
+    rng = np.random.default_rng(seed)
+    num_samples = int(duration * sample_rate)
+    t = np.arange(num_samples) / sample_rate
+    waveform = np.zeros(num_samples, dtype=np.float32)
+    spans = utterance_spans(duration, utterances)
+
+    for start, end in spans:
+        begin, stop = int(start * sample_rate), int(end * sample_rate)
+        seg_t = t[begin:stop] - start
+
+        # Slowly drifting pitch contour around a speaker-like f0
+        f0 = rng.uniform(100, 220) * (1 + 0.08 * np.sin(2 * np.pi * 0.7 * seg_t))
+        phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+
+        # Harmonics shaped by two fixed "formant" bumps
+        formants = rng.uniform([500, 1400], [800, 2200])
+        voiced = np.zeros_like(seg_t)
+        for k in range(1, 20):
+            freq = k * f0.mean()
+            if freq > sample_rate / 2 - 500:
+                break
+            gain = sum(np.exp(-((freq - f) / 300) ** 2) for f in formants) + 0.05
+            voiced += gain / k * np.sin(k * phase)
+
+        # ~4 syllables per second
+        envelope = np.clip(np.sin(np.pi * rng.uniform(3.5, 5.0) * seg_t), 0, None) ** 0.6
+        segment = voiced * envelope + 0.01 * rng.standard_normal(seg_t.shape)
+        waveform[begin:stop] = segment / (np.abs(segment).max() + 1e-8) * 0.6
+
+    return waveform, spans
+
+
+def generate_frames(duration, fps, width, height, seed=0):
+    """Yield uint8 BGR frames with a moving disc over a drifting gradient"""
+    rng = np.random.default_rng(seed)
+    num_frames = max(1, int(round(duration * fps)))
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    base_color = rng.uniform(40, 200, size=3)
+    radius = min(width, height) / 6
+
+    for i in range(num_frames):
+        progress = i / max(1, num_frames - 1)
+        frame = np.empty((height, width, 3), dtype=np.float32)
+        gradient = (xs / width + progress) % 1.0
+        for c in range(3):
+            frame[..., c] = base_color[c] * (0.5 + 0.5 * gradient)
+        cx = width * (0.2 + 0.6 * progress)
+        cy = height * (0.5 + 0.25 * np.sin(2 * np.pi * progress))
+        disc = (xs - cx) ** 2 + (ys - cy) ** 2 < radius ** 2
+        frame[disc] = 255 - base_color
+        yield frame.astype(np.uint8)
+
+
+def write_wav(path, waveform, sample_rate=16000):
+    pcm = (np.clip(waveform, -1.0, 1.0) * 32767).astype(np.int16)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+def generate_video(output_path, duration=10.0, width=640, height=360, fps=25,
+                   utterances=3, sample_rate=16000, seed=0):
+    """Render a synthetic mp4 and return its metadata, including the utterance
+    segments (with placeholder text) in the same shape Whisper returns them"""
+    waveform, spans = generate_speech_like_audio(
+        duration, sample_rate=sample_rate, utterances=utterances, seed=seed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_path = os.path.join(tmp_dir, "audio.wav")
+        write_wav(audio_path, waveform, sample_rate)
+
+        process = subprocess.Popen([
+            "ffmpeg", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            "-i", audio_path,
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "veryfast",
+            "-c:a", "aac",
+            "-shortest",
+            output_path
+        ], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            for frame in generate_frames(duration, fps, width, height, seed=seed):
+                process.stdin.write(frame.tobytes())
+        finally:
+            process.stdin.close()
+            process.wait()
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to render synthetic video: {output_path}")
+
+    rng = np.random.default_rng(seed)
+    segments = [{
+        "id": i,
+        "start": start,
+        "end": end,
+        "text": " ".join(rng.choice(WORDS, size=rng.integers(2, 12))).capitalize() + "."
+    } for i, (start, end) in enumerate(spans)]
+
+    return {
+        "path": output_path,
+        "duration": duration,
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "sample_rate": sample_rate,
+        "segments": segments
+    }
+
+
+class SyntheticTranscriber:
+    """Stands in for Whisper by returning the generator's known segments"""
+
+    def __init__(self, segments):
+        self.segments = segments
+
+    def transcribe(self, audio, **kwargs):
+        return {"text": " ".join(s["text"] for s in self.segments),
+                "segments": [dict(s) for s in self.segments],
+                "language": "en"}
+
+    def transcribe_range(self, video_path, start_time, end_time):
+        """Segments heard in [start_time, end_time), cut at the range's edges
+        the way a window of audio cuts them (streaming mode)"""
+        segments = [dict(s, start=max(s["start"], start_time), end=min(s["end"], end_time))
+                    for s in self.segments if s["end"] > start_time and s["start"] < end_time]
+        return {"text": " ".join(s["text"] for s in segments),
+                "segments": segments,
+                "language": "en"}
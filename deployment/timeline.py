@@ -0,0 +1,105 @@
+"""
+Dense emotion / sentiment timeline: fixed windows (e.g. 3 s every 1 s)
+over the whole video instead of one prediction per transcript segment.
+
+Frames and audio are decoded once per block of windows; every window's
+frames and mel features are views into the block's tensors, and windows
+are scored in large batches (see inference.timeline_predict).
+"""
+
+import math
+import os
+import torch
+
+DEFAULT_TIMELINE = {
+    'step': 1.0,
+    'window': 3.0,
+    # Windows scored per forward
+    'batch_size': 32,
+    # Decoded at once; bounds memory for long videos (~90 MB of frames at 30x224x224)
+    'block_seconds': 60.0
+}
+# Upper bounds on what a request may ask for; larger values are clamped
+TIMELINE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_TIMELINE_MAX_BATCH_SIZE', '128'))
+TIMELINE_MAX_BLOCK_SECONDS = float(os.environ.get('INFERENCE_TIMELINE_MAX_BLOCK_SECONDS', '300'))
+
+
+def make_timeline_config(config=None):
+    """Complete a (possibly partial) timeline config with the defaults"""
+    timeline = dict(DEFAULT_TIMELINE)
+    unknown = set(config or ()) - set(timeline)
+    if unknown:
+        raise ValueError(f"Unknown timeline settings {sorted(unknown)}, expected some of {list(timeline)}")
+    timeline.update(config or {})
+    for key in ('step', 'window', 'block_seconds'):
+        timeline[key] = float(timeline[key])
+        if timeline[key] <= 0:
+            raise ValueError(f"Invalid timeline {key}: {timeline[key]}")
+    timeline['batch_size'] = min(max(1, int(timeline['batch_size'])), TIMELINE_MAX_BATCH_SIZE)
+    timeline['block_seconds'] = min(max(timeline['block_seconds'], timeline['step']),
+                                    max(TIMELINE_MAX_BLOCK_SECONDS, timeline['step']))
+    return timeline
+
+
+def window_starts(duration, step, window):
+    """Start times of every full window; one (shorter) window for short videos"""
+    count = max(1, math.floor((duration - window) / step + 1e-9) + 1)
+    return [i * step for i in range(count)]
+
+
+def window_blocks(starts, block_seconds):
+    """Consecutive runs of window starts spanning at most block_seconds"""
+    blocks, block = [], []
+    for start in starts:
+        if block and start - block[0] >= block_seconds:
+            blocks.append(block)
+            block = []
+        block.append(start)
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+def frame_windows(frames, offsets, length):
+    """[n, length, H, W, C] windows of a [N, H, W, C] frame tensor starting at
+    the given frame offsets. Evenly strided offsets give a view (no copy)."""
+    needed = offsets[-1] + length
+    if frames.size(0) < needed:
+        # The stream ended early: repeat the last frame (or black)
+        fill = frames[-1:] if frames.size(0) else torch.zeros(1, *frames.shape[1:], dtype=frames.dtype)
+        frames = torch.cat([frames, fill.expand(needed - frames.size(0), *frames.shape[1:])])
+    stride = offsets[1] - offsets[0] if len(offsets) > 1 else 1
+    if stride > 0 and all(b - a == stride for a, b in zip(offsets, offsets[1:])):
+        views = frames[offsets[0]:].unfold(0, length, stride)[:len(offsets)]
+        return views.permute(0, 4, 1, 2, 3)
+    index = torch.as_tensor(offsets)[:, None] + torch.arange(length)
+    return frames[index]
+
+
+def window_texts(segments, starts, window):
+    """(text, segment index) per window: the text of every transcript
+    segment overlapping it, and the segment overlapping it most (-1: none)"""
+    texts, owners = [], []
+    for start in starts:
+        end = start + window
+        overlapping = [(min(end, s['end']) - max(start, s['start']), i)
+                       for i, s in enumerate(segments) if s['end'] > start and s['start'] < end]
+        texts.append(' '.join(segments[i]['text'].strip() for _, i in overlapping).strip())
+        owners.append(max(overlapping)[1] if overlapping else -1)
+    return texts, owners
+
+
+def columnar_timeline(config, starts, owners, emotion_probs, sentiment_probs,
+                      emotion_labels, sentiment_labels):
+    """Compact column-oriented output: one list per field, probabilities as
+    [windows x classes] rows in label order"""
+    return {
+        'step': config['step'],
+        'window': config['window'],
+        'start': [round(s, 3) for s in starts],
+        'segment': owners,
+        'emotion_labels': emotion_labels,
+        'emotions': [[round(p, 4) for p in row] for row in emotion_probs.tolist()],
+        'sentiment_labels': sentiment_labels,
+        'sentiments': [[round(p, 4) for p in row] for row in sentiment_probs.tolist()]
+    }
@@ -0,0 +1,222 @@
+"""
+Whisper transcription with speed profiles and a persistent transcript cache.
+
+Transcripts are cached by a hash of the decoded 16 kHz audio together with
+the Whisper model and decoding options, so re-scoring a video (e.g. with a
+new sentiment model) never runs ASR again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import whisper
+from media_decoder import decode_audio
+
+SAMPLE_RATE = 16000
+
+_FAST_OPTIONS = {
+    # Segment timestamps only: the word-level DTW alignment is unused
+    'word_timestamps': False,
+    # MELD-style English input: no language detection pass
+    'language': 'en',
+    # Greedy decoding, no temperature fallback re-decodes
+    'temperature': 0.0,
+    # Each 30 s window decoded on its own (also avoids repetition loops)
+    'condition_on_previous_text': False
+}
+
+TRANSCRIPTION_PROFILES = {
+    # Multilingual with language detection, what predict_fn always ran
+    'accurate': {'model': 'base', 'options': {'word_timestamps': True}},
+    # English only: opt in for English-only traffic
+    'fast': {'model': 'base.en', 'options': _FAST_OPTIONS},
+    'fastest': {'model': 'tiny.en', 'options': _FAST_OPTIONS}
+}
+
+TRANSCRIPTION_PROFILE = os.environ.get('INFERENCE_TRANSCRIPTION_PROFILE', 'accurate')
+# Optional override of the profile's Whisper model (tiny, base, small, ...)
+TRANSCRIPTION_MODEL = os.environ.get('INFERENCE_TRANSCRIPTION_MODEL') or None
+# Transcripts persist here across restarts; empty disables the disk cache
+TRANSCRIPT_CACHE_DIR = os.environ.get('INFERENCE_TRANSCRIPT_CACHE_DIR', '/tmp/transcript-cache')
+TRANSCRIPT_CACHE_SIZE = int(os.environ.get('INFERENCE_TRANSCRIPT_CACHE_SIZE', '256'))
+# Disk tier budget; least recently used transcripts are deleted beyond it (0: unbounded)
+TRANSCRIPT_CACHE_BYTES = int(float(os.environ.get('INFERENCE_TRANSCRIPT_CACHE_MB', '512')) * (1 << 20))
+
+
+def transcript_key(audio, model_name, options):
+    """Hash of the PCM samples, the Whisper model and the decoding options"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps({'model': model_name, **options}, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(audio, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def rebase_result(result, offset):
+    """Shift a transcript's timestamps by offset seconds (in place)"""
+    for segment in result['segments']:
+        segment['start'] += offset
+        segment['end'] += offset
+        for word in segment.get('words') or ():
+            word['start'] += offset
+            word['end'] += offset
+    return result
+
+
+class TranscriptCache:
+    """Transcripts by transcript_key: a small in-memory LRU of serialized
+    results over JSON files in cache_dir. Every get returns a fresh copy.
+    Safe to share between request threads. The files are kept within
+    max_disk_bytes, least recently used (by mtime) deleted first."""
+
+    def __init__(self, cache_dir=TRANSCRIPT_CACHE_DIR, max_items=TRANSCRIPT_CACHE_SIZE,
+                 max_disk_bytes=TRANSCRIPT_CACHE_BYTES):
+        self.cache_dir = cache_dir or None
+        self.max_items = max_items
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_bytes = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._prune_disk()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(self.entries[key])
+        if self.cache_dir and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key)) as f:
+                    body = f.read()
+                result = json.loads(body)
+                # Marks the file as recently used for _prune_disk
+                os.utime(self._path(key))
+            except (OSError, ValueError):
+                pass
+            else:
+                with self.lock:
+                    self.disk_hits += 1
+                    self._store(key, body)
+                return result
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        body = json.dumps(result)
+        with self.lock:
+            self._store(key, body)
+        if self.cache_dir:
+            tmp_path = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(body)
+            os.replace(tmp_path, self._path(key))
+            with self.lock:
+                self.disk_bytes += len(body)
+                if self.max_disk_bytes and self.disk_bytes > self.max_disk_bytes:
+                    self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete the least recently used files down to 90% of the budget.
+        Other processes may share the directory, so it is rescanned."""
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if self.max_disk_bytes:
+            for _, size, path in sorted(files):
+                if total <= self.max_disk_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self.disk_bytes = total
+
+    def _store(self, key, body):
+        self.entries[key] = body
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_items:
+            self.entries.popitem(last=False)
+
+
+class Transcriber:
+    """Whisper with the decoding options of one speed profile.
+
+    transcribe takes a path or 16 kHz float32 audio, transcribe_range a time
+    range of a video (timestamps relative to the video). Both decode the
+    audio with ffmpeg, then look the transcript up in the cache first.
+    """
+
+    def __init__(self, profile=TRANSCRIPTION_PROFILE, device='cpu', model_name=TRANSCRIPTION_MODEL,
+                 cache=None):
+        if profile not in TRANSCRIPTION_PROFILES:
+            raise ValueError(f"Unknown transcription profile {profile!r}, "
+                             f"expected one of {sorted(TRANSCRIPTION_PROFILES)}")
+        config = TRANSCRIPTION_PROFILES[profile]
+        self.profile = profile
+        self.model_name = model_name or config['model']
+        # fp16 only where it exists; whisper warns and falls back on CPU
+        self.options = dict(config['options'], fp16=str(device) != 'cpu')
+        self.model = whisper.load_model(self.model_name, device=device)
+        self.cache = cache
+        # Whisper installs kv-cache hooks on the model for every decode, so
+        # concurrent requests take turns (cache hits do not wait)
+        self.lock = threading.Lock()
+
+    def transcribe(self, audio, **options):
+        if isinstance(audio, str):
+            audio = decode_audio(audio, SAMPLE_RATE)
+        return self._transcribe(audio, {**self.options, **options})
+
+    def transcribe_range(self, video_path, start_time, end_time):
+        audio = decode_audio(video_path, SAMPLE_RATE, start_time, end_time)
+        return rebase_result(self._transcribe(audio, self.options), start_time)
+
+    def _transcribe(self, audio, options):
+        key = None
+        if self.cache is not None:
+            key = transcript_key(audio, self.model_name, options)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        if len(audio) == 0:
+            result = {'text': '', 'segments': [], 'language': options.get('language')}
+        else:
+            with self.lock:
+                result = self.model.transcribe(audio, **options)
+            # Plain JSON types only (cached as JSON)
+            result = json.loads(json.dumps(result, default=float))
+
+        if self.cache is not None:
+            self.cache.put(key, result)
+        return result
+
+    def stats(self):
+        if self.cache is None:
+            return None
+        lookups = self.cache.hits + self.cache.disk_hits + self.cache.misses
+        return {
+            'hits': self.cache.hits,
+            'disk_hits': self.cache.disk_hits,
+            'misses': self.cache.misses,
+            'hit_rate': (self.cache.hits + self.cache.disk_hits) / lookups if lookups else 0.0
+        }
@@ -0,0 +1,80 @@
+"""
+Per-sample load time of MeldDataset.
+
+Compares the two-pass reader (cv2 for frames, then librosa for audio), the
+single-pass ffmpeg demux and a second pass served from the decoded clip
+cache, at the given clip geometry.
+
+    python benchmark_dataset.py --data_dir ../dataset/dev --max_samples 64
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+from meld_dataset import MeldDataset
+from clip_config import parse_clip_geometry, clip_config_name
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--data_dir', type=str, default='../dataset/dev')
+    parser.add_argument('--csv', type=str, default='dev_sent_emo.csv')
+    parser.add_argument('--video_dir', type=str, default='dev_splits_complete')
+    parser.add_argument('--clip_geometry', type=str, default='30x224x224')
+    parser.add_argument('--frame_sampling', type=str, default='uniform')
+    parser.add_argument('--max_samples', type=int, default=32)
+    parser.add_argument('--output', type=str, default='dataset_benchmark.json')
+    return parser.parse_args()
+
+
+def time_samples(dataset, count):
+    timings = []
+    for idx in range(count):
+        start = time.perf_counter()
+        sample = dataset[idx]
+        elapsed = (time.perf_counter() - start) * 1000
+        if sample is not None:
+            timings.append(elapsed)
+    return {
+        'samples': len(timings),
+        'mean_ms': float(np.mean(timings)) if timings else 0.0,
+        'median_ms': float(np.median(timings)) if timings else 0.0
+    }
+
+
+def main():
+    args = parse_args()
+    csv_path = os.path.join(args.data_dir, args.csv)
+    video_dir = os.path.join(args.data_dir, args.video_dir)
+
+    results = {}
+    for name, decoder in (('two_pass', 'opencv'), ('single_pass', 'ffmpeg')):
+        clip_config = parse_clip_geometry(
+            args.clip_geometry, sampling=args.frame_sampling, decoder=decoder)
+        # Untimed first sample: lazy imports (librosa/audioread), page cache
+        MeldDataset(csv_path, video_dir, clip_config=clip_config)[0]
+        dataset = MeldDataset(csv_path, video_dir, clip_config=clip_config,
+                              cache_size=args.max_samples)
+        count = min(args.max_samples, len(dataset))
+        results[name] = time_samples(dataset, count)
+        if decoder == 'ffmpeg':
+            results['cached'] = time_samples(dataset, count)
+            results['cached']['hit_rate'] = dataset.clip_cache.hits / max(
+                1, dataset.clip_cache.hits + dataset.clip_cache.misses)
+
+    baseline = results['two_pass']['mean_ms']
+    print(f"\nClip {clip_config_name(clip_config)}")
+    print(f"{'reader':>12s} {'mean ms':>9s} {'median ms':>10s} {'speedup':>8s}")
+    for name, r in results.items():
+        r['speedup'] = baseline / r['mean_ms'] if r['mean_ms'] else 0.0
+        print(f"{name:>12s} {r['mean_ms']:9.1f} {r['median_ms']:10.1f} {r['speedup']:7.2f}x")
+
+    with open(args.output, 'w') as f:
+        json.dump({'clip_config': clip_config, 'results': results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
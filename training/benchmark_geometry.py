@@ -0,0 +1,124 @@
+"""
+Latency and accuracy of the video clip geometries.
+
+Evaluates each checkpoint (trained with train.py --clip_geometry ...) on the
+MELD dev split at the geometry stored in it and reports emotion/sentiment
+accuracy, frame decode time and forward time per sample. Geometries given
+without a checkpoint are timed on a freshly initialised model (latency only).
+
+    python benchmark_geometry.py --checkpoints full/best_model.pth native/best_model.pth
+    python benchmark_geometry.py --geometries 30x224x224,16x112x112 --max_samples 64
+"""
+
+import argparse
+import json
+import os
+import time
+import torch
+from torch.utils.data import DataLoader, Subset
+from sklearn.metrics import accuracy_score
+from meld_dataset import MeldDataset, collate_fn
+from models import MultimodalSentimentModel
+from clip_config import parse_clip_geometry, clip_geometry_name
+from train_cascade import load_full_model, measure_decode_ms
+
+SM_CHANNEL_VALIDATION = os.environ.get('SM_CHANNEL_VALIDATION', '/opt/ml/input/data/validation')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--checkpoints', type=str, nargs='*', default=[])
+    parser.add_argument('--geometries', type=str, default='',
+                        help='Comma separated geometries to time without a checkpoint')
+    parser.add_argument('--val_dir', type=str, default=SM_CHANNEL_VALIDATION)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--max_samples', type=int, default=None)
+    parser.add_argument('--latency_samples', type=int, default=32)
+    parser.add_argument('--output', type=str, default='geometry_benchmark.json')
+    return parser.parse_args()
+
+
+def evaluate_geometry(model, dataset, device, batch_size, latency_samples, with_accuracy):
+    loader = DataLoader(dataset, batch_size=batch_size, collate_fn=collate_fn)
+    emotion_preds, emotion_labels = [], []
+    sentiment_preds, sentiment_labels = [], []
+    forward_s = 0.0
+    samples = 0
+
+    with torch.inference_mode():
+        for batch in loader:
+            text_inputs = {k: v.to(device) for k, v in batch['text_inputs'].items()}
+            video_frames = batch['video_frames'].to(device)
+            audio_features = batch['audio_features'].to(device)
+
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            outputs = model(text_inputs, video_frames, audio_features)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            forward_s += time.perf_counter() - start
+            samples += video_frames.size(0)
+
+            emotion_preds.extend(outputs['emotions'].argmax(1).cpu().tolist())
+            sentiment_preds.extend(outputs['sentiments'].argmax(1).cpu().tolist())
+            emotion_labels.extend(batch['emotion_label'].tolist())
+            sentiment_labels.extend(batch['sentiment_label'].tolist())
+
+    base = dataset.dataset if isinstance(dataset, Subset) else dataset
+    result = {
+        'geometry': clip_geometry_name(model.clip_config),
+        'samples': samples,
+        'frame_decode_ms_per_sample': measure_decode_ms(base, latency_samples),
+        'forward_ms_per_sample': forward_s * 1000 / max(1, samples)
+    }
+    result['total_ms_per_sample'] = result['frame_decode_ms_per_sample'] + result['forward_ms_per_sample']
+    if with_accuracy and samples:
+        result['emotion_accuracy'] = accuracy_score(emotion_labels, emotion_preds)
+        result['sentiment_accuracy'] = accuracy_score(sentiment_labels, sentiment_preds)
+    return result
+
+
+def main():
+    args = parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    runs = [(path, None) for path in args.checkpoints]
+    runs += [(None, parse_clip_geometry(g)) for g in args.geometries.split(',') if g]
+    if not runs:
+        raise SystemExit("Pass --checkpoints and/or --geometries")
+
+    results = []
+    for checkpoint_path, clip_config in runs:
+        if checkpoint_path:
+            model = load_full_model(checkpoint_path, device)
+        else:
+            model = MultimodalSentimentModel(clip_config).to(device)
+            model.eval()
+
+        dataset = MeldDataset(
+            os.path.join(args.val_dir, 'dev_sent_emo.csv'),
+            os.path.join(args.val_dir, 'dev_splits_complete'),
+            clip_config=model.clip_config)
+        if args.max_samples:
+            dataset = Subset(dataset, range(min(args.max_samples, len(dataset))))
+
+        result = evaluate_geometry(model, dataset, device, args.batch_size,
+                                   args.latency_samples, with_accuracy=checkpoint_path is not None)
+        result['checkpoint'] = checkpoint_path
+        results.append(result)
+        print(json.dumps(result))
+
+    print(f"\n{'geometry':>12s} {'decode ms':>10s} {'forward ms':>11s} {'total ms':>9s} {'emotion acc':>12s} {'sentiment acc':>14s}")
+    for r in results:
+        print(f"{r['geometry']:>12s} {r['frame_decode_ms_per_sample']:10.1f} {r['forward_ms_per_sample']:11.1f} "
+              f"{r['total_ms_per_sample']:9.1f} {r.get('emotion_accuracy', float('nan')):12.3f} "
+              f"{r.get('sentiment_accuracy', float('nan')):14.3f}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torchaudio
+
+# Batched audio/video feature extraction. Workers hand over raw waveforms and
+# uint8 frames; mel spectrograms, normalisation, padding and frame scaling run
+# once per batch, on the training device when there is one.
+
+SAMPLE_RATE = 16000
+N_MELS = 64
+N_FFT = 1024
+HOP_LENGTH = 512
+MAX_FRAMES = 300
+
+
+class MelFeatureExtractor(nn.Module):
+    """Mel spectrogram features for a batch of waveforms, identical to the
+    per-sample pipeline (mel, normalise over the whole utterance, then
+    truncate / zero pad to max_frames).
+
+    Each waveform is reflect padded on its own before batching, so the STFT
+    frames near a sample's end see the same context as when it is processed
+    alone and not the zeros of the batch padding.
+    """
+
+    def __init__(self, max_frames=MAX_FRAMES):
+        super().__init__()
+        self.max_frames = max_frames
+        self.mel = torchaudio.transforms.MelSpectrogram(
+            sample_rate=SAMPLE_RATE,
+            n_mels=N_MELS,
+            n_fft=N_FFT,
+            hop_length=HOP_LENGTH,
+            center=False
+        )
+
+    @staticmethod
+    def pad_waveforms(waveforms):
+        """List of 1-D waveforms -> ([B, longest + N_FFT] batch, [B] lengths)"""
+        lengths = torch.tensor([len(w) for w in waveforms], dtype=torch.long)
+        batch = torch.zeros(len(waveforms), int(lengths.max()) + N_FFT)
+        for i, waveform in enumerate(waveforms):
+            waveform = torch.as_tensor(waveform, dtype=torch.float32)
+            batch[i, :len(waveform) + N_FFT] = F.pad(
+                waveform[None, None], (N_FFT // 2, N_FFT // 2), mode='reflect')[0, 0]
+        return batch, lengths
+
+    def forward(self, waveforms, lengths):
+        """[B, samples] padded waveforms -> [B, 1, n_mels, max_frames]"""
+        mel_spec = self.mel(waveforms)
+        return self.normalize(mel_spec, lengths.to(mel_spec.device) // HOP_LENGTH + 1)
+
+    def windows(self, waveform, starts, window_samples):
+        """Features of fixed-length windows of one waveform from a single STFT.
+
+        Each window is a view of the whole waveform's mel frames, from the
+        hop nearest its start (a sample offset), normalised on its own.
+        Only the frames at a window's edges differ from processing the
+        window alone, where they would see reflection padding.
+        """
+        waveform = torch.as_tensor(waveform, dtype=torch.float32)
+        mode = 'reflect' if len(waveform) > N_FFT // 2 else 'constant'
+        padded = F.pad(waveform[None, None], (N_FFT // 2, N_FFT // 2), mode=mode)[0, 0]
+        mel_spec = self.mel(padded.to(self.mel.spectrogram.window.device))
+
+        length = window_samples // HOP_LENGTH + 1
+        first = torch.round(torch.as_tensor(starts, dtype=torch.float64) / HOP_LENGTH).long()
+        first = first.clamp(0, mel_spec.size(-1) - 1).to(mel_spec.device)
+        frames = (mel_spec.size(-1) - first).clamp(max=length)
+        views = F.pad(mel_spec, (0, length)).unfold(-1, length, 1)  # [n_mels, T, length]
+        return self.normalize(views[:, first].transpose(0, 1), frames)
+
+    def normalize(self, mel_spec, frames):
+        """[B, n_mels, T] mel frames with `frames` valid per row ->
+        [B, 1, n_mels, max_frames]"""
+        mask = (torch.arange(mel_spec.size(-1), device=mel_spec.device)[None] < frames[:, None])
+        mask = mask[:, None, :].to(mel_spec.dtype)
+
+        # Mean / unbiased std over each utterance's valid frames
+        count = frames.to(mel_spec.dtype) * mel_spec.size(1)
+        mean = (mel_spec * mask).sum(dim=(1, 2)) / count
+        centered = (mel_spec - mean[:, None, None]) * mask
+        std = ((centered ** 2).sum(dim=(1, 2)) / (count - 1)).sqrt()
+        mel_spec = centered / std[:, None, None]
+
+        if mel_spec.size(-1) < self.max_frames:
+            mel_spec = F.pad(mel_spec, (0, self.max_frames - mel_spec.size(-1)))
+        return mel_spec[:, None, :, :self.max_frames]
+
+
+_EXTRACTORS = {}
+
+
+def get_mel_extractor(device=None):
+    """One cached extractor (and mel filterbank) per device"""
+    device = torch.device(device or 'cpu')
+    if device not in _EXTRACTORS:
+        # setdefault: threads racing here all end up with the same extractor
+        return _EXTRACTORS.setdefault(device, MelFeatureExtractor().to(device))
+    return _EXTRACTORS[device]
+
+
+def scale_frames(frames):
+    """uint8 [B, T, H, W, C] -> float [B, T, C, H, W] in [0, 1]"""
+    return frames.permute(0, 1, 4, 2, 3).contiguous().float().mul_(1.0 / 255.0)
+
+
+def featurize_batch(batch, device=None):
+    """Turn a raw batch (waveforms + uint8 frames) into model inputs on device.
+    Batches that already carry features are only moved."""
+    device = torch.device(device or 'cpu')
+    if 'waveforms' in batch:
+        waveforms = batch.pop('waveforms').to(device, non_blocking=True)
+        lengths = batch.pop('waveform_lengths')
+        with torch.no_grad():
+            batch['audio_features'] = get_mel_extractor(device)(waveforms, lengths)
+    if 'video_frames' in batch and batch['video_frames'].dtype == torch.uint8:
+        batch['video_frames'] = scale_frames(batch['video_frames'].to(device, non_blocking=True))
+    return batch
@@ -1,24 +1,73 @@
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler
+from torch.nn.utils.rnn import pad_sequence
 import os
 import json
+from collections import OrderedDict
 import pandas as pd
 from transformers import AutoTokenizer
-import cv2
 import torch
-import numpy as np
 import subprocess
-import torchaudio
 import librosa
+from clip_config import make_clip_config
+from frame_sampling import load_clip_frames, decode_clip_frames, pad_frames, load_clip
+from features import MelFeatureExtractor, featurize_batch
+from media_decoder import decode_audio
 
 os.environ['TOKENIZERS_PARALLELISM'] = 'false'
 
+# bert-base-uncased [PAD]; batches are padded to their longest utterance
+PAD_TOKEN_ID = 0
+MAX_TOKENS = 128
+
+
+class ClipCache:
+    """Bounded LRU of decoded clips (uint8 frames, waveform) keyed by path.
+
+    Entries are ~4.5 MB at 30x224x224. Evaluation reads the split in order,
+    so the cache only hits if it can hold the whole split.
+    """
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if self.max_items <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_items:
+            self.entries.popitem(last=False)
+
+
 class MeldDataset(Dataset):
     
-    def __init__(self, csv_path, video_dir):
+    def __init__(self, csv_path, video_dir, load_video=True, clip_config=None, cache_size=0):
         self.csv_path = csv_path
+        self.clip_config = make_clip_config(clip_config)
+        # Text/audio-only consumers (e.g. cascade head training) skip frame decoding
+        self.load_video = load_video
+        # Decoded clips kept for repeated passes (dev/test evaluation every epoch)
+        self.clip_cache = ClipCache(cache_size)
         self.data = pd.read_csv(csv_path)
         self.video_dir = video_dir
         self.tokenizer = AutoTokenizer.from_pretrained('bert-base-uncased')
+        # Tokenized once up front, unpadded: collate pads each batch to its
+        # longest utterance and the bucketing sampler needs the lengths
+        self.token_ids = self.tokenizer(
+            [str(u) for u in self.data['Utterance']],
+            truncation=True, max_length=MAX_TOKENS)['input_ids']
+        self.token_lengths = [len(ids) for ids in self.token_ids]
 
         self.emotion_map = {
             'anger':0,
@@ -37,83 +86,37 @@ class MeldDataset(Dataset):
         }
 
     def __load_video_frames__(self,video_path):
-        cap = cv2.VideoCapture(video_path)
-        frames = []
-
         try:
-            if not cap.isOpened():
-                raise ValueError(f"Video not found: {video_path}")
-            
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                raise ValueError(f"Video not found at {video_path}")
-            
-
-            # reset frame to first frame
-            cap.set(cv2.CAP_PROP_POS_FRAMES,0)
-            while len(frames) < 30 and cap.isOpened():
-                ret, frame = cap.read()
-
-                if not ret:
-                    break
-                frame = cv2.resize(frame,(224,224))
-
-                # Normalize values
-                frame = frame/255.0
-
-                frames.append(frame)
-
-            if len(frames) == 0:
-                raise ValueError("No values could be extracted")
-            
-            if len(frames) < 30:
-                frames += [np.zeros_like(frames[0])] * (30 - len(frames))
-            else:
-                frames = frames[:30]
-
-            return torch.FloatTensor(np.array(frames)).permute(0,3,1,2)
-
-
-
+            return load_clip_frames(video_path, self.clip_config)
         except Exception as e:
             raise ValueError(f"video error: {e}")
-        finally:
-            cap.release()
 
 
-    def _extract_audio_features_(self, video_path):
-        try:
+    def _load_clip_(self, video_path):
+        """(uint8 frames or None, 16 kHz waveform) for a clip, decoded once"""
+        cached = self.clip_cache.get(video_path)
+        if cached is not None:
+            return cached
+
+        if self.clip_config['decoder'] == 'ffmpeg':
+            # Same ffmpeg resampling as inference; frames and PCM from one demux
+            if self.load_video:
+                clip = load_clip(video_path, self.clip_config, sample_rate=16000)
+            else:
+                clip = (None, decode_audio(video_path, sample_rate=16000))
+        else:
+            frames = None
+            if self.load_video:
+                try:
+                    frames = decode_clip_frames(video_path, self.clip_config)
+                except Exception as e:
+                    raise ValueError(f"video error: {e}")
             # Use librosa to load audio directly from video file
             waveform, sample_rate = librosa.load(video_path, sr=16000, mono=True)
-            
-            # Convert to torch tensor and add channel dimension
-            waveform = torch.FloatTensor(waveform).unsqueeze(0)
-            
-            # Create mel spectrogram using torchaudio
-            mel_spectogram = torchaudio.transforms.MelSpectrogram(
-                sample_rate=16000,
-                n_mels=64,
-                n_fft=1024,
-                hop_length=512
-            )
-
-            mel_spec = mel_spectogram(waveform)
-
-            # normalize
-            mel_spec = (mel_spec - mel_spec.mean())/mel_spec.std()
-
-            # Pad or truncate to fixed length (300 frames)
-            if mel_spec.size(2) < 300:
-                padding = 300 - mel_spec.size(2)
-                mel_spec = torch.nn.functional.pad(mel_spec, (0, padding))
-            else:
-                mel_spec = mel_spec[:,:,:300]
-                
-            return mel_spec
-        except Exception as e:
-            raise ValueError(f"Audio error: {str(e)}")
-
+            clip = (frames, waveform)
 
+        self.clip_cache.put(video_path, clip)
+        return clip
 
     def  __len__(self):
         return len(self.data)
@@ -135,30 +138,30 @@ class MeldDataset(Dataset):
                 return None
             
             print(f"File Found,{video_filename}")
-            text_inputs = self.tokenizer(row["Utterance"],
-                                        padding = 'max_length',
-                                        truncation = True,
-                                        max_length = 128,
-                                        return_tensors = 'pt'
-                                        )
+            input_ids = torch.tensor(self.token_ids[idx], dtype=torch.long)
             
-            video_frames = self.__load_video_frames__(path)
-
-            audio_features = self._extract_audio_features_(path)
+            # Raw waveform and uint8 frames; mel features and frame scaling
+            # are computed per batch (features.featurize_batch)
+            frames, waveform = self._load_clip_(path)
 
             emotion_label = self.emotion_map[row['Emotion'].lower()]
             sentiment_label = self.sentiment_map[row['Sentiment'].lower()]
 
-            return {
+            sample = {
                         'text_inputs': {
-                            'input_ids': text_inputs['input_ids'].squeeze(),
-                            'attention_mask': text_inputs['attention_mask'].squeeze()
+                            'input_ids': input_ids,
+                            'attention_mask': torch.ones_like(input_ids)
                         },
-                        'video_frames': video_frames,
-                        'audio_features': audio_features,
+                        'waveform': torch.as_tensor(waveform, dtype=torch.float32),
                         'emotion_label': torch.tensor(emotion_label),
                         'sentiment_label': torch.tensor(sentiment_label)
                     }
+
+            if self.load_video:
+                sample['video_frames'] = torch.from_numpy(
+                    pad_frames(frames, self.clip_config['num_frames']))
+
+            return sample
         
         except Exception as e:
             print(f"Error processing {path}: {str(e)}")
@@ -166,37 +169,111 @@ class MeldDataset(Dataset):
         
         # print(video_frames)
 
-def collate_fn(batch):
+class BucketBatchSampler(Sampler):
+    """Batches of utterances with similar token counts, so dynamic padding
+    wastes little. Shuffled pools of pool_batches batches are sorted by
+    length, cut into batches, and the batch order is shuffled again."""
+
+    def __init__(self, lengths, batch_size, shuffle=True, pool_batches=50, drop_last=False):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.pool_size = batch_size * pool_batches
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        if self.shuffle:
+            indices = torch.randperm(len(self.lengths)).tolist()
+        else:
+            indices = list(range(len(self.lengths)))
+
+        batches = []
+        for start in range(0, len(indices), self.pool_size):
+            pool = sorted(indices[start:start + self.pool_size], key=lambda i: self.lengths[i])
+            for i in range(0, len(pool), self.batch_size):
+                batch = pool[i:i + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        return iter(batches)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+def pad_text_inputs(text_inputs):
+    """Pad a list of unpadded {'input_ids', 'attention_mask'} to the longest"""
+    return {
+        'input_ids': pad_sequence([t['input_ids'] for t in text_inputs],
+                                  batch_first=True, padding_value=PAD_TOKEN_ID),
+        'attention_mask': pad_sequence([t['attention_mask'] for t in text_inputs],
+                                       batch_first=True, padding_value=0)
+    }
+
+
+def raw_collate_fn(batch):
+    """Stack samples, padding text and waveforms to the longest in the batch;
+    features are left to featurize_batch (e.g. on the training device)"""
     batch = list(filter(None, batch))
-    return torch.utils.data.dataloader.default_collate(batch)
+    waveforms = [sample.pop('waveform') for sample in batch]
+    text_inputs = pad_text_inputs([sample.pop('text_inputs') for sample in batch])
+    collated = torch.utils.data.dataloader.default_collate(batch)
+    collated['text_inputs'] = text_inputs
+    collated['waveforms'], collated['waveform_lengths'] = MelFeatureExtractor.pad_waveforms(waveforms)
+    return collated
+
+
+def collate_fn(batch):
+    # Batched mel spectrograms and frame scaling on the CPU
+    return featurize_batch(raw_collate_fn(batch))
 
     
 
 
 def prepare_dataloaders(train_csv, train_video_dir,
                         dev_csv, dev_video_dir,
-                        test_csv, test_video_dir, batch_size = 32):
+                        test_csv, test_video_dir, batch_size = 32,
+                        clip_config = None, eval_cache_size = 0,
+                        features_on_device = False, bucket_by_length = True):
+    # On device: the loader yields raw batches, the trainer featurizes them
+    collate = raw_collate_fn if features_on_device else collate_fn
                         
-    train_dataset = MeldDataset(train_csv,train_video_dir)
-    dev_dataset = MeldDataset(dev_csv , dev_video_dir)
-    test_dataset = MeldDataset(test_csv, test_video_dir)
-
-    train_loader = DataLoader(train_dataset,
-                              batch_size = batch_size,
-                              shuffle=True,
-                              num_workers=0,  # Set to 0 for debugging
-                              pin_memory=True,
-                              collate_fn=collate_fn
-                              )
+    train_dataset = MeldDataset(train_csv,train_video_dir, clip_config=clip_config)
+    dev_dataset = MeldDataset(dev_csv , dev_video_dir, clip_config=clip_config,
+                              cache_size=eval_cache_size)
+    test_dataset = MeldDataset(test_csv, test_video_dir, clip_config=clip_config,
+                               cache_size=eval_cache_size)
+
+    if bucket_by_length:
+        # Batches of similar length, padded to their longest utterance
+        train_loader = DataLoader(train_dataset,
+                                  batch_sampler=BucketBatchSampler(
+                                      train_dataset.token_lengths, batch_size),
+                                  num_workers=0,  # Set to 0 for debugging
+                                  pin_memory=True,
+                                  collate_fn=collate
+                                  )
+    else:
+        train_loader = DataLoader(train_dataset,
+                                  batch_size = batch_size,
+                                  shuffle=True,
+                                  num_workers=0,  # Set to 0 for debugging
+                                  pin_memory=True,
+                                  collate_fn=collate
+                                  )
     
     dev_loader = DataLoader(dev_dataset,
                             batch_size = batch_size,
-                            collate_fn=collate_fn)
+                            collate_fn=collate)
 
     
     test_loader = DataLoader(test_dataset,
                              batch_size=batch_size,
-                             collate_fn=collate_fn)
+                             collate_fn=collate)
 
     return train_loader, dev_loader, test_loader
 
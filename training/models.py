@@ -2,10 +2,18 @@ import torch.nn as nn
 from transformers import BertModel
 import torch
 import os
-from meld_dataset import MeldDataset
+import itertools
+import json
+from meld_dataset import MeldDataset, collate_fn
+from features import featurize_batch
 from torchvision import models as vision_models
+from clip_config import make_clip_config
+from embedding_cache import TextEmbeddingCache, token_key, weights_fingerprint
+from concurrent.futures import ThreadPoolExecutor
 from torch.utils.tensorboard import SummaryWriter
 from datetime import datetime
+from contextlib import nullcontext
+from step_profiler import StepProfiler
 
 from sklearn.metrics import precision_score, accuracy_score
 
@@ -18,8 +26,20 @@ class TextEncoder(nn.Module):
             param.requires_grad = False
 
         self.projection = nn.Linear(768, 128)
+        # Opt-in pooler output cache, see enable_cache
+        self.embedding_cache = None
+
+    def enable_cache(self, max_items=8192, spill_dir=None):
+        """Cache BERT pooler outputs by token ids. Only used in eval mode:
+        in train mode BERT's dropout makes the output non-deterministic."""
+        self.embedding_cache = TextEmbeddingCache(max_items, spill_dir)
+        self.embedding_cache.bind(weights_fingerprint(self.bert))
+        return self.embedding_cache
 
     def forward(self, input_ids, attention_mask):
+        if self.embedding_cache is not None and not self.bert.training:
+            return self.projection(self._cached_pooler_output(input_ids, attention_mask))
+
         # Extract BERT embeddings
         outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask)
 
@@ -28,6 +48,30 @@ class TextEncoder(nn.Module):
 
         return self.projection(pooler_output)
 
+    def _cached_pooler_output(self, input_ids, attention_mask):
+        lengths = attention_mask.sum(dim=1).tolist()
+        keys = [token_key(ids[:length]) for ids, length in zip(input_ids.tolist(), lengths)]
+        # One lookup (and at most one BERT row) per distinct utterance in the batch
+        first_row = {}
+        for i, key in enumerate(keys):
+            first_row.setdefault(key, i)
+        pooled = {key: self.embedding_cache.get(key) for key in first_row}
+
+        # BERT only for the misses, padded to the longest of them
+        missing = [key for key, value in pooled.items() if value is None]
+        if missing:
+            rows = [first_row[key] for key in missing]
+            width = max(lengths[i] for i in rows)
+            rows = torch.tensor(rows, device=input_ids.device)
+            outputs = self.bert(input_ids=input_ids[rows, :width],
+                                attention_mask=attention_mask[rows, :width])
+            for row, key in enumerate(missing):
+                pooled[key] = outputs.pooler_output[row]
+                self.embedding_cache.put(key, pooled[key])
+
+        return torch.stack([pooled[key].to(input_ids.device, self.projection.weight.dtype)
+                            for key in keys])
+
 
 class VideoEncoder(nn.Module):
     def __init__(self):
@@ -45,6 +89,7 @@ class VideoEncoder(nn.Module):
         )
 
     def forward(self, x):
+        # Any clip geometry works: r3d_18 ends in adaptive pooling
         # [batch_size, frames, channels, height, width]->[batch_size, channels, frames, height, width]
         x = x.transpose(1, 2)
         return self.backbone(x)
@@ -84,15 +129,41 @@ class AudioEncoder(nn.Module):
         return self.projection(features.squeeze(-1))
 
 
+def encoder_thread_split(total_threads):
+    """Intra-op threads for (text, video, audio) when the encoders run
+    concurrently: video (r3d_18) is the heaviest, text and audio share the rest"""
+    text = max(1, total_threads // 4)
+    audio = max(1, total_threads // 8)
+    return text, max(1, total_threads - text - audio), audio
+
+
+def _in_caller_mode(fn):
+    """Grad / inference mode are thread-local: run fn under the caller's"""
+    grad_enabled = torch.is_grad_enabled()
+    inference = torch.is_inference_mode_enabled()
+
+    def run(*args):
+        with torch.inference_mode(inference), torch.set_grad_enabled(grad_enabled):
+            return fn(*args)
+    return run
+
+
 class MultimodalSentimentModel(nn.Module):
-    def __init__(self):
+    def __init__(self, clip_config=None):
         super().__init__()
 
+        # Video input geometry; saved with the checkpoint
+        self.clip_config = make_clip_config(clip_config)
+
         # Encoders
         self.text_encoder = TextEncoder()
         self.video_encoder = VideoEncoder()
         self.audio_encoder = AudioEncoder()
+        # Opt-in concurrent encoders, see enable_parallel_encoders
+        self.encoder_pools = None
+        self._build_heads()
 
+    def _build_heads(self):
         # Fusion layer
         self.fusion_layer = nn.Sequential(
             nn.Linear(128 * 3, 256),
@@ -116,14 +187,13 @@ class MultimodalSentimentModel(nn.Module):
             nn.Linear(64, 3)  # Negative, positive, neutral
         )
 
-    def forward(self, text_inputs, video_frames, audio_features):
-        text_features = self.text_encoder(
+    def encode_text(self, text_inputs):
+        return self.text_encoder(
             text_inputs['input_ids'],
             text_inputs['attention_mask'],
         )
-        video_features = self.video_encoder(video_frames)
-        audio_features = self.audio_encoder(audio_features)
 
+    def classify(self, text_features, video_features, audio_features, return_features=False):
         # Concatenate multimodal features
         combined_features = torch.cat([
             text_features,
@@ -136,10 +206,236 @@ class MultimodalSentimentModel(nn.Module):
         emotion_output = self.emotion_classifier(fused_features)
         sentiment_output = self.sentiment_classifier(fused_features)
 
-        return {
+        outputs = {
             'emotions': emotion_output,
             'sentiments': sentiment_output
         }
+        if return_features:
+            # Per-modality and fused embeddings, e.g. for the embedding store
+            outputs.update(text_features=text_features, video_features=video_features,
+                           audio_features=audio_features, fused_features=fused_features)
+        return outputs
+
+    def classify_with_features(self, text_features, video_features, audio_features):
+        return self.classify(text_features, video_features, audio_features, return_features=True)
+
+    def enable_parallel_encoders(self, num_threads=None):
+        """Run the text, video and audio encoders concurrently in forward.
+
+        Each encoder gets its own worker thread with a fixed share of the
+        intra-op threads (encoder_thread_split of num_threads, default
+        torch.get_num_threads()), so the three do not oversubscribe the cores.
+        Only pays off on CPU hosts with several cores per model.
+        """
+        self.disable_parallel_encoders()
+        threads = encoder_thread_split(num_threads or torch.get_num_threads())
+        self.encoder_pools = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{name}_encoder',
+                               initializer=torch.set_num_threads, initargs=(count,))
+            for name, count in zip(('text', 'video', 'audio'), threads)
+        ]
+        return threads
+
+    def disable_parallel_encoders(self):
+        if self.encoder_pools is not None:
+            for pool in self.encoder_pools:
+                pool.shutdown()
+            self.encoder_pools = None
+
+    def encode(self, text_inputs, video_frames, audio_features):
+        """(text, video, audio) features, concurrently when enabled"""
+        if self.encoder_pools is None:
+            return (self.encode_text(text_inputs),
+                    self.video_encoder(video_frames),
+                    self.audio_encoder(audio_features))
+
+        encoders = (self.encode_text, self.video_encoder, self.audio_encoder)
+        inputs = (text_inputs, video_frames, audio_features)
+        futures = [pool.submit(_in_caller_mode(encoder), x)
+                   for pool, encoder, x in zip(self.encoder_pools, encoders, inputs)]
+        return tuple(future.result() for future in futures)
+
+    def forward(self, text_inputs, video_frames, audio_features):
+        text_features, video_features, audio_features = self.encode(
+            text_inputs, video_frames, audio_features)
+
+        return self.classify(text_features, video_features, audio_features)
+
+
+class FusionHeads(nn.Module):
+    """The fusion layer and classifier heads of MultimodalSentimentModel
+    without the encoders, to score stored encoder features"""
+
+    HEAD_MODULES = ('fusion_layer', 'emotion_classifier', 'sentiment_classifier')
+
+    def __init__(self):
+        super().__init__()
+        MultimodalSentimentModel._build_heads(self)
+
+    classify = MultimodalSentimentModel.classify
+
+    def forward(self, text_features, video_features, audio_features):
+        return self.classify(text_features, video_features, audio_features)
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        """Heads with the weights of a full model's state dict"""
+        heads = cls()
+        heads.load_state_dict({k: v for k, v in state_dict.items()
+                               if k.split('.')[0] in cls.HEAD_MODULES})
+        return heads
+
+
+class TextAudioHead(nn.Module):
+    """Lightweight emotion/sentiment heads over the text and audio features
+    only, used to skip the video encoder when they are confident enough"""
+
+    def __init__(self):
+        super().__init__()
+        self.fusion_layer = nn.Sequential(
+            nn.Linear(128 * 2, 128),
+            nn.ReLU(),
+            nn.Dropout(0.2)
+        )
+        self.emotion_classifier = nn.Linear(128, 7)
+        self.sentiment_classifier = nn.Linear(128, 3)
+
+    def forward(self, text_features, audio_features):
+        fused_features = self.fusion_layer(
+            torch.cat([text_features, audio_features], dim=1))
+
+        return {
+            'emotions': self.emotion_classifier(fused_features),
+            'sentiments': self.sentiment_classifier(fused_features)
+        }
+
+
+def cascade_confidence(outputs, criterion='margin'):
+    """Per-sample confidence of a cascade prediction: the lower of the
+    emotion and sentiment scores, so both tasks must be confident to skip"""
+    scores = []
+    for key in ('emotions', 'sentiments'):
+        probs = torch.softmax(outputs[key], dim=1)
+        top2 = probs.topk(2, dim=1).values
+        if criterion == 'margin':
+            scores.append(top2[:, 0] - top2[:, 1])
+        else:
+            scores.append(top2[:, 0])
+    return torch.minimum(scores[0], scores[1])
+
+
+def save_checkpoint(model, path):
+    """Save the weights together with the metadata preprocessing depends on"""
+    torch.save({
+        'model_state_dict': model.state_dict(),
+        'clip_config': model.clip_config
+    }, path)
+
+
+def save_heads_checkpoint(heads, path, **metadata):
+    """Save only the fusion layer and classifier heads (a FusionHeads or a
+    sweep replica); FusionHeads.from_state_dict loads them back"""
+    torch.save({'model_state_dict': heads.state_dict(), **metadata}, path)
+
+
+# One replica of a head sweep; a learning_rate of None is the trainer's
+DEFAULT_REPLICA = {
+    'learning_rate': None,
+    'dropout': 0.3,  # fusion layer
+    'head_dropout': 0.2,  # emotion / sentiment classifiers
+    'emotion_weight': 1.0,
+    'sentiment_weight': 1.0,
+    'weight_decay': 1e-5
+}
+
+
+def make_replica_config(config=None, learning_rate=1e-4):
+    config = {**DEFAULT_REPLICA, **(config or {})}
+    unknown = set(config) - set(DEFAULT_REPLICA)
+    if unknown:
+        raise ValueError(f"Unknown sweep settings: {sorted(unknown)}")
+    if config['learning_rate'] is None:
+        config['learning_rate'] = learning_rate
+    return config
+
+
+def parse_sweep(spec, learning_rate=1e-4):
+    """Replica configs from JSON (or a JSON file): a list of configs, or an
+    object of value lists expanded to every combination, e.g.
+    {"learning_rate": [1e-4, 3e-4], "dropout": [0.2, 0.4]}"""
+    if os.path.exists(spec):
+        with open(spec) as f:
+            spec = f.read()
+    spec = json.loads(spec)
+    if isinstance(spec, dict):
+        values = [v if isinstance(v, list) else [v] for v in spec.values()]
+        spec = [dict(zip(spec, combination)) for combination in itertools.product(*values)]
+    return [make_replica_config(config, learning_rate) for config in spec]
+
+
+class GroupedFusionHeads(nn.Module):
+    """K FusionHeads replicas trained side by side on the same features.
+
+    Every replica keeps its own parameters, so it gets its own optimizer,
+    scheduler and checkpoint. The forward stacks them per layer and runs
+    all K replicas in one batched matmul; batch norm statistics and the
+    dropout rates are per replica. Outputs are [K, batch, classes].
+    """
+
+    def __init__(self, configs):
+        super().__init__()
+        self.configs = configs
+        self.replicas = nn.ModuleList(FusionHeads() for _ in configs)
+        self.register_buffer('dropout', torch.tensor(
+            [c['dropout'] for c in configs]).view(-1, 1, 1), persistent=False)
+        self.register_buffer('head_dropout', torch.tensor(
+            [c['head_dropout'] for c in configs]).view(-1, 1, 1), persistent=False)
+
+    def _linear(self, x, layers):
+        # x is [batch, in] (shared by every replica) or [K, batch, in]
+        weight = torch.stack([layer.weight for layer in layers])  # [K, out, in]
+        bias = torch.stack([layer.bias for layer in layers])
+        return torch.matmul(x, weight.transpose(1, 2)) + bias.unsqueeze(1)
+
+    def _batch_norm(self, x, norms):
+        # nn.BatchNorm1d of each replica over its own slice of x
+        if self.training:
+            mean = x.mean(dim=1)
+            var = x.var(dim=1, unbiased=False)
+            with torch.no_grad():
+                n = x.size(1)
+                for k, norm in enumerate(norms):
+                    norm.running_mean.lerp_(mean[k], norm.momentum)
+                    norm.running_var.lerp_(var[k] * n / max(n - 1, 1), norm.momentum)
+                    norm.num_batches_tracked += 1
+        else:
+            mean = torch.stack([norm.running_mean for norm in norms])
+            var = torch.stack([norm.running_var for norm in norms])
+        weight = torch.stack([norm.weight for norm in norms])
+        bias = torch.stack([norm.bias for norm in norms])
+        x = (x - mean.unsqueeze(1)) * torch.rsqrt(var.unsqueeze(1) + norms[0].eps)
+        return x * weight.unsqueeze(1) + bias.unsqueeze(1)
+
+    def _dropout(self, x, p):
+        if not self.training:
+            return x
+        keep = 1.0 - p
+        return x * (torch.rand_like(x) < keep) / keep
+
+    def _head(self, x, name):
+        heads = [getattr(replica, name) for replica in self.replicas]
+        x = self._dropout(torch.relu(self._linear(x, [h[0] for h in heads])), self.head_dropout)
+        return self._linear(x, [h[3] for h in heads])
+
+    def forward(self, text_features, video_features, audio_features):
+        combined = torch.cat([text_features, video_features, audio_features], dim=1)
+        fusion = [replica.fusion_layer for replica in self.replicas]
+        x = self._linear(combined, [f[0] for f in fusion])
+        x = self._dropout(torch.relu(self._batch_norm(x, [f[1] for f in fusion])), self.dropout)
+        return {
+            'emotions': self._head(x, 'emotion_classifier'),
+            'sentiments': self._head(x, 'sentiment_classifier')
+        }
 
 
 def compute_class_weights(dataset):
@@ -189,7 +485,8 @@ def compute_class_weights(dataset):
 
 
 class MultimodalTrainer:
-    def __init__(self, model, train_loader, val_loader, learning_rate=1e-4, max_grad_norm=1.0):
+    def __init__(self, model, train_loader, val_loader, learning_rate=1e-4, max_grad_norm=1.0,
+                 profile=False, profile_wait=1, profile_warmup=1, profile_active=5, sweep=None):
         self.model = model
         self.train_loader = train_loader
         self.val_loader = val_loader
@@ -206,9 +503,18 @@ class MultimodalTrainer:
         timestamp = datetime.now().strftime('%b%d_%H-%M-%S')  # Dec17_14-22-35
         base_dir = '/opt/ml/output/tensorboard' if 'SM_MODEL_DIR' in os.environ else 'runs'
         log_dir = f"{base_dir}/run_{timestamp}"
+        self.log_dir = log_dir
         self.writer = SummaryWriter(log_dir)
         self.global_step = 0
 
+        # Opt-in: profiles one window of training steps into log_dir/profiler
+        self.profiler = StepProfiler(
+            log_dir, self.writer,
+            wait=profile_wait,
+            warmup=profile_warmup,
+            active=profile_active
+        ) if profile else None
+
         # Fix: Reduced learning rates to prevent NaN weights
         self.optimizer = torch.optim.Adam([
             {'params': model.text_encoder.parameters(), 'lr': learning_rate * 0.05},  # 5e-6
@@ -251,6 +557,32 @@ class MultimodalTrainer:
             weight=self.sentiment_weights
         )
 
+        # Opt-in head sweep, see enable_sweep
+        self.sweep = None
+        if sweep:
+            self.enable_sweep(sweep)
+
+    def enable_sweep(self, configs):
+        """Train fusion/head replicas (make_replica_config dicts) instead of
+        the model. The encoders are frozen and run once per batch; their
+        outputs are shared by every replica. train_epoch and evaluate then
+        return one result per replica."""
+        device = next(self.model.parameters()).device
+        self.sweep = GroupedFusionHeads(configs).to(device)
+        self.sweep_optimizers = [
+            torch.optim.Adam(replica.parameters(), lr=config['learning_rate'],
+                             weight_decay=config['weight_decay'])
+            for replica, config in zip(self.sweep.replicas, configs)]
+        self.sweep_schedulers = [
+            torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode="min", factor=0.1, patience=2)
+            for optimizer in self.sweep_optimizers]
+        self.sweep_loss_weights = torch.tensor(
+            [[c['emotion_weight'], c['sentiment_weight']] for c in configs], device=device)
+        self.current_train_losses = None
+        print(f"\nSweeping {len(configs)} fusion/head replicas on frozen encoders:")
+        for k, config in enumerate(configs):
+            print(f"  replica {k}: {config}")
+
     def log_metrics(self, losses, metrics=None, phase="train"):
         if phase == "train":
             self.current_train_losses = losses
@@ -280,71 +612,110 @@ class MultimodalTrainer:
             self.writer.add_scalar(
                 f'{phase}/sentiment_accuracy', metrics['sentiment_accuracy'], self.global_step)
 
+    def _profile_phase(self, name):
+        if self.profiler is not None and self.profiler.active:
+            return self.profiler.phase(name)
+        return nullcontext()
+
     def train_epoch(self):
+        if self.sweep is not None:
+            return self._train_sweep_epoch()
         self.model.train()
         running_loss = {'total': 0, 'emotion': 0, 'sentiment': 0}
 
-        for batch in self.train_loader:
-            device = next(self.model.parameters()).device
-            text_inputs = {
-                'input_ids': batch['text_inputs']['input_ids'].to(device),
-                'attention_mask': batch['text_inputs']['attention_mask'].to(device)
-            }
-            video_frames = batch['video_frames'].to(device)
-            audio_features = batch['audio_features'].to(device)
-            emotion_labels = batch['emotion_label'].to(device)
-            sentiment_labels = batch['sentiment_label'].to(device)
+        if self.profiler is not None:
+            self.profiler.start()
+
+        data_iter = iter(self.train_loader)
+        while True:
+            # Data wait covers the loader (decode + collate) and the copy to device
+            with self._profile_phase('data_wait'):
+                batch = next(data_iter, None)
+                if batch is None:
+                    break
+                device = next(self.model.parameters()).device
+                # Raw batches get their mel features / frame scaling here, on device
+                batch = featurize_batch(batch, device)
+                text_inputs = {
+                    'input_ids': batch['text_inputs']['input_ids'].to(device),
+                    'attention_mask': batch['text_inputs']['attention_mask'].to(device)
+                }
+                video_frames = batch['video_frames'].to(device)
+                audio_features = batch['audio_features'].to(device)
+                emotion_labels = batch['emotion_label'].to(device)
+                sentiment_labels = batch['sentiment_label'].to(device)
+            batch_size = emotion_labels.size(0)
 
             # Zero gradient
             self.optimizer.zero_grad()
 
-            # Forward pass
-            outputs = self.model(text_inputs, video_frames, audio_features)
+            with self._profile_phase('forward'):
+                # Forward pass
+                outputs = self.model(text_inputs, video_frames, audio_features)
 
-            # Check for NaN outputs
-            if torch.isnan(outputs["emotions"]).any() or torch.isnan(outputs["sentiments"]).any():
-                print("❌ NaN detected in model outputs, skipping batch")
+                # Check for NaN outputs
+                if torch.isnan(outputs["emotions"]).any() or torch.isnan(outputs["sentiments"]).any():
+                    print("❌ NaN detected in model outputs, skipping batch")
+                    nan_outputs = True
+                else:
+                    nan_outputs = False
+
+                    # Calculate losses using raw logits
+                    emotion_loss = self.emotion_criterion(
+                        outputs["emotions"], emotion_labels)
+                    sentiment_loss = self.sentiment_criterion(
+                        outputs["sentiments"], sentiment_labels)
+                    total_loss = emotion_loss + sentiment_loss
+
+            if nan_outputs:
+                if self.profiler is not None:
+                    self.profiler.step(batch_size)
                 continue
 
-            # Calculate losses using raw logits
-            emotion_loss = self.emotion_criterion(
-                outputs["emotions"], emotion_labels)
-            sentiment_loss = self.sentiment_criterion(
-                outputs["sentiments"], sentiment_labels)
-            total_loss = emotion_loss + sentiment_loss
-
-            # Backward pass. Calculate gradients
-            total_loss.backward()
-
-            # Check for NaN gradients before clipping
-            for name, param in self.model.named_parameters():
-                if param.grad is not None and torch.isnan(param.grad).any():
-                    print(f"❌ NaN gradient detected in {name}, skipping update")
-                    self.optimizer.zero_grad()
-                    continue
+            with self._profile_phase('backward'):
+                # Backward pass. Calculate gradients
+                total_loss.backward()
+
+            with self._profile_phase('optimizer'):
+                # Check for NaN gradients before clipping
+                for name, param in self.model.named_parameters():
+                    if param.grad is not None and torch.isnan(param.grad).any():
+                        print(f"❌ NaN gradient detected in {name}, skipping update")
+                        self.optimizer.zero_grad()
+                        continue
 
-            # Gradient clipping
-            torch.nn.utils.clip_grad_norm_(
-                self.model.parameters(), max_norm=self.max_grad_norm)
+                # Gradient clipping
+                torch.nn.utils.clip_grad_norm_(
+                    self.model.parameters(), max_norm=self.max_grad_norm)
 
-            self.optimizer.step()
+                self.optimizer.step()
 
-            # Track losses
-            running_loss['total'] += total_loss.item()
-            running_loss['emotion'] += emotion_loss.item()
-            running_loss['sentiment'] += sentiment_loss.item()
+            with self._profile_phase('logging'):
+                # Track losses
+                running_loss['total'] += total_loss.item()
+                running_loss['emotion'] += emotion_loss.item()
+                running_loss['sentiment'] += sentiment_loss.item()
+
+                self.log_metrics({
+                    'total': total_loss.item(),
+                    'emotion': emotion_loss.item(),
+                    'sentiment': sentiment_loss.item()
+                })
 
-            self.log_metrics({
-                'total': total_loss.item(),
-                'emotion': emotion_loss.item(),
-                'sentiment': sentiment_loss.item()
-            })
+            if self.profiler is not None:
+                self.profiler.step(batch_size)
 
             self.global_step += 1
 
+        # A window longer than the epoch is cut short rather than left open
+        if self.profiler is not None:
+            self.profiler.stop()
+
         return {k: v/len(self.train_loader) for k, v in running_loss.items()}
 
     def evaluate(self, data_loader, phase="val"):
+        if self.sweep is not None:
+            return self._evaluate_sweep(data_loader, phase)
         self.model.eval()
         losses = {'total': 0, 'emotion': 0, 'sentiment': 0}
         all_emotion_preds = []
@@ -355,6 +726,7 @@ class MultimodalTrainer:
         with torch.inference_mode():
             for batch in data_loader:
                 device = next(self.model.parameters()).device
+                batch = featurize_batch(batch, device)
                 text_inputs = {
                     'input_ids': batch['text_inputs']['input_ids'].to(device),
                     'attention_mask': batch['text_inputs']['attention_mask'].to(device)
@@ -406,6 +778,12 @@ class MultimodalTrainer:
         if phase == "val":
             self.scheduler.step(avg_loss['total'])
 
+        cache = self.model.text_encoder.embedding_cache
+        if cache is not None:
+            stats = cache.stats()
+            self.writer.add_scalar(f'text_cache/hit_rate/{phase}', stats['hit_rate'], self.global_step)
+            self.writer.add_scalar(f'text_cache/entries/{phase}', stats['entries'], self.global_step)
+
         return avg_loss, {
             'emotion_precision': emotion_precision,
             'emotion_accuracy': emotion_accuracy,
@@ -413,22 +791,143 @@ class MultimodalTrainer:
             'sentiment_accuracy': sentiment_accuracy
         }
 
+    def _sweep_batch(self, batch):
+        """Encoder outputs (computed once, shared by every replica) and labels"""
+        device = next(self.model.parameters()).device
+        batch = featurize_batch(batch, device)
+        text_inputs = {
+            'input_ids': batch['text_inputs']['input_ids'].to(device),
+            'attention_mask': batch['text_inputs']['attention_mask'].to(device)
+        }
+        with torch.no_grad():
+            features = self.model.encode(
+                text_inputs, batch['video_frames'].to(device), batch['audio_features'].to(device))
+        return features, batch['emotion_label'].to(device), batch['sentiment_label'].to(device)
+
+    def _sweep_losses(self, outputs, emotion_labels, sentiment_labels):
+        """[K] emotion and sentiment losses, each as the trainer's criterion
+        computes it for one replica"""
+        def loss(logits, labels, criterion):
+            replicas, batch_size = logits.shape[:2]
+            per_sample = nn.functional.cross_entropy(
+                logits.flatten(0, 1), labels.repeat(replicas), weight=criterion.weight,
+                label_smoothing=criterion.label_smoothing, reduction='none')
+            # Weighted mean, as reduction='mean' with class weights
+            return per_sample.view(replicas, batch_size).sum(dim=1) / criterion.weight[labels].sum()
+
+        return (loss(outputs['emotions'], emotion_labels, self.emotion_criterion),
+                loss(outputs['sentiments'], sentiment_labels, self.sentiment_criterion))
+
+    def _log_sweep(self, phase, losses, metrics=None):
+        for k, replica_losses in enumerate(losses):
+            for name, value in replica_losses.items():
+                self.writer.add_scalar(f'sweep/replica_{k}/loss/{name}/{phase}', value, self.global_step)
+            for name, value in (metrics[k] if metrics else {}).items():
+                self.writer.add_scalar(f'sweep/replica_{k}/{phase}/{name}', value, self.global_step)
+
+    def _train_sweep_epoch(self):
+        # Frozen encoders in eval mode: no dropout, and the text cache applies
+        self.model.eval()
+        self.sweep.train()
+        replicas = len(self.sweep.configs)
+        running = torch.zeros(replicas, 3)
+        skipped = [0] * replicas
+
+        for batch in self.train_loader:
+            features, emotion_labels, sentiment_labels = self._sweep_batch(batch)
+            outputs = self.sweep(*features)
+            emotion_loss, sentiment_loss = self._sweep_losses(outputs, emotion_labels, sentiment_labels)
+            weights = self.sweep_loss_weights
+            total_loss = weights[:, 0] * emotion_loss + weights[:, 1] * sentiment_loss
+
+            # A replica with NaN outputs skips the batch; the others train on
+            finite = torch.isfinite(total_loss)
+            for optimizer in self.sweep_optimizers:
+                optimizer.zero_grad()
+            if finite.any():
+                # Replicas share no parameters: one backward gives each its own gradients
+                total_loss[finite].sum().backward()
+
+            for k, (replica, optimizer) in enumerate(zip(self.sweep.replicas, self.sweep_optimizers)):
+                if not finite[k]:
+                    skipped[k] += 1
+                    continue
+                grad_norm = torch.nn.utils.clip_grad_norm_(
+                    replica.parameters(), max_norm=self.max_grad_norm)
+                if not torch.isfinite(grad_norm):
+                    skipped[k] += 1
+                    continue
+                optimizer.step()
+
+            batch_losses = torch.stack([total_loss, emotion_loss, sentiment_loss], dim=1).detach().cpu()
+            running += torch.where(finite.cpu().unsqueeze(1), batch_losses, torch.zeros_like(batch_losses))
+            self.global_step += 1
+
+        for k, count in enumerate(skipped):
+            if count:
+                print(f"❌ Replica {k} skipped {count} batches with NaN outputs or gradients")
+        running /= len(self.train_loader)
+        self.current_train_losses = [
+            {'total': total, 'emotion': emotion, 'sentiment': sentiment}
+            for total, emotion, sentiment in running.tolist()]
+        self._log_sweep('train', self.current_train_losses)
+        return self.current_train_losses
+
+    def _evaluate_sweep(self, data_loader, phase="val"):
+        self.model.eval()
+        self.sweep.eval()
+        replicas = len(self.sweep.configs)
+        running = torch.zeros(replicas, 3)
+        emotion_preds, sentiment_preds = [], []
+        emotion_labels_all, sentiment_labels_all = [], []
+
+        with torch.inference_mode():
+            for batch in data_loader:
+                features, emotion_labels, sentiment_labels = self._sweep_batch(batch)
+                outputs = self.sweep(*features)
+                emotion_loss, sentiment_loss = self._sweep_losses(outputs, emotion_labels, sentiment_labels)
+                weights = self.sweep_loss_weights
+                total_loss = weights[:, 0] * emotion_loss + weights[:, 1] * sentiment_loss
+                running += torch.stack([total_loss, emotion_loss, sentiment_loss], dim=1).cpu()
+
+                emotion_preds.append(outputs['emotions'].argmax(dim=2).cpu())
+                sentiment_preds.append(outputs['sentiments'].argmax(dim=2).cpu())
+                emotion_labels_all.append(emotion_labels.cpu())
+                sentiment_labels_all.append(sentiment_labels.cpu())
+
+        running /= len(data_loader)
+        losses = [{'total': total, 'emotion': emotion, 'sentiment': sentiment}
+                  for total, emotion, sentiment in running.tolist()]
+        emotion_preds = torch.cat(emotion_preds, dim=1).numpy()
+        sentiment_preds = torch.cat(sentiment_preds, dim=1).numpy()
+        emotion_labels_all = torch.cat(emotion_labels_all).numpy()
+        sentiment_labels_all = torch.cat(sentiment_labels_all).numpy()
+        metrics = [{
+            'emotion_precision': precision_score(emotion_labels_all, emotion_preds[k], average='weighted'),
+            'emotion_accuracy': accuracy_score(emotion_labels_all, emotion_preds[k]),
+            'sentiment_precision': precision_score(sentiment_labels_all, sentiment_preds[k], average='weighted'),
+            'sentiment_accuracy': accuracy_score(sentiment_labels_all, sentiment_preds[k])
+        } for k in range(replicas)]
+
+        self._log_sweep(phase, losses, metrics)
+        if phase == "val":
+            for scheduler, replica_losses in zip(self.sweep_schedulers, losses):
+                scheduler.step(replica_losses['total'])
+        return losses, metrics
+
 
 if __name__ == "__main__":
     dataset = MeldDataset(
         '../dataset/train/train_sent_emo.csv', '../dataset/train/train_splits')
 
-    sample = dataset[0]
+    batch = collate_fn([dataset[0]])
 
     model = MultimodalSentimentModel()
     model.eval()
 
-    text_inputs = {
-        'input_ids': sample['text_inputs']['input_ids'].unsqueeze(0),
-        'attention_mask': sample['text_inputs']['attention_mask'].unsqueeze(0)
-    }
-    video_frames = sample['video_frames'].unsqueeze(0)
-    audio_features = sample['audio_features'].unsqueeze(0)
+    text_inputs = batch['text_inputs']
+    video_frames = batch['video_frames']
+    audio_features = batch['audio_features']
 
     with torch.inference_mode():
         outputs = model(text_inputs, video_frames, audio_features)
@@ -0,0 +1,231 @@
+"""
+Per-component profiler for MultimodalSentimentModel.
+
+Uses forward hooks on the encoders, fusion layer and both heads to report
+FLOPs, wall time, activation memory and parameter bytes for a grid of
+batch sizes and video geometries.
+
+    python profile_model.py --batch_sizes 1,8 --geometries 30x224x224,16x112x112
+"""
+
+import argparse
+import json
+import time
+from collections import defaultdict
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+from models import MultimodalSentimentModel
+
+COMPONENTS = ['text_encoder', 'video_encoder', 'audio_encoder',
+              'fusion_layer', 'emotion_classifier', 'sentiment_classifier']
+
+
+def count_parameters(model):
+    param_dict = {component: 0 for component in COMPONENTS}
+
+    total_params = 0
+    for name, param in model.named_parameters():
+        if param.requires_grad:
+            param_count = param.numel()
+            total_params += param_count
+
+            component = name.split('.')[0]
+            if component in param_dict:
+                param_dict[component] += param_count
+
+    return param_dict, total_params
+
+
+def parameter_bytes(model):
+    """Bytes of all (trainable and frozen) parameters and buffers per component"""
+    sizes = {}
+    for component in COMPONENTS:
+        module = getattr(model, component)
+        tensors = list(module.parameters()) + list(module.buffers())
+        sizes[component] = sum(t.numel() * t.element_size() for t in tensors)
+    return sizes
+
+
+def _tensor_bytes(output):
+    if isinstance(output, torch.Tensor):
+        return output.numel() * output.element_size()
+    if isinstance(output, (list, tuple)):
+        return sum(_tensor_bytes(o) for o in output)
+    if isinstance(output, dict):
+        return sum(_tensor_bytes(o) for o in output.values())
+    if hasattr(output, 'to_tuple'):
+        # transformers ModelOutput
+        return sum(_tensor_bytes(o) for o in output.to_tuple())
+    return 0
+
+
+class ComponentHooks:
+    """Forward hooks measuring wall time per component and the bytes of
+    activations produced by the leaf modules inside it"""
+
+    def __init__(self, model):
+        self.model = model
+        self.sync = torch.cuda.synchronize if torch.cuda.is_available() else (lambda: None)
+        self.handles = []
+        self.reset()
+
+    def reset(self):
+        self.starts = {}
+        self.times = defaultdict(float)
+        self.activation_bytes = defaultdict(int)
+        self.output_bytes = {}
+
+    def __enter__(self):
+        for component in COMPONENTS:
+            module = getattr(self.model, component)
+            self.handles.append(module.register_forward_pre_hook(self._pre_hook(component)))
+            self.handles.append(module.register_forward_hook(self._post_hook(component)))
+            for leaf in module.modules():
+                if not list(leaf.children()):
+                    self.handles.append(leaf.register_forward_hook(self._leaf_hook(component)))
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def _pre_hook(self, component):
+        def hook(module, inputs):
+            self.sync()
+            self.starts[component] = time.perf_counter()
+        return hook
+
+    def _post_hook(self, component):
+        def hook(module, inputs, output):
+            self.sync()
+            self.times[component] += time.perf_counter() - self.starts.pop(component)
+            self.output_bytes[component] = _tensor_bytes(output)
+        return hook
+
+    def _leaf_hook(self, component):
+        def hook(module, inputs, output):
+            self.activation_bytes[component] += _tensor_bytes(output)
+        return hook
+
+
+def make_inputs(batch_size, frames, height, width, seq_len, device):
+    text_inputs = {
+        'input_ids': torch.randint(1000, 2000, (batch_size, seq_len), device=device),
+        'attention_mask': torch.ones(batch_size, seq_len, dtype=torch.long, device=device)
+    }
+    video_frames = torch.rand(batch_size, frames, 3, height, width, device=device)
+    audio_features = torch.randn(batch_size, 1, 64, 300, device=device)
+    return text_inputs, video_frames, audio_features
+
+
+def component_flops(model, inputs):
+    with FlopCounterMode(depth=2, display=False) as counter:
+        model(*inputs)
+    flops = {component: 0 for component in COMPONENTS}
+    for name, counts in counter.get_flop_counts().items():
+        component = name.split('.')[-1]
+        if '.' in name and component in flops:
+            flops[component] = sum(counts.values())
+    return flops
+
+
+def profile_model(model, batch_sizes, geometries, seq_len=128, repeat=3, warmup=1):
+    device = next(model.parameters()).device
+    param_sizes = parameter_bytes(model)
+    results = []
+
+    for frames, height, width in geometries:
+        for batch_size in batch_sizes:
+            inputs = make_inputs(batch_size, frames, height, width, seq_len, device)
+
+            with torch.inference_mode():
+                flops = component_flops(model, inputs)
+
+                for _ in range(warmup):
+                    model(*inputs)
+
+                with ComponentHooks(model) as hooks:
+                    for _ in range(repeat):
+                        model(*inputs)
+
+            for component in COMPONENTS:
+                results.append({
+                    'component': component,
+                    'batch_size': batch_size,
+                    'geometry': f'{frames}x{height}x{width}',
+                    'flops': flops[component],
+                    'time_ms': hooks.times[component] / repeat * 1000,
+                    # Leaf outputs accumulate across repeats
+                    'activation_bytes': hooks.activation_bytes[component] // repeat,
+                    'output_bytes': hooks.output_bytes.get(component, 0),
+                    'param_bytes': param_sizes[component]
+                })
+    return results
+
+
+def format_table(results):
+    header = f"{'geometry':>12s} {'batch':>5s} {'component':20s} {'GFLOPs':>10s} {'time ms':>10s} {'act MB':>9s} {'param MB':>9s} {'time %':>7s}"
+    lines = [header, '-' * len(header)]
+    groups = defaultdict(list)
+    for row in results:
+        groups[(row['geometry'], row['batch_size'])].append(row)
+
+    for (geometry, batch_size), rows in groups.items():
+        total_time = sum(r['time_ms'] for r in rows) or 1.0
+        for row in rows:
+            lines.append(
+                f"{geometry:>12s} {batch_size:5d} {row['component']:20s} "
+                f"{row['flops'] / 1e9:10.2f} {row['time_ms']:10.2f} "
+                f"{row['activation_bytes'] / 1024**2:9.1f} {row['param_bytes'] / 1024**2:9.1f} "
+                f"{row['time_ms'] / total_time:7.1%}")
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def parse_geometry(value):
+    """'30x224x224' -> (frames, height, width)"""
+    frames, height, width = (int(v) for v in value.lower().split('x'))
+    return frames, height, width
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--batch_sizes', type=str, default='1,8')
+    parser.add_argument('--geometries', type=str, default='30x224x224')
+    parser.add_argument('--seq_len', type=int, default=128)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write the results as JSON to this path')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = MultimodalSentimentModel().to(device)
+    model.eval()
+
+    param_dict, total_params = count_parameters(model)
+    print('Trainable parameter count by component:')
+    for component, count in param_dict.items():
+        print(f'{component:20s}: {count:,} parameters')
+    print(f'Total trainable parameters: {total_params:,}\n')
+
+    results = profile_model(
+        model,
+        batch_sizes=[int(b) for b in args.batch_sizes.split(',')],
+        geometries=[parse_geometry(g) for g in args.geometries.split(',')],
+        seq_len=args.seq_len,
+        repeat=args.repeat
+    )
+    print(format_table(results))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'trainable_parameters': param_dict,
+                'total_trainable_parameters': total_params,
+                'results': results
+            }, f, indent=2)
+        print(f'Results written to {args.output}')
@@ -0,0 +1,174 @@
+import json
+import os
+import resource
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import torch
+from torch.profiler import profile, schedule, record_function, ProfilerActivity
+
+
+class StepProfiler:
+    """Opt-in torch.profiler window over MultimodalTrainer training steps.
+
+    Besides the operator-level profile it times each step's phases itself so
+    an epoch can be attributed to data loading, compute or the optimizer.
+    Everything is written under <log_dir>/profiler next to the TensorBoard
+    events.
+    """
+
+    PHASES = ('data_wait', 'forward', 'backward', 'optimizer', 'logging')
+
+    def __init__(self, log_dir, writer, wait=1, warmup=1, active=5,
+                 record_shapes=False, profile_memory=True):
+        self.output_dir = os.path.join(log_dir, 'profiler')
+        self.writer = writer
+        self.wait = wait
+        self.warmup = warmup
+        self.active_steps = active
+        self.record_shapes = record_shapes
+        self.profile_memory = profile_memory
+        self.use_cuda = torch.cuda.is_available()
+
+        self.step_records = []
+        self.done = False
+        self.active = False
+        self._profiler = None
+        self._step_index = 0
+        self._current = None
+
+    @property
+    def total_steps(self):
+        return self.wait + self.warmup + self.active_steps
+
+    def start(self):
+        if self.done or self.active:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        activities = [ProfilerActivity.CPU]
+        if self.use_cuda:
+            activities.append(ProfilerActivity.CUDA)
+            torch.cuda.reset_peak_memory_stats()
+
+        self._profiler = profile(
+            activities=activities,
+            schedule=schedule(wait=self.wait, warmup=self.warmup,
+                              active=self.active_steps, repeat=1),
+            on_trace_ready=self._on_trace_ready,
+            record_shapes=self.record_shapes,
+            profile_memory=self.profile_memory
+        )
+        self._profiler.__enter__()
+        self.active = True
+        self._step_index = 0
+        self._current = defaultdict(float)
+
+    def _sync(self):
+        if self.use_cuda:
+            torch.cuda.synchronize()
+
+    @contextmanager
+    def phase(self, name):
+        self._sync()
+        start = time.perf_counter()
+        try:
+            with record_function(name):
+                yield
+        finally:
+            # A phase that raises (e.g. a skipped OOM batch) still took the time
+            self._sync()
+            self._current[name] += time.perf_counter() - start
+
+    def step(self, batch_size):
+        """Close the current step; stops the profiler once the window is over"""
+        if not self.active:
+            return
+
+        step_time = sum(self._current.values())
+        # Only the active part of the schedule is representative
+        if self._step_index >= self.wait + self.warmup:
+            record = {'step': self._step_index, 'batch_size': batch_size}
+            record.update({f'{name}_ms': self._current[name] * 1000 for name in self.PHASES})
+            record['compute_ms'] = record['forward_ms'] + record['backward_ms']
+            record['step_ms'] = step_time * 1000
+            record['samples_per_sec'] = batch_size / step_time if step_time > 0 else 0.0
+            self.step_records.append(record)
+
+            for name in self.PHASES + ('compute', 'step'):
+                self.writer.add_scalar(
+                    f'profile/{name}_ms', record[f'{name}_ms'], self._step_index)
+            self.writer.add_scalar(
+                'profile/samples_per_sec', record['samples_per_sec'], self._step_index)
+
+        self._current = defaultdict(float)
+        self._profiler.step()
+        self._step_index += 1
+        if self._step_index >= self.total_steps:
+            self.stop()
+
+    def stop(self):
+        if not self.active:
+            return
+        self._profiler.__exit__(None, None, None)
+        self.active = False
+        self.done = True
+        self._write_summary()
+
+    def _on_trace_ready(self, prof):
+        trace_path = os.path.join(self.output_dir, 'trace.json')
+        prof.export_chrome_trace(trace_path)
+        sort_by = 'self_cuda_time_total' if self.use_cuda else 'self_cpu_time_total'
+        with open(os.path.join(self.output_dir, 'operators.txt'), 'w') as f:
+            f.write(prof.key_averages().table(sort_by=sort_by, row_limit=50))
+        print(f"Profiler chrome trace written to {trace_path}")
+
+    def peak_memory(self):
+        peak = {
+            # ru_maxrss is reported in kB on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        }
+        if self.use_cuda:
+            peak['peak_cuda_allocated_mb'] = torch.cuda.max_memory_allocated() / 1024**2
+            peak['peak_cuda_reserved_mb'] = torch.cuda.max_memory_reserved() / 1024**2
+        return peak
+
+    def summary(self):
+        if not self.step_records:
+            return {}
+        count = len(self.step_records)
+        keys = [f'{name}_ms' for name in self.PHASES] + ['compute_ms', 'step_ms']
+        means = {key: sum(r[key] for r in self.step_records) / count for key in keys}
+        total_samples = sum(r['batch_size'] for r in self.step_records)
+        total_time = sum(r['step_ms'] for r in self.step_records) / 1000
+        return {
+            'profiled_steps': count,
+            'mean': means,
+            'share': {key: means[key] / means['step_ms'] if means['step_ms'] else 0.0
+                      for key in keys if key != 'step_ms'},
+            'samples_per_sec': total_samples / total_time if total_time else 0.0,
+            **self.peak_memory()
+        }
+
+    def _write_summary(self):
+        summary = self.summary()
+        with open(os.path.join(self.output_dir, 'steps.json'), 'w') as f:
+            json.dump({'summary': summary, 'steps': self.step_records}, f, indent=2)
+        if not summary:
+            return
+
+        rows = ['| phase | mean ms | share |', '| --- | ---: | ---: |']
+        for name in self.PHASES + ('compute',):
+            rows.append(f"| {name} | {summary['mean'][f'{name}_ms']:.1f} | "
+                        f"{summary['share'][f'{name}_ms']:.1%} |")
+        rows.append(f"| step | {summary['mean']['step_ms']:.1f} | 100% |")
+        table = '\n'.join(rows)
+        footer = f"samples/sec: {summary['samples_per_sec']:.2f}, " + ', '.join(
+            f"{k}: {v:.0f}" for k, v in summary.items() if k.startswith('peak_'))
+
+        with open(os.path.join(self.output_dir, 'summary.md'), 'w') as f:
+            f.write(table + '\n\n' + footer + '\n')
+        self.writer.add_text('profile/summary', table + '\n\n' + footer)
+        print("\nTraining step profile:")
+        print(table)
+        print(footer)
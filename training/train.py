@@ -1,8 +1,9 @@
 from sklearn import metrics as sklearn_metrics
 import torchaudio
 import torch
-from models import MultimodalSentimentModel, MultimodalTrainer
+from models import MultimodalSentimentModel, MultimodalTrainer, parse_sweep, save_checkpoint, save_heads_checkpoint
 from meld_dataset import prepare_dataloaders
+from clip_config import parse_clip_geometry, clip_config_name
 import json
 from tqdm import tqdm
 from install_ffmpeg import install_ffmpeg
@@ -60,6 +61,11 @@ SM_CHANNEL_TEST = os.environ.get('SM_CHANNEL_TEST', '/opt/ml/input/data/test')
 
 os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'expandable_segments:True'
 
+def str2bool(value):
+    # SageMaker passes hyperparameters as strings, e.g. --profile True
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--epochs', type=int, default=20)
@@ -67,13 +73,50 @@ def parse_args():
     parser.add_argument('--learning_rate', type=float, default=1e-4)  # Reduced default
     parser.add_argument('--max_grad_norm', type=float, default=1.0)  # Add gradient clipping
 
+    # Video clip geometry FRAMESxHEIGHTxWIDTH or a preset (e.g. r3d_native = 16x112x112)
+    parser.add_argument('--clip_geometry', type=str, default='30x224x224')
+    # Which frames of each utterance are decoded: head, uniform, stride or motion
+    parser.add_argument('--frame_sampling', type=str, default='uniform')
+    # opencv or ffmpeg (scaling in ffmpeg, frames/audio piped straight into memory)
+    parser.add_argument('--frame_decoder', type=str, default='ffmpeg')
+    # Decoded dev/test clips kept in memory between epochs (~4.5 MB each at
+    # 30x224x224); only useful when it covers the whole dev split
+    parser.add_argument('--eval_cache_size', type=int, default=0)
+    # Mel spectrograms and frame scaling per batch on the training device
+    # (GPU) instead of in the loader's collate
+    parser.add_argument('--features_on_device', type=str2bool, default=True)
+    # Training batches grouped by utterance length (text padded per batch)
+    parser.add_argument('--bucket_by_length', type=str2bool, default=True)
+    # Frozen-BERT embedding cache (eval passes only; 0 disables), optional disk spill
+    parser.add_argument('--text_cache_size', type=int, default=8192)
+    parser.add_argument('--text_cache_dir', type=str, default=None)
+    # Text, video and audio encoders on concurrent threads (CPU training)
+    parser.add_argument('--parallel_encoders', type=str2bool, default=False)
+
+    # Head sweep: JSON (or a JSON file) with a list of replica configs or an
+    # object of value lists, e.g. '{"learning_rate": [1e-4, 3e-4], "dropout": [0.2, 0.4]}'.
+    # Encoders are frozen; only the fusion layer and heads of each replica train
+    parser.add_argument('--sweep', type=str, default=None)
+    # Weights to start from, e.g. the encoders of a previous full run
+    parser.add_argument('--init_checkpoint', type=str, default=None)
+
+    # Opt-in torch.profiler window (written to the TensorBoard log dir)
+    parser.add_argument('--profile', type=str2bool, default=False)
+    parser.add_argument('--profile_wait', type=int, default=1)
+    parser.add_argument('--profile_warmup', type=int, default=1)
+    parser.add_argument('--profile_active', type=int, default=5)
+
     # Data directory
     parser.add_argument('--train_dir', type=str, default=SM_CHANNEL_TRAINING)
     parser.add_argument('--val_dir', type=str, default=SM_CHANNEL_VALIDATION)
     parser.add_argument('--test_dir', type=str, default=SM_CHANNEL_TEST)
     parser.add_argument('--model_dir', type=str, default=SM_MODEL_DIR)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.sweep and not args.init_checkpoint:
+        # The encoders are frozen in a sweep; untrained projections would make it meaningless
+        parser.error("--sweep needs --init_checkpoint with trained encoder weights")
+    return args
 
 def main():
     print()
@@ -88,6 +131,9 @@ def main():
     print(str(torchaudio.list_audio_backends()))
 
     args = parse_args()
+    clip_config = parse_clip_geometry(
+        args.clip_geometry, sampling=args.frame_sampling, decoder=args.frame_decoder)
+    print(f"Clip: {clip_config_name(clip_config)}, decoder {clip_config['decoder']}")
     # Ensure the model directory exists so SageMaker can package artifacts
     os.makedirs(args.model_dir, exist_ok=True)
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -106,16 +152,38 @@ def main():
         dev_video_dir = os.path.join(args.val_dir, 'dev_splits_complete'),
         test_csv = os.path.join(args.test_dir, 'test_sent_emo.csv'),
         test_video_dir = os.path.join(args.test_dir, 'output_repeated_splits_test'),
-        batch_size = args.batch_size
+        batch_size = args.batch_size,
+        clip_config = clip_config,
+        eval_cache_size = args.eval_cache_size,
+        features_on_device = args.features_on_device and torch.cuda.is_available(),
+        bucket_by_length = args.bucket_by_length
     )
 
     print(f'''training dsv path: {os.path.join(args.train_dir, "train_sent_emo.csv")}''')
     print(f'''training video dir: {os.path.join(args.train_dir, "train_splits")}''')
 
-    model = MultimodalSentimentModel().to(device)
+    model = MultimodalSentimentModel(clip_config).to(device)
+    if args.init_checkpoint:
+        checkpoint = torch.load(args.init_checkpoint, map_location=device)
+        model.load_state_dict(checkpoint.get('model_state_dict', checkpoint))
+        print(f"Initialized from {args.init_checkpoint}")
+    if args.text_cache_size > 0:
+        model.text_encoder.enable_cache(args.text_cache_size, args.text_cache_dir)
+    if args.parallel_encoders:
+        print(f"Parallel encoders, intra-op threads (text, video, audio): "
+              f"{model.enable_parallel_encoders()}")
     trainer = MultimodalTrainer(model, train_loader, val_loader, 
                                learning_rate=args.learning_rate, 
-                               max_grad_norm=args.max_grad_norm)
+                               max_grad_norm=args.max_grad_norm,
+                               profile=args.profile,
+                               profile_wait=args.profile_wait,
+                               profile_warmup=args.profile_warmup,
+                               profile_active=args.profile_active,
+                               sweep=parse_sweep(args.sweep, args.learning_rate) if args.sweep else None)
+    if args.sweep:
+        run_sweep(args, model, trainer, val_loader, test_loader)
+        return
+
     best_val_loss = float('inf')
 
     metrics_data = {
@@ -154,7 +222,7 @@ def main():
         # save model
         if val_loss['total'] < best_val_loss:
             best_val_loss = val_loss['total']
-            torch.save(model.state_dict(), os.path.join(
+            save_checkpoint(model, os.path.join(
                 args.model_dir, 'best_model.pth'))
     
     # After training, save the final model
@@ -175,10 +243,70 @@ def main():
         }))
 
     # Always save a final model to trigger SageMaker packaging into model.tar.gz
-    torch.save(model.state_dict(), os.path.join(args.model_dir, 'final_model.pth'))
+    save_checkpoint(model, os.path.join(args.model_dir, 'final_model.pth'))
+
+
+def run_sweep(args, model, trainer, val_loader, test_loader):
+    """Train every replica of the trainer's sweep. Each replica's best heads
+    are saved to replica_<k>_best.pth; the best replica overall becomes
+    best_model.pth / final_model.pth (shared encoders plus its heads).
+
+    Replicas are compared on the unweighted emotion + sentiment loss: their
+    own totals use their own loss weights and are not comparable."""
+    replicas, configs = trainer.sweep.replicas, trainer.sweep.configs
+    results = [{'replica': k, 'config': config, 'best_val_loss': float('inf'), 'best_epoch': None,
+                'checkpoint': os.path.join(args.model_dir, f'replica_{k}_best.pth')}
+               for k, config in enumerate(configs)]
+
+    print(f'Training Epochs: {args.epochs}')
+
+    for epoch in tqdm(range(args.epochs), desc='Epochs'):
+        train_losses = trainer.train_epoch()
+        val_losses, val_metrics = trainer.evaluate(val_loader)
+
+        metrics = []
+        for k, result in enumerate(results):
+            metrics += [
+                {'Name': f'replica_{k} train: loss', 'Value': train_losses[k]['total']},
+                {'Name': f'replica_{k} validation: loss', 'Value': val_losses[k]['total']},
+                {'Name': f'replica_{k} validation:emotion_accuracy', 'Value': val_metrics[k]['emotion_accuracy']},
+                {'Name': f'replica_{k} validation:sentiment_accuracy', 'Value': val_metrics[k]['sentiment_accuracy']}
+            ]
+            val_loss = val_losses[k]['emotion'] + val_losses[k]['sentiment']
+            if val_loss < result['best_val_loss']:
+                result.update(best_val_loss=val_loss, best_epoch=epoch, val_metrics=val_metrics[k])
+                save_heads_checkpoint(replicas[k], result['checkpoint'], sweep_config=configs[k],
+                                      epoch=epoch, val_loss=val_loss,
+                                      clip_config=model.clip_config)
+        print(json.dumps({'metrics': metrics}))
+
+    # Test metrics of the checkpoints that were saved, all replicas in one pass
+    device = next(model.parameters()).device
+    for replica, result in zip(replicas, results):
+        if result['best_epoch'] is not None:
+            replica.load_state_dict(torch.load(result['checkpoint'], map_location=device)['model_state_dict'])
+    print("Evaluating the best checkpoints on the test set...")
+    test_losses, test_metrics = trainer.evaluate(test_loader, phase='test')
+    for result, test_loss, metrics in zip(results, test_losses, test_metrics):
+        if result['best_epoch'] is not None:
+            result.update(test_loss=test_loss['emotion'] + test_loss['sentiment'], test_metrics=metrics)
+
+    ranked = sorted((r for r in results if r['best_epoch'] is not None), key=lambda r: r['best_val_loss'])
+    for result in ranked:
+        print(f"replica {result['replica']}: val loss {result['best_val_loss']:.4f} "
+              f"(epoch {result['best_epoch']}) {result['config']}")
+    with open(os.path.join(args.model_dir, 'sweep_results.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if ranked:
+        best = ranked[0]
+        model.load_state_dict(replicas[best['replica']].state_dict(), strict=False)
+        print(f"Best replica: {best['replica']}, saved as best_model.pth")
+        save_checkpoint(model, os.path.join(args.model_dir, 'best_model.pth'))
+    # Always save a final model to trigger SageMaker packaging into model.tar.gz
+    save_checkpoint(model, os.path.join(args.model_dir, 'final_model.pth'))
 
 
-                
 if __name__ == '__main__':
     main()
     
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""
+Train and calibrate the text+audio cascade head.
+
+The full MultimodalSentimentModel stays frozen; a TextAudioHead is trained
+on its text and audio features, then a confidence threshold is calibrated
+on the MELD dev split so that skipping the video encoder above it costs at
+most --max_accuracy_drop accuracy on either task. The head, threshold and
+report (skip rate, latency saved, accuracy impact) are saved next to the
+model as cascade_head.pth / cascade_report.json.
+
+    python train_cascade.py --model_path model/best_model.pth
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+from meld_dataset import MeldDataset, collate_fn
+from models import MultimodalSentimentModel, TextAudioHead, cascade_confidence
+from clip_config import clip_config_from_checkpoint
+
+SM_MODEL_DIR = os.environ.get('SM_MODEL_DIR', '.')
+SM_CHANNEL_TRAINING = os.environ.get('SM_CHANNEL_TRAINING', '/opt/ml/input/data/training')
+SM_CHANNEL_VALIDATION = os.environ.get('SM_CHANNEL_VALIDATION', '/opt/ml/input/data/validation')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--model_path', type=str, required=True)
+    parser.add_argument('--epochs', type=int, default=15)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--learning_rate', type=float, default=1e-3)
+    parser.add_argument('--criterion', type=str, default='margin',
+                        choices=['margin', 'confidence'])
+    parser.add_argument('--max_accuracy_drop', type=float, default=0.01)
+    parser.add_argument('--latency_samples', type=int, default=32)
+
+    parser.add_argument('--train_dir', type=str, default=SM_CHANNEL_TRAINING)
+    parser.add_argument('--val_dir', type=str, default=SM_CHANNEL_VALIDATION)
+    parser.add_argument('--model_dir', type=str, default=SM_MODEL_DIR)
+    return parser.parse_args()
+
+
+def load_full_model(model_path, device):
+    checkpoint = torch.load(model_path, map_location=device)
+    model = MultimodalSentimentModel(clip_config_from_checkpoint(checkpoint)).to(device)
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        checkpoint = checkpoint['model_state_dict']
+    elif isinstance(checkpoint, dict) and 'state_dict' in checkpoint:
+        checkpoint = checkpoint['state_dict']
+    model.load_state_dict(checkpoint, strict=False)
+    model.eval()
+    for param in model.parameters():
+        param.requires_grad = False
+    return model
+
+
+def collect_features(model, data_loader, device, with_video=False):
+    """Run the frozen encoders once; video only when full-model outputs are needed"""
+    collected = {'text': [], 'audio': [], 'emotion_label': [], 'sentiment_label': [],
+                 'full_emotions': [], 'full_sentiments': []}
+    video_encoder_s = 0.0
+    samples = 0
+
+    with torch.inference_mode():
+        for batch in data_loader:
+            text_inputs = {k: v.to(device) for k, v in batch['text_inputs'].items()}
+            text_features = model.encode_text(text_inputs)
+            audio_features = model.audio_encoder(batch['audio_features'].to(device))
+
+            if with_video:
+                video_frames = batch['video_frames'].to(device)
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                video_features = model.video_encoder(video_frames)
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                video_encoder_s += time.perf_counter() - start
+
+                outputs = model.classify(text_features, video_features, audio_features)
+                collected['full_emotions'].append(outputs['emotions'].cpu())
+                collected['full_sentiments'].append(outputs['sentiments'].cpu())
+
+            collected['text'].append(text_features.cpu())
+            collected['audio'].append(audio_features.cpu())
+            collected['emotion_label'].append(batch['emotion_label'])
+            collected['sentiment_label'].append(batch['sentiment_label'])
+            samples += batch['emotion_label'].size(0)
+
+    features = {k: torch.cat(v) for k, v in collected.items() if v}
+    features['video_encoder_ms_per_sample'] = video_encoder_s * 1000 / max(1, samples)
+    return features
+
+
+def train_head(features, device, epochs, batch_size, learning_rate):
+    head = TextAudioHead().to(device)
+    loader = DataLoader(TensorDataset(
+        features['text'], features['audio'],
+        features['emotion_label'], features['sentiment_label']),
+        batch_size=batch_size, shuffle=True)
+
+    optimizer = torch.optim.Adam(head.parameters(), lr=learning_rate, weight_decay=1e-5)
+    emotion_criterion = nn.CrossEntropyLoss(label_smoothing=0.05)
+    sentiment_criterion = nn.CrossEntropyLoss(label_smoothing=0.05)
+
+    for epoch in range(epochs):
+        head.train()
+        total = 0.0
+        for text_features, audio_features, emotion_labels, sentiment_labels in loader:
+            optimizer.zero_grad()
+            outputs = head(text_features.to(device), audio_features.to(device))
+            loss = emotion_criterion(outputs['emotions'], emotion_labels.to(device)) + \
+                sentiment_criterion(outputs['sentiments'], sentiment_labels.to(device))
+            loss.backward()
+            optimizer.step()
+            total += loss.item()
+        print(f"Cascade epoch {epoch + 1}/{epochs} loss: {total / max(1, len(loader)):.4f}")
+
+    head.eval()
+    return head
+
+
+def calibrate_threshold(scores, cascade_preds, full_preds, labels, max_accuracy_drop):
+    """Lowest threshold (highest skip rate) whose accuracy stays within
+    max_accuracy_drop of the full model on both tasks.
+
+    scores: [N]; *_preds / labels: dicts of [N] arrays keyed by task.
+    """
+    order = np.argsort(-scores)
+    n = len(scores)
+    full_acc = {task: float(np.mean(full_preds[task] == labels[task])) for task in labels}
+
+    # Accuracy when the k most confident samples use the cascade prediction
+    best = {'threshold': float('inf'), 'skipped': 0}
+    cascade_correct = {task: (cascade_preds[task] == labels[task])[order] for task in labels}
+    full_correct = {task: (full_preds[task] == labels[task])[order] for task in labels}
+    for task in labels:
+        cascade_correct[task] = np.concatenate([[0], np.cumsum(cascade_correct[task])])
+        full_correct[task] = np.concatenate([[0], np.cumsum(full_correct[task])])
+
+    for k in range(1, n + 1):
+        # Only cut between distinct scores so the threshold is well defined
+        if k < n and scores[order[k]] == scores[order[k - 1]]:
+            continue
+        ok = True
+        for task in labels:
+            accuracy = (cascade_correct[task][k] + full_correct[task][n] - full_correct[task][k]) / n
+            if full_acc[task] - accuracy > max_accuracy_drop:
+                ok = False
+                break
+        if ok:
+            best = {'threshold': float(scores[order[k - 1]]), 'skipped': k}
+
+    skipped = scores >= best['threshold']
+    accuracy = {task: float(np.mean(np.where(skipped, cascade_preds[task], full_preds[task]) == labels[task]))
+                for task in labels}
+    return {
+        'threshold': best['threshold'],
+        'skip_rate': float(skipped.mean()) if n else 0.0,
+        'full_accuracy': full_acc,
+        'cascade_accuracy': accuracy,
+        'accuracy_delta': {task: accuracy[task] - full_acc[task] for task in labels},
+        'text_audio_only_accuracy': {task: float(np.mean(cascade_preds[task] == labels[task]))
+                                     for task in labels}
+    }
+
+
+def measure_decode_ms(dataset, samples):
+    """Average time to decode one utterance's frames, the other half of the video cost"""
+    timings = []
+    for idx in range(min(samples, len(dataset))):
+        row = dataset.data.iloc[idx]
+        path = os.path.join(
+            dataset.video_dir, f"dia{row['Dialogue_ID']}_utt{row['Utterance_ID']}.mp4")
+        if not os.path.exists(path):
+            continue
+        start = time.perf_counter()
+        try:
+            dataset.__load_video_frames__(path)
+        except ValueError:
+            continue
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.mean(timings)) if timings else 0.0
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.model_dir, exist_ok=True)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = load_full_model(args.model_path, device)
+
+    train_dataset = MeldDataset(
+        os.path.join(args.train_dir, 'train_sent_emo.csv'),
+        os.path.join(args.train_dir, 'train_splits'),
+        load_video=False, clip_config=model.clip_config)
+    dev_dataset = MeldDataset(
+        os.path.join(args.val_dir, 'dev_sent_emo.csv'),
+        os.path.join(args.val_dir, 'dev_splits_complete'),
+        clip_config=model.clip_config)
+
+    print("Extracting text/audio features for the training split...")
+    train_features = collect_features(model, DataLoader(
+        train_dataset, batch_size=args.batch_size, collate_fn=collate_fn), device)
+    head = train_head(train_features, device, args.epochs,
+                      args.batch_size, args.learning_rate)
+
+    print("Scoring the dev split with the full model...")
+    dev_features = collect_features(model, DataLoader(
+        dev_dataset, batch_size=args.batch_size, collate_fn=collate_fn), device, with_video=True)
+
+    with torch.inference_mode():
+        text_features = dev_features['text'].to(device)
+        audio_features = dev_features['audio'].to(device)
+        start = time.perf_counter()
+        cascade_outputs = head(text_features, audio_features)
+        head_ms = (time.perf_counter() - start) * 1000 / max(1, len(text_features))
+        scores = cascade_confidence(cascade_outputs, args.criterion).cpu().numpy()
+
+    labels = {'emotion': dev_features['emotion_label'].numpy(),
+              'sentiment': dev_features['sentiment_label'].numpy()}
+    cascade_preds = {'emotion': cascade_outputs['emotions'].argmax(1).cpu().numpy(),
+                     'sentiment': cascade_outputs['sentiments'].argmax(1).cpu().numpy()}
+    full_preds = {'emotion': dev_features['full_emotions'].argmax(1).numpy(),
+                  'sentiment': dev_features['full_sentiments'].argmax(1).numpy()}
+
+    report = calibrate_threshold(scores, cascade_preds, full_preds, labels, args.max_accuracy_drop)
+    decode_ms = measure_decode_ms(dev_dataset, args.latency_samples)
+    video_ms = decode_ms + dev_features['video_encoder_ms_per_sample']
+    report.update({
+        'criterion': args.criterion,
+        'max_accuracy_drop': args.max_accuracy_drop,
+        'dev_samples': int(len(scores)),
+        'frame_decode_ms_per_sample': decode_ms,
+        'video_encoder_ms_per_sample': dev_features['video_encoder_ms_per_sample'],
+        'cascade_head_ms_per_sample': head_ms,
+        'latency_saved_ms_per_sample': report['skip_rate'] * video_ms - head_ms
+    })
+
+    torch.save({
+        'state_dict': head.state_dict(),
+        'criterion': args.criterion,
+        'threshold': report['threshold'],
+        'report': report
+    }, os.path.join(args.model_dir, 'cascade_head.pth'))
+    with open(os.path.join(args.model_dir, 'cascade_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()